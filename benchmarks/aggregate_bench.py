@@ -0,0 +1,66 @@
+"""
+    Compare per-sample scalar conversion with the batched ``SampleWindow`` stage.
+
+    The scalar path converts each SI7021 temperature code as it arrives and
+    keeps running min/max/sum/sum-of-squares. The batched path stores raw
+    codes and converts and summarises the window in one pass.
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/aggregate_bench.py
+"""
+import math
+import random
+import time
+
+from sensor_app import aggregate
+from sensor_app.aggregate import SampleWindow
+from sensor_app.si7021 import SI7021, TEMPERATURE_SCALE, TEMPERATURE_OFFSET
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+
+def scalar(raw):
+    low = high = None
+    total = total_sq = 0.0
+    for code in raw:
+        value = SI7021.convert_temperature(code)
+        if low is None or value < low:
+            low = value
+        if high is None or value > high:
+            high = value
+        total += value
+        total_sq += value * value
+    mean = total / len(raw)
+    return low, high, mean, math.sqrt(max(total_sq / len(raw) - mean * mean, 0))
+
+
+def batched(raw, use_numpy):
+    window = SampleWindow(len(raw), TEMPERATURE_SCALE, TEMPERATURE_OFFSET, use_numpy=use_numpy)
+    window.extend(raw)
+    return window.summary()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    modes = [False]
+    if aggregate.numpy is not None:
+        modes.append(True)
+    print('{:>10} {:>12} {:>12} {:>12}'.format('samples', 'scalar ms', 'array ms', 'numpy ms'))
+    for size in SIZES:
+        rnd = random.Random(size)
+        raw = [rnd.randrange(24000, 28000) for _ in range(size)]
+        results = [timed(scalar, raw)] + [timed(batched, raw, mode) for mode in modes]
+        cells = ['{:>12.2f}'.format(result * 1e3) for result in results]
+        if len(cells) < 3:
+            cells.append('{:>12}'.format('n/a'))
+        print('{:>10} '.format(size) + ' '.join(cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+    Compare the fan controller against setting ``PwmFan.duty_cycle`` directly.
+
+    Feeds a day of temperatures hovering around a band edge, read every
+    ``--period`` seconds, to the old control, where the setter sleeps through
+    a kick for every duty cycle under 60 and the duty cycle follows the hard
+    band edges, and to ``fan.Fan`` with a ``BandCurve`` of the given
+    hysteresis on a virtual clock. Reports duty cycle changes, PWM writes,
+    kicks and the time the loop is stalled.
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/fan_bench.py --hysteresis 1
+"""
+import argparse
+import bisect
+import math
+import random
+
+from sensor_app.fan import FAN_DUTY_CYCLES, FAN_TEMP_BANDS, KICK_SECONDS, KICK_THRESHOLD, BandCurve, Fan
+from sensor_app.simulation import SimulatedSensorApplication
+
+DAY = 24 * 60 * 60
+
+
+def temperatures(period, edge, seed=0):
+    rand = random.Random(seed)
+    for current_time in range(0, DAY, period):
+        yield current_time, edge + 0.4 * math.sin(current_time * 2 * math.pi / 1800) + rand.gauss(0, 0.15)
+
+
+def run_old(period, edge):
+    changes = writes = kicks = 0
+    last = None
+    for current_time, temp in temperatures(period, edge):
+        duty_cycle = FAN_DUTY_CYCLES[bisect.bisect_right(FAN_TEMP_BANDS, temp)]
+        changes += duty_cycle != last
+        last = duty_cycle
+        if duty_cycle < KICK_THRESHOLD:
+            kicks += 1
+            writes += 1
+        writes += 1
+    return changes, writes, kicks, kicks * KICK_SECONDS
+
+
+def run_new(period, edge, hysteresis, smoothing):
+    app = SimulatedSensorApplication({}, False)
+    fan = Fan(app, lambda duty_cycle: None)
+    curve = BandCurve(hysteresis=hysteresis, smoothing=smoothing)
+    changes = 0
+    last = None
+    for current_time, temp in temperatures(period, edge):
+        app.run_until(current_time)
+        duty_cycle = curve.duty_cycle(temp, current_time)
+        changes += duty_cycle != last
+        last = duty_cycle
+        fan.set(duty_cycle, current_time)
+    # nothing sleeps; the kick ends in an event on the loop
+    return changes, fan.writes, fan.kicks, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--period', type=int, default=60, help='seconds between readings')
+    parser.add_argument('--edge', type=float, default=28, help='band edge the temperature hovers around')
+    parser.add_argument('--hysteresis', type=float, default=1)
+    parser.add_argument('--smoothing', type=float, default=1)
+    args = parser.parse_args()
+
+    print('{0} readings a day around {1:g} C'.format(DAY // args.period, args.edge))
+    print('{0:<22} {1:>8} {2:>8} {3:>8} {4:>14}'.format('control', 'changes', 'writes', 'kicks', 'stalled s/day'))
+    for name, result in (('duty_cycle setter', run_old(args.period, args.edge)),
+                         ('Fan, hysteresis {0:g}'.format(args.hysteresis),
+                          run_new(args.period, args.edge, args.hysteresis, args.smoothing))):
+        print('{0:<22} {1:>8} {2:>8} {3:>8} {4:>14}'.format(name, *result))
+
+
+if __name__ == '__main__':
+    main()
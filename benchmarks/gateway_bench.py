@@ -0,0 +1,106 @@
+"""
+    Estimate the CPU a gateway hosting many logical devices needs.
+
+    Each device is a ``GatewayDevice`` reading a replayed trace, with the
+    adaptive temperature period and deadbands of the example config, on one
+    virtual clock loop publishing to an in-process broker. CPU time spent is
+    divided by the simulated time to give the share of one core the loop
+    would use. Network I/O is not included. ``--slowdown`` scales the result
+    for a slower board; a Raspberry Pi 3 core is roughly ten times slower
+    than a current desktop core.
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/gateway_bench.py --devices 200 --days 1
+"""
+import argparse
+import bisect
+import os
+import tempfile
+import time
+
+from simulation_bench import DAY, load_trace, write_trace
+from sensor_app.device import GatewayDevice
+from sensor_app.simulation import ReplaySensor, SimulatedSensorApplication, load_csv
+
+FAN_TEMP_BANDS = (20, 22, 24, 26)
+FAN_DUTY_CYCLES = (0, 40, 50, 80, 100)
+
+EVENT_PERIODS = {'temperature': 300}
+JITTER = 60 # seconds
+ADAPTIVE_PERIODS = {
+    'temperature': {'min_period': 30, 'max_period': 480, 'rate': 0.005, 'variance': 0.05},
+}
+DEADBANDS = {
+    'temperature': {'absolute': 0.2, 'heartbeat': 900},
+    'humidity': {'percent': 2, 'heartbeat': 900},
+    'fan_duty_cycle': {'heartbeat': 3600, 'retain': True},
+}
+
+
+class ReplayFanDevice(GatewayDevice):
+    """``main_rpi.FanDevice`` with its SI7021 replaced by a trace and no fan."""
+    def __init__(self, host, name, sensor, **kwargs):
+        super(ReplayFanDevice, self).__init__(host, name, **kwargs)
+        self.sensor = sensor
+        self.intern('temperature', 'humidity', 'fan_duty_cycle')
+
+    def init_events(self):
+        self.schedule_reading('temperature', self.event_temperature, run_now=True)
+
+    def event_temperature(self, current_time):
+        temp, humidity = self.sensor.read()
+        self.observe('temperature', temp, current_time)
+        self.publish('temperature', temp)
+        self.publish('humidity', humidity)
+        self.publish('fan_duty_cycle', FAN_DUTY_CYCLES[bisect.bisect_right(FAN_TEMP_BANDS, temp)])
+
+
+def build(trace, devices, adaptive=True):
+    host = SimulatedSensorApplication({}, False, root='gateway')
+    for i in range(devices):
+        sensor = ReplaySensor(trace, host.time, ('temperature', 'humidity'), offset=i * 37)
+        device = ReplayFanDevice(host, 'device-{0:04d}'.format(i), sensor, event_periods=EVENT_PERIODS,
+                                 adaptive_periods=ADAPTIVE_PERIODS if adaptive else None, deadbands=DEADBANDS,
+                                 jitter=JITTER)
+        device.init_events()
+    return host
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--days', type=float, default=1)
+    parser.add_argument('--fixed', action='store_true', help='read on the fixed period, not adaptively')
+    parser.add_argument('--slowdown', type=float, default=10, help='target core speed relative to this one')
+    parser.add_argument('--trace', help='CSV or Parquet trace with time, temperature and humidity columns')
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        try:
+            write_trace(path)
+            trace = load_csv(path)
+        finally:
+            os.remove(path)
+
+    host = build(trace, args.devices, not args.fixed)
+    start = time.process_time()
+    host.run_until(args.days * DAY)
+    cpu = time.process_time() - start
+
+    events = sum(histogram.count for histogram in host.stats.handlers.values())
+    share = 100 * cpu / host.now
+    print('devices {0}, {1:g} simulated days, {2:.2f} s CPU'.format(args.devices, args.days, cpu))
+    print('{0:>10} {1:>10} {2:>10} {3:>12} {4:>10} {5:>12}'.format(
+        'events', 'messages', 'suppressed', 'us/event', 'CPU %', 'CPU % x{0:g}'.format(args.slowdown)))
+    print('{0:>10} {1:>10} {2:>10} {3:>12.1f} {4:>10.3f} {5:>12.3f}'.format(
+        events, host.broker.messages, host.publisher.suppressed, 1000000 * cpu / max(events, 1),
+        share, share * args.slowdown))
+
+
+if __name__ == '__main__':
+    main()
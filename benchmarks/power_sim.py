@@ -0,0 +1,327 @@
+"""
+    Host-side simulation of the ESP8266 firmware's power modes.
+
+    Runs the real ``main.py``, configured as in ``sensor_feed_config.py.template``,
+    against stand-ins for ``machine``, ``utime``, ``network``, ``umqtt`` and
+    the sensor drivers on a virtual clock. Deep
+    sleep restarts ``main.py`` as the board would, with RTC memory and the
+    WiFi cache file preserved. Reports wakes, connections, estimated charge
+    per simulated day and the mean time from each boot to its first publish,
+    from the firmware's own startup report.
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/power_sim.py
+"""
+import contextlib
+import io
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+TEMPLATE = os.path.join(ROOT, 'sensor_feed_config.py.template')
+DAY = 24 * 60 * 60
+
+# Approximate ESP8266 current draw in mA for each state.
+CURRENT_MA = {
+    'radio': 75.0,   # awake with WiFi associated
+    'awake': 15.0,   # awake, modem off
+    'light': 0.9,    # light sleep
+    'deep': 0.02,    # deep sleep
+}
+BOOT_SECONDS = 0.3
+# A connection without a cached access point scans every channel for it, then
+# joins and asks for an address over DHCP. A pinned BSSID and a static address
+# skip the scan and DHCP.
+WIFI_SCAN_SECONDS = 1.5
+WIFI_JOIN_SECONDS = 0.2
+DHCP_SECONDS = 0.3
+MQTT_CONNECT_SECONDS = 0.3
+
+
+class EndOfSimulation(BaseException):
+    pass
+
+
+class DeepSleepReset(BaseException):
+    pass
+
+
+class Board:
+    """Virtual clock, power state and counters shared by the stand-in modules."""
+    def __init__(self, end):
+        self.now = 0.0
+        self.end = end
+        self.radio = False
+        self.charge = dict((state, 0.0) for state in CURRENT_MA)
+        self.rtc_memory = b''
+        self.reset_cause = 0
+        self.boots = 0
+        self.booted_at = 0.0
+        self.wifi_ready_at = None
+        self.first_publish_ms = []
+        self.light_sleeps = 0
+        self.deep_sleeps = 0
+        self.wifi_connects = 0
+        self.mqtt_connects = 0
+        self.publishes = 0
+
+    def advance(self, seconds, state=None):
+        if state is None:
+            state = 'radio' if self.radio else 'awake'
+        seconds = min(seconds, self.end - self.now)
+        self.charge[state] += seconds * CURRENT_MA[state]
+        self.now += seconds
+        if self.now >= self.end:
+            raise EndOfSimulation()
+
+    def online(self):
+        return self.radio and self.wifi_ready_at is not None and self.now >= self.wifi_ready_at
+
+
+def make_modules(board):
+    machine = types.ModuleType('machine')
+    machine.DEEPSLEEP_RESET = 5
+
+    class Pin:
+        OUT = 1
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def on(self):
+            pass
+
+        def off(self):
+            pass
+
+    class RTC:
+        def memory(self, data=None):
+            if data is None:
+                return board.rtc_memory
+            board.rtc_memory = data
+
+    def lightsleep(ms):
+        board.light_sleeps += 1
+        board.advance(ms / 1000.0, 'light')
+
+    def deepsleep(ms):
+        board.deep_sleeps += 1
+        board.radio = False
+        board.advance(ms / 1000.0, 'deep')
+        board.reset_cause = machine.DEEPSLEEP_RESET
+        raise DeepSleepReset()
+
+    machine.Pin = Pin
+    machine.I2C = lambda *args, **kwargs: None
+    machine.RTC = RTC
+    machine.lightsleep = lightsleep
+    machine.deepsleep = deepsleep
+    machine.reset_cause = lambda: board.reset_cause
+
+    utime = types.ModuleType('utime')
+    utime.time = lambda: int(board.now)
+    utime.sleep = lambda seconds: board.advance(seconds)
+    utime.sleep_ms = lambda ms: board.advance(ms / 1000.0)
+    utime.sleep_us = lambda us: board.advance(us / 1e6)
+    utime.ticks_us = lambda: int(board.now * 1e6)
+    utime.ticks_ms = lambda: int((board.now - board.booted_at) * 1000)
+    utime.ticks_diff = lambda end, start: end - start
+    utime.localtime = lambda secs=None: (2020, 1, 1, 0, 0, int(board.now if secs is None else secs), 0, 1)
+
+    network = types.ModuleType('network')
+    network.STA_IF = 0
+    network.STAT_IDLE = 0
+    network.STAT_CONNECTING = 1
+    network.STAT_GOT_IP = 5
+
+    class WLAN:
+        def __init__(self, interface):
+            self.static = False
+            self.ssid = None
+
+        def status(self):
+            if not board.radio:
+                return network.STAT_IDLE
+            return network.STAT_GOT_IP if board.online() else network.STAT_CONNECTING
+
+        def active(self, state):
+            if not state:
+                board.radio = False
+
+        def scan(self):
+            board.radio = True
+            board.advance(WIFI_SCAN_SECONDS)
+            return [(bytes(self.ssid or '', 'utf-8'), b'\x02\x00\x00\x00\x00\x01', 6, -60, 3, False)]
+
+        def connect(self, ssid, password, bssid=None):
+            self.ssid = ssid
+            board.wifi_connects += 1
+            board.radio = True
+            seconds = WIFI_JOIN_SECONDS
+            if bssid is None:
+                seconds += WIFI_SCAN_SECONDS
+            if not self.static:
+                seconds += DHCP_SECONDS
+            board.wifi_ready_at = board.now + seconds
+
+        def disconnect(self):
+            board.radio = False
+
+        def ifconfig(self, config=None):
+            if config is not None:
+                self.static = True
+            return ('10.0.0.2', '255.255.255.0', '10.0.0.1', '10.0.0.1')
+
+    network.WLAN = WLAN
+
+    class MQTTClient:
+        def __init__(self, *args, **kwargs):
+            self.connected = False
+
+        def set_callback(self, callback):
+            pass
+
+        def connect(self):
+            if not board.online():
+                raise OSError('no network')
+            board.mqtt_connects += 1
+            board.advance(MQTT_CONNECT_SECONDS)
+            self.connected = True
+
+        def disconnect(self):
+            self.connected = False
+
+        def subscribe(self, topic):
+            pass
+
+        def publish(self, topic, msg, retain=False, qos=0):
+            if not (self.connected and board.online()):
+                raise OSError('not connected')
+            board.publishes += 1
+            if topic.endswith(b'/startup'):
+                board.first_publish_ms.append(json.loads(msg)['first_publish'])
+
+        def check_msg(self):
+            if not (self.connected and board.online()):
+                raise OSError('not connected')
+
+    umqtt = types.ModuleType('umqtt')
+    umqtt_simple = types.ModuleType('umqtt.simple')
+    umqtt_simple.MQTTClient = MQTTClient
+    umqtt.simple = umqtt_simple
+
+    ntptime = types.ModuleType('ntptime')
+    ntptime.settime = lambda: None
+
+    bme280 = types.ModuleType('bme280')
+
+    class BME280:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def read_compensated_data(self):
+            return 2150, 101325 * 256, 45 * 1024
+
+    bme280.BME280 = BME280
+
+    si1145 = types.ModuleType('si1145')
+
+    class SI1145:
+        read_uv = 1
+        read_visible = 260
+        read_ir = 250
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+    si1145.SI1145 = SI1145
+
+    ads1x15 = types.ModuleType('ads1x15')
+
+    class ADS1015:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def read(self, channel):
+            return 1200
+
+    ads1x15.ADS1015 = ADS1015
+
+    return {
+        'machine': machine, 'utime': utime, 'network': network,
+        'umqtt': umqtt, 'umqtt.simple': umqtt_simple, 'ntptime': ntptime,
+        'bme280': bme280, 'si1145': si1145, 'ads1x15': ads1x15,
+    }
+
+
+def make_config(power_mode, directory):
+    """The settings shipped in the config template, in ``power_mode``."""
+    config = types.ModuleType('sensor_feed_config')
+    with open(TEMPLATE) as f:
+        source = f.read()
+    # set where the template sets it, as later settings depend on it
+    default = "power_mode = 'always_on'"
+    assert default in source
+    exec(source.replace(default, 'power_mode = {0!r}'.format(power_mode)), config.__dict__)
+    config.debug = False
+    config.wifi_cache_path = os.path.join(directory, 'wifi.json')
+    return config
+
+
+def simulate(power_mode, seconds=DAY):
+    board = Board(seconds)
+    # the firmware's modules bind machine, utime etc. at import so load them fresh per run
+    fresh = ['sensor_app.sensor_app_base', 'sensor_app.sensor_app_upython', 'sensor_app.startup', 'sensor_app.wifi']
+    names = list(make_modules(board)) + ['sensor_feed_config'] + fresh
+    saved = dict((name, sys.modules.get(name)) for name in names)
+    for name in fresh:
+        sys.modules.pop(name, None)
+    directory = tempfile.mkdtemp()
+    sys.modules.update(make_modules(board))
+    sys.modules['sensor_feed_config'] = make_config(power_mode, directory)
+    try:
+        while True:
+            board.boots += 1
+            board.booted_at = board.now
+            try:
+                board.advance(BOOT_SECONDS)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    namespace = runpy.run_path(MAIN)
+            except DeepSleepReset:
+                continue
+            except EndOfSimulation:
+                break
+            if namespace.get('last_error'):
+                raise RuntimeError(namespace['last_error'])
+            break
+    finally:
+        shutil.rmtree(directory)
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    return board
+
+
+def main():
+    print('{:<12} {:>7} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10} {:>16}'.format(
+        'mode', 'boots', 'light', 'deep', 'wifi', 'publish', 'mAh/day', 'days@2Ah', 'first publish ms'))
+    for mode in ('always_on', 'light_sleep', 'deep_sleep'):
+        board = simulate(mode)
+        mah = sum(board.charge.values()) / 3600.0 * DAY / board.now
+        first_publish = sum(board.first_publish_ms) / max(len(board.first_publish_ms), 1)
+        print('{:<12} {:>7} {:>8} {:>8} {:>8} {:>8} {:>10.1f} {:>10.1f} {:>16.0f}'.format(
+            mode, board.boots, board.light_sleeps, board.deep_sleeps,
+            board.wifi_connects, board.publishes, mah, 2000 / mah, first_publish))
+
+
+if __name__ == '__main__':
+    main()
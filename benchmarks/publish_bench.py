@@ -0,0 +1,82 @@
+"""
+    Compare per-field publishing against the coalesced ``Publisher`` pipeline.
+
+    Messages go to an in-process stand-in for the broker that counts packets
+    and the bytes a QoS 0 PUBLISH would take on the wire.
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/publish_bench.py
+"""
+import time
+
+from sensor_app.publisher import Publisher, FORMAT_JSON, FORMAT_BINARY
+
+ROOT = 'sensors/device-0001'
+FIELDS = ('temperature', 'humidity', 'fan_duty_cycle')
+READINGS = 100000
+
+
+class BrokerStandIn:
+    def __init__(self):
+        self.messages = 0
+        self.wire_bytes = 0
+
+    def publish(self, topic, payload):
+        if isinstance(topic, str):
+            topic = bytes(topic, 'utf-8')
+        if isinstance(payload, str):
+            payload = bytes(payload, 'utf-8')
+        remaining = 2 + len(topic) + len(payload)
+        length_bytes = 1
+        while remaining >= 128 ** length_bytes:
+            length_bytes += 1
+        self.messages += 1
+        self.wire_bytes += 1 + length_bytes + remaining
+
+
+def make_topic(*sub_topics):
+    return "/".join((ROOT,) + sub_topics)
+
+
+def values(i):
+    return 20 + (i % 100) / 10.0, 40 + (i % 50) / 10.0, 50
+
+
+def run_per_field(broker):
+    """The original ``event_temperature`` publish path."""
+    for i in range(READINGS):
+        for name, value in zip(FIELDS, values(i)):
+            broker.publish(make_topic(name), bytes(str(value), 'utf-8'))
+
+
+def run_publisher(broker, batch_topic=None, fmt=FORMAT_JSON):
+    publisher = Publisher(broker.publish, make_topic, batch_topic=batch_topic, fmt=fmt)
+    publisher.intern(*FIELDS)
+    for i in range(READINGS):
+        for name, value in zip(FIELDS, values(i)):
+            publisher.add(name, value, i)
+        publisher.tick(i)
+
+
+def main():
+    cases = [
+        ('per-field', run_per_field),
+        ('pipeline per-field', run_publisher),
+        ('pipeline json', lambda broker: run_publisher(broker, 'readings', FORMAT_JSON)),
+        ('pipeline binary', lambda broker: run_publisher(broker, 'readings', FORMAT_BINARY)),
+    ]
+    print('{:<20} {:>10} {:>14} {:>12} {:>14}'.format(
+        'case', 'messages', 'readings/s', 'wire KiB', 'bytes/reading'))
+    for name, func in cases:
+        broker = BrokerStandIn()
+        start = time.perf_counter()
+        func(broker)
+        elapsed = time.perf_counter() - start
+        print('{:<20} {:>10} {:>14.0f} {:>12.1f} {:>14.1f}'.format(
+            name, broker.messages, READINGS / elapsed,
+            broker.wire_bytes / 1024, broker.wire_bytes / float(READINGS)))
+
+
+if __name__ == '__main__':
+    main()
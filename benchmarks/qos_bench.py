@@ -0,0 +1,70 @@
+"""
+    Compare pipelined QoS 1 publishing against stop-and-wait over a slow link.
+
+    Publishes a backlog of readings through ``InflightWindow`` to the
+    in-process broker, with PUBACKs delayed by ``--latency`` seconds of
+    simulated time. A window of 1 is stop-and-wait, as a blocking
+    QoS 1 client such as ``umqtt`` does. Throughput is in messages per
+    simulated second; CPU is real time per message.
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/qos_bench.py --latency 0.3
+"""
+import argparse
+import time
+
+from sensor_app.inflight import InflightWindow
+from sensor_app.simulation import Broker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def run(messages, window, latency):
+    clock = Clock()
+    broker = Broker()
+    client = broker.client(latency=latency, clock=clock.time, sleep=clock.sleep)
+    client.connect('localhost')
+    client.loop(timeout=0)
+    sender = InflightWindow(client, window, clock=clock.time)
+    payload = b'21.5'
+
+    start = time.process_time()
+    for i in range(messages):
+        # backpressure: service the link until the window has room
+        while not sender.publish('bench/temperature', payload):
+            client.loop(timeout=sender.timeout)
+    while len(sender):
+        client.loop(timeout=sender.timeout)
+    cpu = time.process_time() - start
+    return clock.now, cpu, sender, broker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.3, help='PUBACK round trip, seconds')
+    parser.add_argument('--windows', default='1,4,16,64', help='comma separated in-flight window sizes')
+    args = parser.parse_args()
+
+    print('{0} messages, {1:g} s round trip'.format(args.messages, args.latency))
+    print('{0:>8} {1:>12} {2:>10} {3:>12} {4:>10} {5:>10}'.format(
+        'window', 'link time s', 'msg/s', 'mean rtt ms', 'delivered', 'cpu us/msg'))
+    for window in [int(size) for size in args.windows.split(',')]:
+        elapsed, cpu, sender, broker = run(args.messages, window, args.latency)
+        print('{0:>8} {1:>12.1f} {2:>10.1f} {3:>12.1f} {4:>10} {5:>10.1f}'.format(
+            window, elapsed, args.messages / elapsed, sender.rtt.total / max(sender.rtt.count, 1) / 1000,
+            broker.messages, 1000000 * cpu / args.messages))
+
+
+if __name__ == '__main__':
+    main()
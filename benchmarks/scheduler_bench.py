@@ -0,0 +1,85 @@
+"""
+    Compare the original list-scan event loop against the heap queue.
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/scheduler_bench.py
+"""
+import random
+import timeit
+
+from sensor_app.scheduler import EventQueue
+
+SIZES = (10, 1000, 100000)
+TICKS = 100
+
+
+def noop(current_time):
+    pass
+
+
+def list_tick(events, current_time):
+    """One pass of the original ``SensorApplication.loop``."""
+    triggered = []
+    for i in range(len(events)):
+        if events[i][0] <= current_time:
+            events[i][1](current_time)
+            triggered.append(i)
+    for i in triggered[::-1]:
+        del events[i]
+
+
+def heap_tick(queue, current_time):
+    for dtime, event in queue.pop_due(current_time):
+        event(current_time)
+
+
+def make_times(size):
+    rnd = random.Random(size)
+    return [rnd.randrange(TICKS) for _ in range(size)]
+
+
+def bench_idle(size):
+    """Cost of one loop pass with ``size`` pending events, none of them due."""
+    events = [(TICKS + dtime, noop) for dtime in make_times(size)]
+    queue = EventQueue()
+    for dtime, event in events:
+        queue.push(dtime, event)
+
+    number = max(1, 100000 // size)
+    list_time = timeit.timeit(lambda: list_tick(events, 0), number=number) / number
+    heap_time = timeit.timeit(lambda: heap_tick(queue, 0), number=number) / number
+    return list_time, heap_time
+
+
+def bench_drain(size):
+    """Schedule ``size`` events spread over ``TICKS`` ticks and run them all."""
+    times = make_times(size)
+
+    def run_list():
+        events = [(dtime, noop) for dtime in times]
+        for tick in range(TICKS):
+            list_tick(events, tick)
+
+    def run_heap():
+        queue = EventQueue()
+        for dtime in times:
+            queue.push(dtime, noop)
+        for tick in range(TICKS):
+            heap_tick(queue, tick)
+
+    return timeit.timeit(run_list, number=1), timeit.timeit(run_heap, number=1)
+
+
+def main():
+    print('{:>8} {:>14} {:>14} {:>14} {:>14}'.format(
+        'events', 'idle list us', 'idle heap us', 'drain list ms', 'drain heap ms'))
+    for size in SIZES:
+        idle_list, idle_heap = bench_idle(size)
+        drain_list, drain_heap = bench_drain(size)
+        print('{:>8} {:>14.2f} {:>14.2f} {:>14.2f} {:>14.2f}'.format(
+            size, idle_list * 1e6, idle_heap * 1e6, drain_list * 1e3, drain_heap * 1e3))
+
+
+if __name__ == '__main__':
+    main()
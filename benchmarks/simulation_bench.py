@@ -0,0 +1,110 @@
+"""
+    Simulate a deployment of many sensors on the virtual clock and report
+    scheduler and dispatch throughput.
+
+    Each sensor is a periodic job reading a replayed trace and publishing two
+    readings to an in-process broker. The trace is a synthetic day of one
+    minute samples written to a CSV file, or pass ``--trace`` to replay a
+    recording (CSV, or Parquet with pandas installed).
+
+    Run from the repository root::
+
+        PYTHONPATH=. python benchmarks/simulation_bench.py --sensors 1000 --days 30
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+
+from sensor_app.simulation import ReplaySensor, SimulatedSensorApplication, load_csv, load_parquet
+
+DAY = 24 * 60 * 60
+
+
+def write_trace(path):
+    """A day of one minute temperature and humidity samples."""
+    with open(path, 'w') as f:
+        f.write('time,temperature,humidity\n')
+        for minute in range(24 * 60):
+            phase = 2 * math.pi * minute / (24 * 60)
+            f.write('{0},{1:.2f},{2:.2f}\n'.format(minute * 60, 22 + 4 * math.sin(phase), 45 - 10 * math.sin(phase)))
+
+
+def load_trace(path):
+    if path.endswith('.parquet'):
+        return load_parquet(path)
+    return load_csv(path)
+
+
+# Report-by-exception rules applied to every sensor with --deadband.
+DEADBAND_TEMPERATURE = {'absolute': 0.5, 'heartbeat': 3600}
+DEADBAND_HUMIDITY = {'percent': 5, 'heartbeat': 3600}
+
+
+def device_names(i):
+    device = 'device-{0:04d}'.format(i)
+    return device, (device + '/temperature', device + '/humidity')
+
+
+def build(trace, sensors, period, jitter, deadband=False):
+    deadbands = None
+    if deadband:
+        deadbands = {}
+        for i in range(sensors):
+            temperature, humidity = device_names(i)[1]
+            deadbands[temperature] = DEADBAND_TEMPERATURE
+            deadbands[humidity] = DEADBAND_HUMIDITY
+    app = SimulatedSensorApplication({}, False, deadbands=deadbands)
+    for i in range(sensors):
+        device, names = device_names(i)
+        app.publisher.intern(*names)
+        sensor = ReplaySensor(trace, app.time, ('temperature', 'humidity'), offset=i * 37)
+
+        def read(current_time, sensor=sensor, names=names):
+            temperature, humidity = sensor.read()
+            app.publish(names[0], temperature)
+            app.publish(names[1], humidity)
+
+        read.__name__ = 'event_' + device
+        app.schedule_periodic(period, read, jitter=jitter)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sensors', type=int, default=1000)
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--period', type=int, default=300, help='seconds between reads')
+    parser.add_argument('--jitter', type=int, default=60, help='spread of read slots, seconds')
+    parser.add_argument('--deadband', action='store_true', help='only publish readings that have changed')
+    parser.add_argument('--trace', help='CSV or Parquet trace with time, temperature and humidity columns')
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        try:
+            write_trace(path)
+            trace = load_csv(path)
+        finally:
+            os.remove(path)
+
+    app = build(trace, args.sensors, args.period, args.jitter, args.deadband)
+    start = time.perf_counter()
+    app.run_until(args.days * DAY)
+    elapsed = time.perf_counter() - start
+
+    events = sum(histogram.count for histogram in app.stats.handlers.values())
+    print('sensors {0}, {1:g} simulated days, {2:.1f} s'.format(args.sensors, args.days, elapsed))
+    print('{0:>12} {1:>12} {2:>12} {3:>12} {4:>12} {5:>12}'.format(
+        'events', 'events/s', 'loop passes', 'messages', 'suppressed', 'sim x real'))
+    print('{0:>12} {1:>12.0f} {2:>12} {3:>12} {4:>12} {5:>12.0f}'.format(
+        events, events / elapsed, app.stats.iteration.count, app.broker.messages,
+        app.publisher.suppressed, app.now / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+#!/bin/bash
+#
+# Compiles the parts of sensor_app used on the board to .mpy bytecode, ready to
+# be uploaded alongside main.py. Needs mpy-cross (pip install mpy-cross) built
+# for the same MicroPython version as the board firmware.
+#
+
+MODULES="
+__init__
+commands
+outbox
+power
+publisher
+runtime_config
+scheduler
+sensor_app_base
+sensor_app_upython
+startup
+stats
+wifi
+"
+
+OUT=${1:-build}
+MPY_CROSS=${MPY_CROSS:-mpy-cross}
+
+mkdir -p ${OUT}/sensor_app
+for module in ${MODULES}
+do
+    ${MPY_CROSS} -o ${OUT}/sensor_app/${module}.mpy sensor_app/${module}.py || exit 1
+done
@@ -0,0 +1,128 @@
+"""Batch conversion and rolling statistics for oversampled sensor readings."""
+import math
+import operator
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def convert(raw, scale=1.0, offset=0.0):
+    """Calibrate a sequence of raw samples as ``raw * scale + offset``."""
+    if numpy is not None:
+        return numpy.asarray(raw, dtype=numpy.float64) * scale + offset
+    return [value * scale + offset for value in raw]
+
+
+class SampleWindow:
+    """
+        Ring buffer of the last ``size`` raw samples for one channel.
+
+        Samples are stored raw and calibrated in one pass when a summary is
+        requested, so a sensor can be oversampled cheaply and only the
+        aggregates published. Uses NumPy when installed and ``array`` otherwise.
+    """
+    def __init__(self, size, scale=1.0, offset=0.0, use_numpy=None):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.size = size
+        self.scale = scale
+        self.offset = offset
+        self.use_numpy = use_numpy
+        if use_numpy:
+            self._data = numpy.zeros(size, dtype=numpy.float64)
+        else:
+            self._data = array('f', [0.0] * size)
+        self._pos = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._pos = 0
+        self._count = 0
+
+    def add(self, raw):
+        """Add one raw sample, replacing the oldest once the window is full."""
+        self._data[self._pos] = raw
+        self._pos = (self._pos + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def extend(self, raws):
+        """Add a batch of raw samples."""
+        if self.use_numpy:
+            raws = numpy.asarray(raws, dtype=numpy.float64)
+        else:
+            raws = array('f', raws)
+        if len(raws) >= self.size:
+            self._data[:] = raws[-self.size:]
+            self._pos = 0
+            self._count = self.size
+            return
+        end = self._pos + len(raws)
+        if end <= self.size:
+            self._data[self._pos:end] = raws
+        else:
+            split = self.size - self._pos
+            self._data[self._pos:] = raws[:split]
+            self._data[:end - self.size] = raws[split:]
+        self._pos = end % self.size
+        self._count = min(self._count + len(raws), self.size)
+
+    def _raw(self):
+        if self._count == self.size:
+            return self._data
+        return self._data[:self._count]
+
+    def values(self):
+        """Calibrated samples currently in the window, in storage order."""
+        return convert(self._raw(), self.scale, self.offset)
+
+    def summary(self):
+        """
+            Calibrated ``count``, ``min``, ``max``, ``mean`` and population
+            ``stddev`` of the window. None when empty.
+        """
+        if not self._count:
+            return None
+        raw = self._raw()
+        if self.use_numpy:
+            raw_min, raw_max = float(raw.min()), float(raw.max())
+            raw_mean, raw_std = float(raw.mean()), float(raw.std())
+        else:
+            raw_min, raw_max = min(raw), max(raw)
+            # C level passes over the array; fsum keeps the sums exact so
+            # the variance doesn't cancel away
+            total = math.fsum(raw)
+            raw_mean = total / self._count
+            squares = math.fsum(map(operator.mul, raw, raw))
+            raw_std = math.sqrt(max(squares / self._count - raw_mean * raw_mean, 0))
+
+        # calibration is linear so it can be applied to the raw statistics
+        low, high = raw_min * self.scale + self.offset, raw_max * self.scale + self.offset
+        if low > high:
+            low, high = high, low
+        return {
+            'count': self._count,
+            'min': low,
+            'max': high,
+            'mean': raw_mean * self.scale + self.offset,
+            'stddev': raw_std * abs(self.scale),
+        }
+
+    def publish(self, publish, name):
+        """
+            Send the window summary through ``publish(field, value)`` as
+            ``name`` (mean) and ``name_<stat>``. Returns the summary.
+        """
+        summary = self.summary()
+        if summary is None:
+            return None
+        publish(name, summary['mean'])
+        for stat in ('min', 'max', 'stddev'):
+            publish(name + '_' + stat, summary[stat])
+        return summary
@@ -0,0 +1,217 @@
+"""Remote commands received over MQTT, matched by topic filter."""
+
+EMPTY = ()
+
+# handlers declared with ``command``, by function name
+_DECLARED = {}
+
+
+def command(sub_topic, parse=None, min_interval=0):
+    """
+        Declare a method as the handler for messages on ``sub_topic``.
+
+        The sub-topic may use the MQTT wildcards ``+`` and ``#``. The method
+        is called as ``handler(topic, value)`` where ``value`` is the payload
+        passed through ``parse`` (e.g. ``parse_int``), or the raw payload if
+        ``parse`` is None. A message arriving within ``min_interval`` seconds
+        of the last accepted one is dropped. A ``ValueError`` from ``parse``,
+        or any exception from the handler, is logged and counted as a
+        rejection. Declared handlers are added to an application's
+        ``commands`` when it is created.
+    """
+    def decorate(func):
+        # kept aside rather than as function attributes, which MicroPython lacks
+        _DECLARED.setdefault(func.__name__, []).append((func, sub_topic, parse, min_interval))
+        return func
+    return decorate
+
+
+def parse_text(payload):
+    return str(bytes(payload), 'utf-8')
+
+
+def parse_int(payload):
+    return int(parse_text(payload))
+
+
+def parse_float(payload):
+    return float(parse_text(payload))
+
+
+def parse_json(payload):
+    import json
+
+    return json.loads(parse_text(payload))
+
+
+class TopicTrie:
+    """
+        Values stored under MQTT topic filters, looked up by topic.
+
+        Filters without wildcards are kept in a dict so matching them is one
+        lookup. Those with ``+`` (one level) or ``#`` (the remaining levels)
+        go in a trie that is only walked when there are any, one step per
+        level. Topics may be str or bytes, matching the filters.
+    """
+    def __init__(self):
+        self._exact = {}
+        self._root = None
+
+    def __len__(self):
+        return len(self._exact) + (self._root is not None)
+
+    def add(self, topic_filter, value):
+        sep, single, multi = _tokens(topic_filter)
+        levels = topic_filter.split(sep)
+        if single not in levels and multi not in levels:
+            self._exact.setdefault(topic_filter, []).append(value)
+            return
+        if multi in levels[:-1]:
+            raise ValueError('{0!r}: "#" must be the last level'.format(topic_filter))
+        if self._root is None:
+            self._root = ({}, [])
+        node = self._root
+        for level in levels:
+            child = node[0].get(level)
+            if child is None:
+                child = ({}, [])
+                node[0][level] = child
+            node = child
+        node[1].append(value)
+
+    def match(self, topic):
+        """Values of the filters matching ``topic``. The result must not be modified."""
+        values = self._exact.get(topic, EMPTY)
+        if self._root is None:
+            return values
+        found = list(values)
+        sep, single, multi = _tokens(topic)
+        self._walk(self._root, topic.split(sep), 0, single, multi, found)
+        return found
+
+    def _walk(self, node, levels, i, single, multi, found):
+        children = node[0]
+        # "a/#" matches "a" as well as everything below it
+        rest = children.get(multi)
+        if rest is not None:
+            found.extend(rest[1])
+        if i == len(levels):
+            found.extend(node[1])
+            return
+        child = children.get(levels[i])
+        if child is not None:
+            self._walk(child, levels, i + 1, single, multi, found)
+        child = children.get(single)
+        if child is not None:
+            self._walk(child, levels, i + 1, single, multi, found)
+
+
+def _tokens(topic):
+    if isinstance(topic, str):
+        return '/', '+', '#'
+    return b'/', b'+', b'#'
+
+
+class Command:
+    """A registered command and its counters."""
+    def __init__(self, sub_topic, handler, parse=None, min_interval=0):
+        self.sub_topic = sub_topic
+        self.handler = handler
+        self.parse = parse
+        self.min_interval = min_interval
+        self.topic_filter = None
+        self.last_time = None
+        self.calls = 0
+        self.rejected = 0
+        self.limited = 0
+
+    def __call__(self, app, topic, payload, current_time):
+        if (self.min_interval and self.last_time is not None and
+                current_time - self.last_time < self.min_interval):
+            self.limited += 1
+            app.log(current_time, 'Command {0} rate limited'.format(self.sub_topic))
+            return
+        if self.parse is None:
+            value = payload
+        else:
+            try:
+                value = self.parse(payload)
+            except ValueError as err:
+                self.rejected += 1
+                app.log(current_time, 'Bad {0} command: {1}'.format(self.sub_topic, err))
+                return
+        self.last_time = current_time
+        try:
+            self.handler(topic, value)
+        except Exception as err:
+            # let out of the MQTT callback this stops the app, on every start
+            # if the message was retained
+            self.rejected += 1
+            app.log(current_time, 'Command {0} failed: {1!r}'.format(self.sub_topic, err))
+            return
+        self.calls += 1
+
+
+class CommandTable:
+    """
+        Commands of an application, dispatched by topic.
+
+        Sub-topics are turned into topic filters with the application's
+        ``mqtt_make_topic`` when first needed, so commands can be added
+        before its MQTT settings are.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.commands = []
+        self._pending = []
+        self._trie = TopicTrie()
+
+    def add(self, sub_topic, handler, parse=None, min_interval=0):
+        """Call ``handler(topic, value)`` for messages on ``sub_topic``. See ``command``."""
+        cmd = Command(sub_topic, handler, parse, min_interval)
+        self.commands.append(cmd)
+        self._pending.append(cmd)
+        return cmd
+
+    def add_declared(self, obj, prefix=''):
+        """Add the methods of ``obj`` declared with ``command``, under ``prefix``. Returns them."""
+        cls = type(obj)
+        added = []
+        for name in _DECLARED:
+            func = getattr(cls, name, None)
+            if func is None:
+                continue
+            for declared, sub_topic, parse, min_interval in _DECLARED[name]:
+                if declared is func:
+                    added.append(self.add(prefix + sub_topic, getattr(obj, name), parse, min_interval))
+        return added
+
+    def _compile(self):
+        for cmd in self._pending:
+            cmd.topic_filter = self.app.mqtt_make_topic(*cmd.sub_topic.split('/'))
+            self._trie.add(cmd.topic_filter, cmd)
+        self._pending = []
+
+    def filters(self, commands=None):
+        """Topic filters to subscribe to for ``commands``, default all of them."""
+        if self._pending:
+            self._compile()
+        filters = []
+        for cmd in self.commands if commands is None else commands:
+            if cmd.topic_filter not in filters:
+                filters.append(cmd.topic_filter)
+        return filters
+
+    def dispatch(self, topic, payload, current_time):
+        """Run the commands matching ``topic``. Returns how many matched."""
+        if self._pending:
+            self._compile()
+        commands = self._trie.match(topic)
+        for cmd in commands:
+            cmd(self.app, topic, payload, current_time)
+        return len(commands)
+
+    def stats(self):
+        """Calls, rejected payloads and rate limited messages per command."""
+        return dict((cmd.sub_topic, {'calls': cmd.calls, 'rejected': cmd.rejected, 'limited': cmd.limited})
+                    for cmd in self.commands)
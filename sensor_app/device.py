@@ -0,0 +1,155 @@
+"""Logical devices hosted together in one gateway process."""
+import json
+import os
+
+from sensor_app.sensor_app_base import SensorApplication
+
+TOPIC_RESERVED = '/+#'
+
+
+class GatewayDevice(SensorApplication):
+    """
+        One device's sensors and handlers, run by a host application.
+
+        Written like a standalone application: ``init_events`` schedules
+        handlers, which ``publish`` readings. Events go on the host's queue
+        and readings through the host's publisher and MQTT connection under
+        the ``<name>`` sub-topic, batched per device if the host batches, so
+        many devices share one loop and one connection. ``event_periods``, ``adaptive_periods``, ``deadbands``
+        and ``jitter`` apply to this device only, the host's jitter by
+        default, and its ``command`` methods answer on ``<name>/<sub-topic>``.
+    """
+    def __init__(self, host, name, event_periods=None, adaptive_periods=None, deadbands=None, jitter=None):
+        if not name or any(c in name for c in TOPIC_RESERVED):
+            raise ValueError('Bad device name: {0!r}'.format(name))
+        # copied, as runtime config updates change them in place
+        super(GatewayDevice, self).__init__(dict(event_periods or {}), host.debug, dict(adaptive_periods or {}),
+                                            host.jitter if jitter is None else jitter)
+        self.host = host
+        self.name = name
+        self._events = host._events
+        self.stats = host.stats
+        # batches stay per device, on <name>/<batch topic>
+        host.publisher.group_batches = True
+        # commands are dispatched by the host, under this device's sub-topic
+        self.commands = host.commands
+        self.device_commands = host.commands.add_declared(self, name + '/')
+        for field, rule in (deadbands or {}).items():
+            host.publisher.set_deadband(self.field_name(field), rule)
+
+    def field_name(self, field):
+        """Name ``field`` is published under by the host."""
+        return self.name + '/' + field
+
+    def intern(self, *fields):
+        """Build the topics for ``fields`` up front."""
+        self.host.publisher.intern(*[self.field_name(field) for field in fields])
+
+    def publish(self, field, value):
+        self.host.publish(self.field_name(field), value)
+
+    def observe(self, name, value, current_time):
+        self.host.call_in_loop(super(GatewayDevice, self).observe, name, value, current_time)
+
+    def call_in_loop(self, func, *args):
+        self.host.call_in_loop(func, *args)
+
+    def mqtt_make_topic(self, *sub_topics):
+        return self.host.mqtt_make_topic(self.name, *sub_topics)
+
+    def log(self, current_time, message):
+        self.host.log(current_time, self.name + ': ' + message)
+
+    def jitter_key(self):
+        return self.host.jitter_key() + '/' + self.name
+
+    def run_handler(self, handler, current_time):
+        self.host.run_handler(handler, current_time)
+
+    def run(self):
+        raise RuntimeError('{0} runs on its host loop'.format(self.name))
+
+    def time(self):
+        return self.host.time()
+
+    def sleep(self, seconds):
+        return self.host.sleep(seconds)
+
+    def localtime(self, timeval):
+        return self.host.localtime(timeval)
+
+    def ticks_us(self):
+        return self.host.ticks_us()
+
+    def ticks_diff(self, end, start):
+        return self.host.ticks_diff(end, start)
+
+
+class DeviceHost:
+    """
+        Mixin for an application hosting ``GatewayDevice``s in ``devices``.
+
+        The application sets ``devices`` to a dict before adding any. Runtime
+        config keys ``<device>/<reading>`` apply to that device, so an
+        ``event_periods``, ``adaptive_periods`` or ``deadbands`` update can
+        reach a device's reading rather than the host's.
+    """
+    def add_device(self, device):
+        """Host ``device`` and schedule its events."""
+        if device.name in self.devices:
+            raise ValueError('Duplicate device: {0}'.format(device.name))
+        self.devices[device.name] = device
+        device.init_events()
+        self.mqtt_subscribe_filters(self.commands.filters(device.device_commands))
+        return device
+
+    def config_target(self, name):
+        device_name, sep, field = name.partition('/')
+        if not sep:
+            return self, name
+        device = self.devices.get(device_name)
+        if device is None or not field:
+            raise ValueError('{0}: no such device'.format(name))
+        return device.config_target(field)
+
+
+def import_class(path):
+    """Class from a dotted ``module.Class`` path."""
+    import importlib
+
+    module, _, name = path.rpartition('.')
+    if not module:
+        raise ValueError('Bad device class: {0!r}'.format(path))
+    return getattr(importlib.import_module(module), name)
+
+
+def load_device_configs(directory):
+    """
+        ``(name, config)`` for each ``<name>.json`` file in ``directory``, by name.
+
+        Each file is a JSON object with the dotted path of a ``GatewayDevice``
+        subclass under ``class`` and its keyword arguments, e.g.
+        ``{"class": "sensor_app.main_rpi.FanDevice", "pin_fan_pwm": 18,
+        "event_periods": {"temperature": 300}}``.
+    """
+    configs = []
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.json':
+            continue
+        with open(os.path.join(directory, filename)) as f:
+            config = json.load(f)
+        if not isinstance(config, dict) or 'class' not in config:
+            raise ValueError('{0}: expected an object with a "class"'.format(filename))
+        configs.append((name, config))
+    return configs
+
+
+def load_devices(host, directory):
+    """Build the devices configured in ``directory`` on ``host``. See ``load_device_configs``."""
+    devices = []
+    for name, config in load_device_configs(directory):
+        config = dict(config)
+        cls = import_class(config.pop('class'))
+        devices.append(cls(host, name, **config))
+    return devices
@@ -0,0 +1,134 @@
+"""Run blocking event handlers on a thread pool."""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def blocking(device=None, timeout=None):
+    """
+        Mark an event handler as blocking.
+
+        When the application has an executor the handler runs on the pool
+        instead of the loop thread. At most one handler per ``device`` runs
+        at a time (default: the handler itself); runs that find the device
+        busy are skipped. A run taking longer than ``timeout`` seconds is
+        logged and its result discarded.
+    """
+    def decorate(func):
+        func.blocking_device = device or func.__name__
+        func.blocking_timeout = timeout
+        return func
+    return decorate
+
+
+class _Job:
+    def __init__(self, name, device, timeout):
+        self.name = name
+        self.device = device
+        self.timeout = timeout
+        self.future = None
+        self.started = time.monotonic()
+        self.timed_out = False
+
+
+class HandlerExecutor:
+    """
+        Bounded thread pool for handlers marked with ``blocking``.
+
+        Anything a worker needs done on the loop thread (e.g. publishing) goes
+        through ``call_soon``; ``process`` must be called from the loop thread
+        to run those callbacks, release finished devices and check timeouts.
+        ``notify``, if set, is called from the queuing thread whenever there
+        is something for ``process`` to do, so a waiting loop can wake.
+    """
+    def __init__(self, app, workers):
+        self.app = app
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='sensor-handler')
+        self.loop_thread = threading.get_ident()
+        self._busy = {}
+        self._callbacks = queue.SimpleQueue()
+        self._local = threading.local()
+        self.notify = None
+        self.skipped = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def in_loop_thread(self):
+        return threading.get_ident() == self.loop_thread
+
+    def busy(self):
+        return bool(self._busy)
+
+    def call_soon(self, func, *args):
+        """
+            Run ``func(*args)`` on the loop thread at the next ``process``. Thread safe.
+
+            Callbacks queued by a handler that has since timed out are dropped.
+        """
+        self._queue(getattr(self._local, 'job', None), func, args)
+
+    def _queue(self, job, func, args):
+        self._callbacks.put((job, func, args))
+        if self.notify is not None:
+            self.notify()
+
+    def submit(self, handler, current_time):
+        """Start ``handler`` on the pool. Returns False if its device is busy."""
+        device = handler.blocking_device
+        name = getattr(handler, '__name__', device)
+        # the same method bound to different objects, e.g. gateway devices,
+        # drives different hardware so is only exclusive per object
+        key = (getattr(handler, '__self__', None), device)
+        if key in self._busy:
+            self.skipped += 1
+            self.app.log(current_time, 'Skipped {0}: {1} busy'.format(name, device))
+            return False
+        job = _Job(name, key, handler.blocking_timeout)
+
+        def run():
+            self._local.job = job
+            try:
+                return handler(current_time)
+            finally:
+                self._local.job = None
+
+        self._busy[key] = job
+        job.future = self.pool.submit(run)
+        job.future.add_done_callback(lambda future: self._queue(None, self._finished, (job,)))
+        return True
+
+    def _finished(self, job):
+        del self._busy[job.device]
+        if job.future.cancelled():
+            return
+        elapsed = time.monotonic() - job.started
+        self.app.stats.handler(job.name + '@pool').record(int(elapsed * 1000000))
+        err = job.future.exception()
+        if err is not None:
+            self.failures += 1
+            self.app.log(self.app.time(), 'Handler {0} failed: {1!r}'.format(job.name, err))
+
+    def process(self):
+        """Run queued callbacks and report handlers that have timed out."""
+        while True:
+            try:
+                job, func, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                break
+            if job is None or not job.timed_out:
+                func(*args)
+
+        now = time.monotonic()
+        for job in list(self._busy.values()):
+            if job.timed_out or job.timeout is None or now - job.started < job.timeout:
+                continue
+            # A running thread can't be stopped; the device stays busy until it
+            # returns so a second read never overlaps a hung one.
+            job.timed_out = True
+            job.future.cancel()
+            self.timeouts += 1
+            self.app.log(self.app.time(), 'Handler {0} timed out after {1}s'.format(job.name, job.timeout))
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,163 @@
+"""Fan speed control that doesn't block the event loop."""
+import bisect
+
+# Fan duty cycle for temperatures below each band edge, then above the last.
+FAN_TEMP_BANDS = (26, 28, 32, 35)
+FAN_DUTY_CYCLES = (0, 40, 50, 80, 100)
+FAN_HYSTERESIS = 1.0 # degrees
+
+# A low duty cycle fails to start a stopped fan, so it is given a burst first.
+KICK_DUTY_CYCLE = 90
+KICK_THRESHOLD = 60
+KICK_SECONDS = 3
+
+FAN_STOPPED = 'stopped'
+FAN_KICKING = 'kicking'
+FAN_RUNNING = 'running'
+
+
+class BandCurve:
+    """
+        Duty cycle from temperature bands, with hysteresis.
+
+        ``duty_cycles[i]`` applies below ``edges[i]`` and the last one above
+        the last edge. The fan moves up a band on reaching its edge but only
+        moves down once ``hysteresis`` degrees below it, so a temperature
+        hovering on an edge doesn't flip it between speeds. ``smoothing``
+        below 1 averages readings exponentially first, giving the newest
+        that weight.
+    """
+    def __init__(self, edges=FAN_TEMP_BANDS, duty_cycles=FAN_DUTY_CYCLES, hysteresis=FAN_HYSTERESIS, smoothing=1):
+        if len(duty_cycles) != len(edges) + 1:
+            raise ValueError('Need one more duty cycle than band edges')
+        if not 0 < smoothing <= 1:
+            raise ValueError('smoothing must be in (0, 1]')
+        self.edges = tuple(edges)
+        self.duty_cycles = tuple(duty_cycles)
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        self.temperature = None
+        self.band = None
+
+    def duty_cycle(self, temp, current_time):
+        if self.temperature is None:
+            self.temperature = temp
+        else:
+            self.temperature += self.smoothing * (temp - self.temperature)
+        temp = self.temperature
+        band = bisect.bisect_right(self.edges, temp)
+        if self.band is not None and band < self.band:
+            band = min(self.band, bisect.bisect_right(self.edges, temp + self.hysteresis))
+        self.band = band
+        return self.duty_cycles[band]
+
+
+class PidCurve:
+    """
+        Duty cycle from a PID loop holding the temperature at ``setpoint``.
+
+        The output is limited to ``max_duty`` and anything under ``min_duty``,
+        which wouldn't keep the fan turning, stops it. The integral is only
+        accumulated while the output isn't limited, so it doesn't wind up
+        while the fan is flat out or off.
+    """
+    def __init__(self, setpoint, kp, ki=0, kd=0, min_duty=40, max_duty=100):
+        self.setpoint = setpoint
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.min_duty = min_duty
+        self.max_duty = max_duty
+        self.integral = 0
+        self._last_error = None
+        self._last_time = None
+
+    def duty_cycle(self, temp, current_time):
+        error = temp - self.setpoint
+        dt = 0 if self._last_time is None else current_time - self._last_time
+        integral = self.integral + error * dt
+        derivative = (error - self._last_error) / dt if dt > 0 else 0
+        self._last_error = error
+        self._last_time = current_time
+
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        if 0 <= output <= self.max_duty:
+            self.integral = integral
+        if output < self.min_duty:
+            return 0
+        return int(round(min(output, self.max_duty)))
+
+
+def make_curve(settings=None):
+    """
+        Curve from ``fan_control`` settings: ``BandCurve`` keyword arguments,
+        or ``PidCurve`` ones with ``"mode": "pid"``.
+    """
+    settings = dict(settings or {})
+    mode = settings.pop('mode', 'bands')
+    if mode == 'bands':
+        return BandCurve(**settings)
+    if mode == 'pid':
+        return PidCurve(**settings)
+    raise ValueError('Unknown fan control mode: {0!r}'.format(mode))
+
+
+class Fan:
+    """
+        Drives a fan through ``output(duty_cycle)`` without blocking.
+
+        Tracks whether the fan is stopped, being kicked or running. Starting a
+        stopped fan at under ``kick_threshold`` percent drives it at
+        ``kick_duty`` first, dropping to the target in an event scheduled on
+        ``app`` ``kick_seconds`` later rather than by sleeping; a running fan
+        is just set to the new duty cycle. ``output`` is only called when the
+        value changes, counted in ``writes``. Call ``set`` on the loop thread.
+    """
+    def __init__(self, app, output, kick_duty=KICK_DUTY_CYCLE, kick_threshold=KICK_THRESHOLD,
+                 kick_seconds=KICK_SECONDS):
+        self.app = app
+        self.output = output
+        self.kick_duty = kick_duty
+        self.kick_threshold = kick_threshold
+        self.kick_seconds = kick_seconds
+        self.state = FAN_STOPPED
+        self.target = 0
+        self.value = None
+        self.writes = 0
+        self.kicks = 0
+        self._kick = None
+
+    def _write(self, value):
+        if value != self.value:
+            self.output(value)
+            self.value = value
+            self.writes += 1
+
+    def set(self, duty_cycle, current_time):
+        """Drive the fan at ``duty_cycle`` percent, 0 to stop it."""
+        self.target = duty_cycle
+        if duty_cycle <= 0:
+            if self._kick is not None:
+                self.app.event_cancel(self._kick)
+                self._kick = None
+            self.state = FAN_STOPPED
+            self._write(0)
+        elif self.state == FAN_KICKING:
+            # the target is applied when the kick ends
+            pass
+        elif self.state == FAN_STOPPED and duty_cycle < self.kick_threshold:
+            self.state = FAN_KICKING
+            self.kicks += 1
+            self._write(self.kick_duty)
+            self._kick = self.app.event_schedule_offset(self.kick_seconds, self.event_end_kick)
+        else:
+            self.state = FAN_RUNNING
+            self._write(duty_cycle)
+
+    def event_end_kick(self, current_time):
+        """Drop a kicked fan to its target."""
+        self._kick = None
+        if self.state == FAN_KICKING:
+            self.state = FAN_RUNNING
+            self._write(self.target)
+
@@ -0,0 +1,51 @@
+"""Run many logical devices in one process."""
+from sensor_app.device import DeviceHost, load_devices
+from sensor_app.sensor_app_cpython import CPythonSensorApplication
+
+
+class Gateway(DeviceHost, CPythonSensorApplication):
+    """
+        One event loop and MQTT connection shared by many ``GatewayDevice``s.
+
+        Each device publishes under ``<root>/<device name>/``. Devices are
+        added with ``add_device`` or loaded from the JSON files in
+        ``devices_path`` (see ``load_device_configs``). Sensors on the same
+        I2C channel share one bus from ``get_bus``.
+    """
+    def __init__(self, mqtt_host, mqtt_root_topic, mqtt_username, mqtt_password, event_periods, debug,
+                 devices_path=None, config_path=None, **kwargs):
+        """Setup the application"""
+        super(Gateway, self).__init__(mqtt_host, mqtt_root_topic, ['halt'], mqtt_username, mqtt_password,
+                                      event_periods, debug, **kwargs)
+        self.devices = {}
+        if devices_path is not None:
+            for device in load_devices(self, devices_path):
+                self.add_device(device)
+        # saved settings can name devices, so are only applied once they exist
+        self.runtime_config.path = config_path
+        self.runtime_config.restore()
+
+    def __del__(self):
+        self.mqtt_client.disconnect()
+
+
+def main():
+    import sensor_feed_config as config
+    app = Gateway(
+        config.mqtt_host, config.mqtt_root_topic,
+        config.mqtt_username, config.mqtt_password,
+        config.event_periods, config.debug,
+        devices_path=config.gateway_devices_path,
+        mqtt_batch_topic=getattr(config, 'mqtt_batch_topic', None),
+        outbox_path=getattr(config, 'outbox_path', None),
+        executor_workers=getattr(config, 'executor_workers', 0),
+        timeseries_path=getattr(config, 'timeseries_path', None),
+        config_path=getattr(config, 'runtime_config_path', None),
+        mqtt_qos=getattr(config, 'mqtt_qos', 0),
+        mqtt_inflight=getattr(config, 'mqtt_inflight', 16),
+        jitter=getattr(config, 'jitter', 0),
+    )
+    app.run()
+
+if __name__ == '__main__':
+    main()
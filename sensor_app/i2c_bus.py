@@ -0,0 +1,160 @@
+"""Shared I2C bus access for sensor drivers."""
+import ctypes
+import fcntl
+import os
+import threading
+import time
+
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+
+
+class i2c_msg(ctypes.Structure):
+    _fields_ = [
+        ('addr', ctypes.c_uint16),
+        ('flags', ctypes.c_uint16),
+        ('len', ctypes.c_uint16),
+        ('buf', ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+    _fields_ = [
+        ('msgs', ctypes.POINTER(i2c_msg)),
+        ('nmsgs', ctypes.c_uint32),
+    ]
+
+
+class DeviceStats:
+    """Transaction count and latency for one device address."""
+    def __init__(self):
+        self.transactions = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, failed):
+        self.transactions += 1
+        if failed:
+            self.errors += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def as_dict(self):
+        mean = self.total_time / self.transactions if self.transactions else 0.0
+        return {
+            'transactions': self.transactions,
+            'errors': self.errors,
+            'mean_time': mean,
+            'max_time': self.max_time,
+        }
+
+
+class I2CBus:
+    """
+        One I2C bus shared by any number of devices.
+
+        Every operation is a single ``transfer``: an optional write followed by
+        an optional read from one device address. Access is serialised with a
+        lock and timed per address. Subclasses implement ``_transfer``.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._stats = {}
+
+    def device(self, address):
+        """Handle for the device at ``address`` on this bus."""
+        return I2CDevice(self, address)
+
+    def transfer(self, address, write=b'', read_length=0):
+        """Write ``write`` then read ``read_length`` bytes as one transaction."""
+        with self.lock:
+            start = time.monotonic()
+            failed = True
+            try:
+                data = self._transfer(address, write, read_length)
+                failed = False
+                return data
+            finally:
+                stats = self._stats.get(address)
+                if stats is None:
+                    stats = self._stats[address] = DeviceStats()
+                stats.record(time.monotonic() - start, failed)
+
+    def stats(self):
+        """Per-address transaction statistics."""
+        return dict((address, stats.as_dict()) for address, stats in self._stats.items())
+
+    def close(self):
+        pass
+
+    def _transfer(self, address, write, read_length):
+        raise NotImplementedError
+
+
+class LinuxI2CBus(I2CBus):
+    """
+        Bus on a Linux ``/dev/i2c-N`` device.
+
+        A single file descriptor is used for every address. Transfers use the
+        ``I2C_RDWR`` ioctl so a write-then-read is one syscall and no
+        ``I2C_SLAVE`` switch is needed between devices.
+    """
+    def __init__(self, channel):
+        super(LinuxI2CBus, self).__init__()
+        self.channel = channel
+        self.fd = os.open('/dev/i2c-{0}'.format(channel), os.O_RDWR)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _transfer(self, address, write, read_length):
+        msgs = []
+        if write:
+            write_buf = (ctypes.c_uint8 * len(write)).from_buffer_copy(bytes(write))
+            msgs.append(i2c_msg(address, 0, len(write), write_buf))
+        if read_length:
+            read_buf = (ctypes.c_uint8 * read_length)()
+            msgs.append(i2c_msg(address, I2C_M_RD, read_length, read_buf))
+
+        msg_array = (i2c_msg * len(msgs))(*msgs)
+        request = i2c_rdwr_ioctl_data(msg_array, len(msgs))
+        fcntl.ioctl(self.fd, I2C_RDWR, request)
+
+        if read_length:
+            return bytes(read_buf)
+        return b''
+
+
+class I2CDevice:
+    """A device address on a shared bus."""
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+
+    def write(self, data):
+        self.bus.transfer(self.address, write=data)
+
+    def read(self, length):
+        return self.bus.transfer(self.address, read_length=length)
+
+    def write_read(self, data, length):
+        """Write ``data`` then read ``length`` bytes in one transaction."""
+        return self.bus.transfer(self.address, write=data, read_length=length)
+
+    def stats(self):
+        return self.bus.stats().get(self.address)
+
+
+_buses = {}
+
+
+def get_bus(channel):
+    """Shared ``LinuxI2CBus`` for ``channel``, opened on first use."""
+    bus = _buses.get(channel)
+    if bus is None:
+        bus = _buses[channel] = LinuxI2CBus(channel)
+    return bus
@@ -0,0 +1,81 @@
+"""Pipelined QoS 1 publishing."""
+import time
+
+from sensor_app.stats import Histogram
+
+
+class InflightWindow:
+    """
+        Publishes QoS 1 messages with up to ``size`` awaiting their PUBACK.
+
+        Takes over ``on_publish`` of the paho-style ``client``, whose network
+        loop must run on the same thread. Unlike a blocking QoS 1 publish the
+        sender doesn't wait for each acknowledgement, so over a link with
+        round trip time ``rtt`` throughput is up to ``size / rtt`` messages
+        a second instead of ``1 / rtt``. ``publish`` returns False while the
+        window is full so the caller can hold messages back.
+
+        Acknowledgements are only tracked for flow control. Retransmission
+        is left to the client, which resends unacknowledged messages when it
+        reconnects, so ``reset`` should be called then to start the window
+        afresh. ``timeout`` is how long a caller should wait for the window
+        to open. ``rtt`` is a histogram of PUBACK round trip times in
+        microseconds, measured on ``clock``.
+    """
+    def __init__(self, client, size=16, timeout=10, clock=time.monotonic):
+        self.client = client
+        self.size = size
+        self.timeout = timeout
+        self.clock = clock
+        self.inflight = {}
+        self.rtt = Histogram()
+        self.sent = 0
+        self.acked = 0
+        self.resets = 0
+        self.full_count = 0
+        client.on_publish = self.on_publish
+
+    def __len__(self):
+        return len(self.inflight)
+
+    def full(self):
+        return len(self.inflight) >= self.size
+
+    def publish(self, topic, payload, retain=False):
+        """Send ``payload`` at QoS 1. Returns False if the window is full or the client refused it."""
+        if len(self.inflight) >= self.size:
+            self.full_count += 1
+            return False
+        info = self.client.publish(topic, bytes(payload), qos=1, retain=retain)
+        if info.rc != 0:
+            return False
+        self.inflight[info.mid] = self.clock()
+        self.sent += 1
+        return True
+
+    def on_publish(self, client, userdata, mid):
+        sent_at = self.inflight.pop(mid, None)
+        if sent_at is None:
+            return
+        self.acked += 1
+        self.rtt.record(int((self.clock() - sent_at) * 1000000))
+
+    def reset(self):
+        """
+            Empty the window, on reconnecting. The client resends what was in
+            flight itself; acknowledgements for those are ignored.
+        """
+        if self.inflight:
+            self.resets += 1
+            self.inflight = {}
+
+    def stats(self):
+        return {
+            'inflight': len(self.inflight),
+            'size': self.size,
+            'sent': self.sent,
+            'acked': self.acked,
+            'resets': self.resets,
+            'full': self.full_count,
+            'rtt': self.rtt.as_dict(),
+        }
@@ -1,57 +1,98 @@
 """Main sensor feed loop"""
 import random
 
+from sensor_app.device import GatewayDevice
+from sensor_app.executor import blocking
+from sensor_app.fan import Fan, make_curve
 from sensor_app.sensor_app_cpython import CPythonSensorApplication
-from sensor_app.si7021 import SI7021
+from sensor_app.si7021 import HUMIDITY_OFFSET, HUMIDITY_SCALE, I2C_CHANNEL, SI7021, TEMPERATURE_OFFSET, TEMPERATURE_SCALE
 from sensor_app.pwm_fan import PwmFan
 
 
-def fan_speed_for_temp(temp):
-    """Determine fan PWM duty cycle for given temp."""
-    if temp < 26:
-        return 0
-    elif temp < 28:
-        return 40
-    elif temp < 32:
-        return 50
-    elif temp < 35:
-        return 80
-    else:
-        return 100
+class FanController:
+    """
+        Reads temperature and humidity from an SI7021 and sets a PWM fan's
+        duty cycle from the temperature. ``fan_control`` configures the curve
+        (see ``fan.make_curve``). With ``oversample`` above 1 each reading
+        takes that many samples back to back and publishes their mean, with
+        ``_min``, ``_max`` and ``_stddev`` fields, and the mean drives the
+        fan. Mixed into ``Application`` and ``FanDevice``.
+    """
+    FIELDS = ('temperature', 'humidity', 'fan_duty_cycle')
 
+    def init_hardware(self, pin_fan_pwm, i2c_channel=I2C_CHANNEL, fan_control=None, oversample=1):
+        # configure output pins
+        self.pwm_fan = PwmFan(pin_fan_pwm, 10, 0)
+        self.fan = Fan(self, self.pwm_fan.write)
+        self.fan_curve = make_curve(fan_control)
+        self.si7120 = SI7021(i2c_channel)
+        self.samples = None
+        if oversample > 1:
+            from sensor_app.aggregate import SampleWindow
+
+            # raw codes, calibrated in one pass per reading
+            self.samples = (SampleWindow(oversample, TEMPERATURE_SCALE, TEMPERATURE_OFFSET),
+                            SampleWindow(oversample, HUMIDITY_SCALE, HUMIDITY_OFFSET))
+
+    def init_events(self):
+        # take a reading now, then on fixed slots.
+        self.schedule_reading('temperature', self.event_temperature, run_now=True)
+
+    @blocking(device='si7021', timeout=10)
+    def event_temperature(self, current_time):
+        """Get temperature fields from SI7120."""
+        self.log(current_time, 'Event: temperature')
+        if self.samples is None:
+            temp, humidity = self.si7120.read()
+            self.publish('temperature', temp)
+            self.publish('humidity', humidity)
+        else:
+            temp, humidity = self.read_oversampled()
+        self.observe('temperature', temp, current_time)
+        # the fan schedules the end of its kick, so drive it from the loop
+        self.call_in_loop(self.update_fan, temp, current_time)
+
+    def read_oversampled(self):
+        """Sample the SI7120 ``oversample`` times and publish the summaries. Returns the means."""
+        temp_window, humidity_window = self.samples
+        temp_window.clear()
+        humidity_window.clear()
+        for _ in range(temp_window.size):
+            temp, humidity = self.si7120.read_raw()
+            temp_window.add(temp)
+            humidity_window.add(humidity)
+        return (temp_window.publish(self.publish, 'temperature')['mean'],
+                humidity_window.publish(self.publish, 'humidity')['mean'])
 
-class Application(CPythonSensorApplication):
+    def update_fan(self, temp, current_time):
+        """Set the fan for temperature ``temp``."""
+        duty_cycle = self.fan_curve.duty_cycle(temp, current_time)
+        self.fan.set(duty_cycle, current_time)
+        self.publish('fan_duty_cycle', duty_cycle)
+
+
+class Application(FanController, CPythonSensorApplication):
     DEFAULT_EVENT_PERIOD = 300 # seconds
 
-    def __init__(self, mqtt_host, mqtt_root_topic, mqtt_username, mqtt_password, pin_fan_pwm, proc_path_si7120, event_periods, debug):
+    def __init__(self, mqtt_host, mqtt_root_topic, mqtt_username, mqtt_password, pin_fan_pwm, proc_path_si7120, event_periods, debug, fan_control=None, oversample=1, **kwargs):
         """Setup the application"""
         mqtt_sub_topics = ["halt"]
-        super(Application, self).__init__(mqtt_host, mqtt_root_topic, mqtt_sub_topics, mqtt_username, mqtt_password, event_periods, debug)
-        
-        # configure output pins
-        self.pwm_fan = PwmFan(pin_fan_pwm, 10, 25)
-        self.si7120 = SI7021() 
+        super(Application, self).__init__(mqtt_host, mqtt_root_topic, mqtt_sub_topics, mqtt_username, mqtt_password, event_periods, debug, **kwargs)
+        self.publisher.intern(*self.FIELDS)
+        self.init_hardware(pin_fan_pwm, fan_control=fan_control, oversample=oversample)
 
         self.init_events()                                                                                        
 
-    def init_events(self):
-        # fire off initial events. These are self submitting so each one
-        # will submit the next job to the event queue.
-        self.event_temperature(self.time())
-
     def __del__(self):
         self.mqtt_client.disconnect()
 
-    def event_temperature(self, current_time):
-        """Get temperature fields from SI7120."""
-        self.log(current_time, 'Event: temperature')
-        temp, humidity = self.si7120.read()
-        fan_speed = fan_speed_for_temp(temp)
-        self.pwm_fan.duty_cycle = fan_speed
-        self.mqtt_client.publish(self.mqtt_make_topic('temperature'), temp)
-        self.mqtt_client.publish(self.mqtt_make_topic('humidity'), humidity)
-        self.mqtt_client.publish(self.mqtt_make_topic('fan_duty_cycle'), fan_speed)
-        self.event_schedule_offset(self.event_period('temperature'), self.event_temperature)
+
+class FanDevice(FanController, GatewayDevice):
+    """A fan controller run by a ``Gateway``, with its fan on ``pin_fan_pwm``."""
+    def __init__(self, host, name, pin_fan_pwm, i2c_channel=I2C_CHANNEL, fan_control=None, oversample=1, **kwargs):
+        super(FanDevice, self).__init__(host, name, **kwargs)
+        self.intern(*self.FIELDS)
+        self.init_hardware(pin_fan_pwm, i2c_channel, fan_control, oversample)
 
 def main():
     import sensor_feed_config as config
@@ -59,6 +100,18 @@ def main():
         config.mqtt_host, config.mqtt_root_topic,
         config.mqtt_username, config.mqtt_password,
         config.pin_fan, config.proc_path_si7120, config.event_periods, config.debug,
+        mqtt_batch_topic=getattr(config, 'mqtt_batch_topic', None),
+        outbox_path=getattr(config, 'outbox_path', None),
+        executor_workers=getattr(config, 'executor_workers', 0),
+        deadbands=getattr(config, 'deadbands', None),
+        adaptive_periods=getattr(config, 'adaptive_periods', None),
+        timeseries_path=getattr(config, 'timeseries_path', None),
+        config_path=getattr(config, 'runtime_config_path', None),
+        mqtt_qos=getattr(config, 'mqtt_qos', 0),
+        mqtt_inflight=getattr(config, 'mqtt_inflight', 16),
+        fan_control=getattr(config, 'fan_control', None),
+        oversample=getattr(config, 'si7021_oversample', 1),
+        jitter=getattr(config, 'jitter', 0),
     )
     app.run()
 
@@ -0,0 +1,208 @@
+"""Bounded store-and-forward queue for messages that could not be published."""
+import struct
+
+
+class Outbox:
+    """
+        Fixed capacity FIFO of ``(timestamp, topic, payload)`` entries.
+
+        When full the oldest entry is overwritten so the most recent readings
+        survive a long outage. Subclasses provide the storage through
+        ``_read``/``_write`` and the ``_head``/``_count`` positions.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._head = 0
+        self._count = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.oversized = 0
+        self.sent = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self._count
+
+    def fits(self, topic, payload):
+        """Whether an entry is small enough to store."""
+        return True
+
+    def close(self):
+        """Release the storage."""
+        pass
+
+    def put(self, timestamp, topic, payload):
+        """Store an entry. Returns False if the oldest entry had to be dropped."""
+        kept = True
+        if self._count == self.capacity:
+            self._set_position(self._head + 1, self._count - 1)
+            self.dropped += 1
+            kept = False
+        self._write((self._head + self._count) % self.capacity, timestamp, topic, payload)
+        self._set_position(self._head, self._count + 1)
+        self.enqueued += 1
+        if self._count > self.high_water:
+            self.high_water = self._count
+        return kept
+
+    def peek(self):
+        """The oldest entry, None if empty."""
+        if not self._count:
+            return None
+        return self._read(self._head)
+
+    def pop(self):
+        """Remove and return the oldest entry."""
+        entry = self.peek()
+        if entry is not None:
+            self._set_position(self._head + 1, self._count - 1)
+        return entry
+
+    def drain(self, send, limit=None):
+        """
+            Pass stored entries to ``send(timestamp, topic, payload)`` oldest first.
+
+            Stops at the first entry ``send`` returns False for, leaving it
+            queued, or after ``limit`` entries. Returns the number sent.
+        """
+        count = 0
+        while self._count and (limit is None or count < limit):
+            timestamp, topic, payload = self._read(self._head)
+            if not send(timestamp, topic, payload):
+                break
+            self._set_position(self._head + 1, self._count - 1)
+            count += 1
+        self.sent += count
+        return count
+
+    def shift_time(self, delta):
+        """Add ``delta`` to the timestamps of stored entries, after the clock is stepped."""
+        for n in range(self._count):
+            index = (self._head + n) % self.capacity
+            timestamp, topic, payload = self._read(index)
+            self._write(index, timestamp + delta, topic, payload)
+
+    def stats(self):
+        """Queue depth and counters."""
+        return {
+            'depth': self._count,
+            'capacity': self.capacity,
+            'high_water': self.high_water,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'oversized': self.oversized,
+            'sent': self.sent,
+        }
+
+    def _set_position(self, head, count):
+        self._head = head % self.capacity
+        self._count = count
+
+    def _read(self, index):
+        raise NotImplementedError
+
+    def _write(self, index, timestamp, topic, payload):
+        raise NotImplementedError
+
+
+class RamOutbox(Outbox):
+    """Outbox held in a preallocated list. Used on MicroPython."""
+    def __init__(self, capacity):
+        super(RamOutbox, self).__init__(capacity)
+        self._entries = [None] * capacity
+
+    def _read(self, index):
+        return self._entries[index]
+
+    def _write(self, index, timestamp, topic, payload):
+        self._entries[index] = (timestamp, topic, payload)
+
+    def _set_position(self, head, count):
+        # release the payload of a consumed entry
+        if count < self._count:
+            self._entries[self._head] = None
+        super(RamOutbox, self)._set_position(head, count)
+
+
+class FileOutbox(Outbox):
+    """
+        Outbox in a memory-mapped ring file so queued messages survive a restart.
+
+        The file is a header followed by ``capacity`` fixed size slots. Each
+        slot holds the timestamp, topic and payload lengths and then the data.
+        Entries too large for a slot are not stored; they are counted as
+        dropped and ``oversized``.
+    """
+    MAGIC = b'SOB1'
+    HEADER = '<4sIIII'
+    HEADER_SIZE = struct.calcsize(HEADER)
+    RECORD = '<dHH'
+    RECORD_SIZE = struct.calcsize(RECORD)
+
+    def __init__(self, path, capacity, slot_size=256):
+        import mmap
+        import os
+
+        super(FileOutbox, self).__init__(capacity)
+        self.slot_size = slot_size
+        size = self.HEADER_SIZE + capacity * slot_size
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            fresh = os.fstat(fd).st_size != size
+            if fresh:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, file_capacity, file_slot, head, count = struct.unpack_from(self.HEADER, self._map, 0)
+        if fresh or magic != self.MAGIC or file_capacity != capacity or file_slot != slot_size:
+            head, count = 0, 0
+        self._set_position(head, count)
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+
+    def fits(self, topic, payload):
+        topic = bytes(topic, 'utf-8') if isinstance(topic, str) else topic
+        return self.RECORD_SIZE + len(topic) + len(payload) <= self.slot_size
+
+    def put(self, timestamp, topic, payload):
+        if not self.fits(topic, payload):
+            self.dropped += 1
+            self.oversized += 1
+            return False
+        topic = bytes(topic, 'utf-8') if isinstance(topic, str) else topic
+        return super(FileOutbox, self).put(timestamp, topic, payload)
+
+    def shift_time(self, delta):
+        # rewrite just the timestamps in place
+        for n in range(self._count):
+            offset = self._offset((self._head + n) % self.capacity)
+            timestamp, topic_len, payload_len = struct.unpack_from(self.RECORD, self._map, offset)
+            struct.pack_into(self.RECORD, self._map, offset, timestamp + delta, topic_len, payload_len)
+
+    def _offset(self, index):
+        return self.HEADER_SIZE + index * self.slot_size
+
+    def _read(self, index):
+        offset = self._offset(index)
+        timestamp, topic_len, payload_len = struct.unpack_from(self.RECORD, self._map, offset)
+        offset += self.RECORD_SIZE
+        topic = self._map[offset:offset + topic_len].decode('utf-8')
+        offset += topic_len
+        return timestamp, topic, self._map[offset:offset + payload_len]
+
+    def _write(self, index, timestamp, topic, payload):
+        offset = self._offset(index)
+        struct.pack_into(self.RECORD, self._map, offset, timestamp, len(topic), len(payload))
+        offset += self.RECORD_SIZE
+        self._map[offset:offset + len(topic)] = topic
+        offset += len(topic)
+        self._map[offset:offset + len(payload)] = payload
+
+    def _set_position(self, head, count):
+        super(FileOutbox, self)._set_position(head, count)
+        struct.pack_into(self.HEADER, self._map, 0, self.MAGIC, self.capacity, self.slot_size, self._head, self._count)
@@ -0,0 +1,83 @@
+"""Sleep handling for battery powered boards."""
+try:
+    import json
+except ImportError:
+    import ujson as json
+
+POWER_ALWAYS_ON = 'always_on'
+POWER_LIGHT_SLEEP = 'light_sleep'
+POWER_DEEP_SLEEP = 'deep_sleep'
+
+
+class PowerManager:
+    """
+        Decides how to wait for the next event and persists the schedule
+        across deep sleep.
+
+        ``machine`` is the MicroPython ``machine`` module (or a stand-in for
+        simulation). In ``POWER_ALWAYS_ON`` mode nothing changes. In the low
+        power modes the radio is switched off for waits of at least
+        ``RADIO_OFF_AFTER`` seconds and the board light sleeps. In
+        ``POWER_DEEP_SLEEP`` mode waits of at least ``DEEP_SLEEP_AFTER``
+        seconds deep sleep instead, which resets the board on wake; the
+        pending schedule is kept in RTC memory so ``load_schedule`` can restore
+        it at boot.
+    """
+    RADIO_OFF_AFTER = 30 # seconds
+    DEEP_SLEEP_AFTER = 60 # seconds
+
+    def __init__(self, machine, mode=POWER_ALWAYS_ON):
+        self.machine = machine
+        self.mode = mode
+        self.low_power = mode != POWER_ALWAYS_ON
+        self.light_sleeps = 0
+
+    def radio_off(self, wait):
+        """Whether the radio should be shut down for a wait of ``wait`` seconds."""
+        return self.low_power and wait >= self.RADIO_OFF_AFTER
+
+    def use_deep_sleep(self, wait):
+        return self.mode == POWER_DEEP_SLEEP and wait >= self.DEEP_SLEEP_AFTER
+
+    def light_sleep(self, seconds):
+        self.light_sleeps += 1
+        self.machine.lightsleep(int(seconds * 1000))
+
+    def check_event(self, app, event):
+        """
+            Raise ValueError in ``POWER_DEEP_SLEEP`` mode if ``event`` can't be
+            saved by ``deep_sleep``, as it isn't a method of ``app``.
+        """
+        if self.mode != POWER_DEEP_SLEEP:
+            return
+        name = getattr(event, '__name__', None)
+        # bound methods don't compare equal on every MicroPython port
+        if name is None or not hasattr(app, name) or getattr(event, '__self__', app) is not app:
+            raise ValueError('{0!r} is not a method of the application, so would be lost in deep sleep'.format(event))
+
+    def deep_sleep(self, seconds, pending, current_time):
+        """
+            Save ``pending`` ``(dtime, event)`` pairs and deep sleep. Does not return.
+
+            Events are saved by method name so must be methods of the
+            application that restores them, see ``check_event``.
+        """
+        data = [current_time, [[dtime, event.__name__] for dtime, event in pending]]
+        self.machine.RTC().memory(bytes(json.dumps(data), 'utf-8'))
+        self.machine.deepsleep(int(seconds * 1000))
+
+    def load_schedule(self):
+        """
+            ``(slept_at, [(dtime, event name), ...])`` saved before a deep
+            sleep, None if the board did not wake from deep sleep.
+        """
+        if self.machine.reset_cause() != self.machine.DEEPSLEEP_RESET:
+            return None
+        memory = self.machine.RTC().memory()
+        if not memory:
+            return None
+        try:
+            slept_at, pending = json.loads(memory)
+            return slept_at, [(dtime, name) for dtime, name in pending]
+        except ValueError:
+            return None
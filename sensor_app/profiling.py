@@ -0,0 +1,65 @@
+"""On-demand CPU and memory profiling triggered over MQTT."""
+import cProfile
+import io
+import pstats
+import tracemalloc
+
+PROFILE_CPU = 'cpu'
+PROFILE_MEMORY = 'memory'
+DEFAULT_SECONDS = 10
+REPORT_LINES = 25
+
+
+class Profiler:
+    """
+        Runs ``cProfile`` or ``tracemalloc`` for a while and publishes a report.
+
+        ``command`` takes a payload such as ``b"cpu 30"`` or ``b"memory"``.
+        When the time is up the top ``REPORT_LINES`` entries are published to
+        the ``profile/result`` sub-topic.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.kind = None
+        self._profile = None
+        self._snapshot = None
+
+    def command(self, payload):
+        parts = payload.decode('utf-8').split()
+        kind = parts[0] if parts else PROFILE_CPU
+        seconds = float(parts[1]) if len(parts) > 1 else DEFAULT_SECONDS
+        return self.start(kind, seconds)
+
+    def start(self, kind, seconds):
+        """Start profiling for ``seconds``. Returns False if already running."""
+        if self.kind is not None:
+            return False
+        if kind == PROFILE_CPU:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif kind == PROFILE_MEMORY:
+            tracemalloc.start()
+            self._snapshot = tracemalloc.take_snapshot()
+        else:
+            raise ValueError('Unknown profile type: {0}'.format(kind))
+        self.kind = kind
+        self.app.event_schedule_offset(seconds, self.stop)
+        return True
+
+    def stop(self, current_time):
+        """Finish profiling and publish the report."""
+        if self.kind == PROFILE_CPU:
+            self._profile.disable()
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(REPORT_LINES)
+            report = out.getvalue()
+            self._profile = None
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            lines = [str(stat) for stat in snapshot.compare_to(self._snapshot, 'lineno')[:REPORT_LINES]]
+            report = '\n'.join(lines)
+            self._snapshot = None
+        self.kind = None
+        self.app.log(current_time, 'Profile complete')
+        self.app.mqtt_send(self.app.mqtt_make_topic('profile', 'result'), bytes(report, 'utf-8'))
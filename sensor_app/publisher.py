@@ -0,0 +1,353 @@
+"""Buffered MQTT publishing."""
+try:
+    import json
+except ImportError:
+    import ujson as json
+import struct
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+FLOAT_DECIMALS = 3
+FLOAT_LIMIT = 1000000 # larger floats are formatted by encode_value
+_FLOAT_SCALE = 10 ** FLOAT_DECIMALS
+
+
+def encode_value(value):
+    """Payload for a single reading."""
+    if isinstance(value, bytes):
+        return value
+    return bytes(str(value), 'utf-8')
+
+
+def _write_digits(buf, pos, number):
+    start = pos
+    while True:
+        buf[pos] = 48 + number % 10
+        number //= 10
+        pos += 1
+        if not number:
+            break
+    end = pos - 1
+    while start < end:
+        buf[start], buf[end] = buf[end], buf[start]
+        start += 1
+        end -= 1
+    return pos
+
+
+def format_value(buf, value):
+    """
+        Write the payload for a numeric reading into ``buf`` without building
+        intermediate strings. Returns the length written.
+
+        Ints are written as by ``encode_value``; floats are rounded to
+        ``FLOAT_DECIMALS`` places with trailing zeros dropped. Returns -1 for
+        anything else, including floats of ``FLOAT_LIMIT`` or more and values
+        too long for ``buf``, which should go through ``encode_value``.
+    """
+    if isinstance(value, bool):
+        return -1
+    if isinstance(value, float):
+        if not -FLOAT_LIMIT < value < FLOAT_LIMIT:
+            # also catches nan
+            return -1
+        scaled = int(round(abs(value) * _FLOAT_SCALE))
+        number = scaled // _FLOAT_SCALE
+    elif isinstance(value, int):
+        scaled = None
+        number = abs(value)
+    else:
+        return -1
+    try:
+        pos = 0
+        if value < 0 and (scaled is None or scaled):
+            buf[0] = 45 # '-'
+            pos = 1
+        pos = _write_digits(buf, pos, number)
+        if scaled is not None:
+            buf[pos] = 46 # '.'
+            pos += 1
+            fraction = scaled % _FLOAT_SCALE
+            divisor = _FLOAT_SCALE // 10
+            while True:
+                buf[pos] = 48 + fraction // divisor
+                pos += 1
+                fraction %= divisor
+                divisor //= 10
+                if not fraction or not divisor:
+                    break
+    except IndexError:
+        return -1
+    return pos
+
+
+def encode_json(readings):
+    """Coalesce readings into a JSON object keyed on field name."""
+    return bytes(json.dumps(dict(readings)), 'utf-8')
+
+
+def encode_binary(readings):
+    """
+        Coalesce readings into a compact binary block.
+
+        A count byte followed by, for each reading, a name length byte, the
+        utf-8 name and the value as a little-endian float32.
+    """
+    parts = [struct.pack('B', len(readings))]
+    for name, value in readings:
+        name = bytes(name, 'utf-8')
+        parts.append(struct.pack('B', len(name)))
+        parts.append(name)
+        parts.append(struct.pack('<f', value))
+    return b''.join(parts)
+
+
+def decode_binary(payload):
+    """Inverse of ``encode_binary``. Returns a list of ``(name, value)``."""
+    readings = []
+    count = payload[0]
+    pos = 1
+    for _ in range(count):
+        length = payload[pos]
+        pos += 1
+        name = str(payload[pos:pos + length], 'utf-8')
+        pos += length
+        readings.append((name, struct.unpack('<f', payload[pos:pos + 4])[0]))
+        pos += 4
+    return readings
+
+
+class Deadband:
+    """
+        Report-by-exception rule for one field.
+
+        A reading is sent if it differs from the last one sent by at least
+        ``absolute``, or by at least ``percent`` percent of it, or if nothing
+        has been sent for ``heartbeat`` seconds. With neither threshold set
+        any change is sent. The first reading is always sent. ``retain``
+        publishes the field as a retained message, for slow changing state
+        a new subscriber should see straight away.
+    """
+    def __init__(self, absolute=None, percent=None, heartbeat=None, retain=False):
+        self.absolute = absolute
+        self.percent = percent
+        self.heartbeat = heartbeat
+        self.retain = retain
+        self.last_value = None
+        self.last_time = None
+
+    def changed(self, value):
+        last = self.last_value
+        if self.absolute is None and self.percent is None:
+            return value != last
+        try:
+            delta = abs(value - last)
+        except TypeError:
+            return value != last
+        if not delta:
+            # otherwise a threshold of 0, or a percentage of 0, passes
+            return False
+        if self.absolute is not None and delta >= self.absolute:
+            return True
+        return self.percent is not None and delta >= abs(last) * self.percent / 100
+
+    def accept(self, value, current_time):
+        """Whether ``value`` should be sent. Records it as sent if so."""
+        send = (self.last_time is None or
+                (self.heartbeat is not None and current_time is not None and
+                 current_time - self.last_time >= self.heartbeat) or
+                self.changed(value))
+        if send:
+            self.last_value = value
+            self.last_time = current_time if current_time is not None else 0
+        return send
+
+
+ENCODERS = {
+    FORMAT_JSON: encode_json,
+    FORMAT_BINARY: encode_binary,
+}
+
+
+class Publisher:
+    """
+        Buffer readings produced within a tick and publish them together.
+
+        ``publish`` is called as ``publish(topic, payload)`` and ``make_topic``
+        builds a topic from sub-topic names; topics are built once and cached.
+        With ``batch_topic`` unset each reading is sent to its own topic as
+        before. With it set, the buffered readings are coalesced into a single
+        payload on that sub-topic in the given ``fmt``. With ``group_batches``
+        also set, readings named ``<group>/<field>``, as a gateway's devices
+        publish them, are coalesced per group on ``<group>/<batch_topic>``
+        keyed on ``<field>``.
+
+        The buffer is flushed when it holds ``max_batch`` readings, or by
+        ``tick`` once the oldest reading is ``max_age`` seconds old.
+
+        ``deadbands`` maps field names to ``Deadband`` keyword arguments.
+        Readings of those fields that haven't changed enough are dropped and
+        counted in ``suppressed``. Fields with ``retain`` set are published as
+        ``publish(topic, payload, True)`` when not coalesced.
+
+        With ``payload_buffer`` set, single numeric readings are formatted
+        into a reusable buffer of that many bytes (see ``format_value``) and
+        ``publish`` is given a ``memoryview`` of it. The view is only valid
+        during the call so ``publish`` must copy it to keep it.
+    """
+    def __init__(self, publish, make_topic, batch_topic=None, fmt=FORMAT_JSON, max_batch=32, max_age=0,
+                 payload_buffer=0, deadbands=None):
+        self._publish = publish
+        self._make_topic = make_topic
+        self._topics = {}
+        self._encode = ENCODERS[fmt]
+        self.batch_topic = batch_topic
+        self.max_batch = max_batch
+        self.max_age = max_age
+        # [name, value] pairs reused for pending readings, the first
+        # ``_count`` of which are queued; a list emptied with ``del`` would
+        # give up its storage and allocate it again on the next append
+        self._pairs = [[None, None] for _ in range(max_batch)]
+        self._count = 0
+        self._oldest = None
+        self._buffer = None
+        self._views = None
+        if payload_buffer:
+            self._buffer = bytearray(payload_buffer)
+            # a view of each length, built on first use, as slicing allocates
+            self._views = [None] * (payload_buffer + 1)
+        self.deadbands = {}
+        for name, rule in (deadbands or {}).items():
+            self.set_deadband(name, rule)
+        self.group_batches = False
+        self.sent = 0
+        self.readings = 0
+        self.suppressed = 0
+
+    def set_deadband(self, name, rule):
+        """Apply ``Deadband`` keyword arguments ``rule`` to ``name``, or remove its rule if None."""
+        if rule is None:
+            self.deadbands.pop(name, None)
+        else:
+            self.deadbands[name] = Deadband(**rule)
+
+    def shift_time(self, delta):
+        """Move the times readings were taken by ``delta`` seconds, after the clock is stepped."""
+        if self._oldest is not None:
+            self._oldest += delta
+        for rule in self.deadbands.values():
+            if rule.last_time is not None:
+                rule.last_time += delta
+
+    def topic(self, *sub_topics):
+        """Cached topic for ``sub_topics``."""
+        # single names, the common case, are keyed on the name itself
+        key = sub_topics[0] if len(sub_topics) == 1 else sub_topics
+        topic = self._topics.get(key)
+        if topic is None:
+            topic = self._make_topic(*sub_topics)
+            self._topics[key] = topic
+        return topic
+
+    def intern(self, *names):
+        """Build the topics for ``names`` up front."""
+        for name in names:
+            self.topic(name)
+        if self.batch_topic is not None:
+            self.topic(self.batch_topic)
+
+    def add(self, name, value, current_time=None):
+        """Queue a reading for publishing, unless its deadband suppresses it."""
+        rule = self.deadbands.get(name)
+        if rule is not None and not rule.accept(value, current_time):
+            self.suppressed += 1
+            return
+        self.readings += 1
+        count = self._count
+        if not count:
+            self._oldest = current_time
+        pair = self._pairs[count]
+        pair[0] = name
+        pair[1] = value
+        self._count = count + 1
+        if self._count >= self.max_batch:
+            self.flush()
+
+    def tick(self, current_time):
+        """Flush if the oldest pending reading has reached ``max_age``."""
+        if not self._count:
+            return
+        if self._oldest is None or current_time - self._oldest >= self.max_age:
+            self.flush()
+
+    def _payload(self, value):
+        if self._buffer is not None:
+            length = format_value(self._buffer, value)
+            if length >= 0:
+                view = self._views[length]
+                if view is None:
+                    view = memoryview(self._buffer)[:length]
+                    self._views[length] = view
+                return view
+        return encode_value(value)
+
+    def flush(self):
+        """Publish everything pending."""
+        count = self._count
+        if not count:
+            return
+        self._oldest = None
+        pairs = self._pairs
+        try:
+            if self.batch_topic is None:
+                topics = self._topics
+                deadbands = self.deadbands
+                # indexed rather than iterated, as the iterator is allocated
+                i = 0
+                while i < count:
+                    name, value = pairs[i]
+                    i += 1
+                    topic = topics.get(name)
+                    if topic is None:
+                        topic = self.topic(name)
+                    rule = deadbands.get(name)
+                    if rule is not None and rule.retain:
+                        self._publish(topic, self._payload(value), True)
+                    else:
+                        self._publish(topic, self._payload(value))
+                    self.sent += 1
+            elif self.group_batches:
+                self._flush_groups(pairs[:count])
+            else:
+                self._publish(self.topic(self.batch_topic), self._encode(pairs[:count]))
+                self.sent += 1
+        finally:
+            self._count = 0
+
+    def _flush_groups(self, readings):
+        groups = {}
+        order = []
+        for name, value in readings:
+            group, sep, field = name.partition('/')
+            if not sep:
+                group, field = None, name
+            batch = groups.get(group)
+            if batch is None:
+                batch = groups[group] = []
+                order.append(group)
+            batch.append((field, value))
+        for group in order:
+            if group is None:
+                topic = self.topic(self.batch_topic)
+            else:
+                topic = self.topic(group, self.batch_topic)
+            self._publish(topic, self._encode(groups[group]))
+            self.sent += 1
+
+    def stats(self):
+        """Messages sent, and readings queued or suppressed by deadbands."""
+        return {
+            'sent': self.sent,
+            'readings': self.readings,
+            'suppressed': self.suppressed,
+        }
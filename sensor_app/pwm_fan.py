@@ -1,29 +1,46 @@
 import time
 
-from gpiozero import PWMOutputDevice
+from sensor_app.fan import KICK_DUTY_CYCLE, KICK_SECONDS, KICK_THRESHOLD
 
 
 class PwmFan:
+    """PWM fan output. Duty cycles are percentages."""
     def __init__(self, pin, freq, duty_cycle):
+        # gpiozero is slow to import, so only load it once a fan is set up
+        from gpiozero import PWMOutputDevice
+
         self.pwm = None
 
         self.pwm = PWMOutputDevice(pin, True, 0, freq)
-        self.pwm.value = duty_cycle
-        self.pwm.on()
+        # on() would be full speed, so just set the duty cycle
+        self.write(duty_cycle)
 
     def __del__(self):
         if self.pwm is not None:
             self.pwm.off()
 
+    def write(self, value):
+        """Set the duty cycle straight away, without a kick. See ``fan.Fan``."""
+        self.pwm.value = value / 100
+
     @property
     def duty_cycle(self):
-        return self.pwm.value
+        return self.pwm.value * 100
 
     @duty_cycle.setter
     def duty_cycle(self, value):
-        if value < 60:
+        if 0 < value < KICK_THRESHOLD and self.pwm.value == 0:
             # Low duty cycle fails to start fan. Give it a burst to get
             # spinning.
-            self.pwm.value = 90
-            time.sleep(3)
-        self.pwm.value = value
+            self.write(KICK_DUTY_CYCLE)
+            time.sleep(KICK_SECONDS)
+        self.write(value)
+
+    async def set_duty_cycle_async(self, value):
+        """As the ``duty_cycle`` setter but yields to the event loop during the kick."""
+        import asyncio
+
+        if 0 < value < KICK_THRESHOLD and self.pwm.value == 0:
+            self.write(KICK_DUTY_CYCLE)
+            await asyncio.sleep(KICK_SECONDS)
+        self.write(value)
@@ -0,0 +1,197 @@
+"""Settings updated over MQTT while running."""
+try:
+    import json
+except ImportError:
+    import ujson as json
+try:
+    import os
+except ImportError:
+    import uos as os
+
+from sensor_app.commands import parse_json
+
+MIN_PERIOD = 1 # seconds
+ADAPTIVE_KEYS = ('min_period', 'max_period', 'rate', 'variance', 'window', 'backoff')
+DEADBAND_KEYS = ('absolute', 'percent', 'heartbeat', 'retain')
+
+
+def _number(value, minimum, what):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        raise ValueError('{0}: expected a number >= {1}, got {2!r}'.format(what, minimum, value))
+
+
+def _whole(value, minimum, what):
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError('{0}: expected a whole number >= {1}, got {2!r}'.format(what, minimum, value))
+
+
+def _period(value, what):
+    # board event tables hold whole seconds
+    if isinstance(value, bool) or not isinstance(value, int) or value < MIN_PERIOD:
+        raise ValueError('{0}: expected whole seconds >= {1}, got {2!r}'.format(what, MIN_PERIOD, value))
+
+
+def _section(settings, name):
+    section = settings.get(name, {})
+    if not isinstance(section, dict):
+        raise ValueError('{0}: expected an object'.format(name))
+    return section
+
+
+class RuntimeConfig:
+    """
+        Event periods, adaptive periods and deadbands updated without a restart.
+
+        Listens on the ``config`` sub-topic, normally published retained so a
+        device picks up the latest settings whenever it connects, for JSON
+        such as ``{"event_periods": {"temperature": 120}, "deadbands":
+        {"temperature": {"absolute": 0.5}}}``. Each sensor listed replaces
+        its settings in that section; ``adaptive_periods`` entries are merged
+        into the existing ones, and an adaptive period or deadband of ``null``
+        removes it. Readings moving between fixed and adaptive periods have
+        their jobs swapped (see ``SensorApplication.set_adaptive_period``). On a
+        gateway a device's readings are named ``<device>/<reading>`` and
+        keys for devices that don't exist are rejected (see
+        ``SensorApplication.config_target``). An update is validated as a
+        whole before any of it is applied. Pending runs of jobs whose period
+        changes are moved in place.
+
+        With ``path`` the updates received are kept in that JSON file, on
+        flash on a MicroPython board, and applied again at start up. The
+        file is only written when something changes.
+    """
+    def __init__(self, app, path=None, sub_topic='config'):
+        self.app = app
+        self.path = path
+        self.settings = {}
+        self.updates = 0
+        # updated in place from here on, so don't share the dicts passed in
+        app.event_periods = dict(app.event_periods)
+        app.adaptive_periods = dict(app.adaptive_periods)
+        self.restore()
+        self.command = app.commands.add(sub_topic, self.command_config, parse=self.parse)
+
+    def restore(self):
+        """Apply the updates saved in ``path``, if any."""
+        saved = self.load()
+        if saved is not None:
+            self.apply(saved, self.app.time(), save=False)
+
+    def load(self):
+        """The saved updates, None if there are none or they are unreadable."""
+        if self.path is None:
+            return None
+        try:
+            with open(self.path) as f:
+                return self.validate(json.load(f))
+        except OSError:
+            return None
+        except ValueError as err:
+            self.app.log(self.app.time(), 'Ignoring {0}: {1}'.format(self.path, err))
+            return None
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.settings, f)
+        try:
+            os.rename(temp_path, self.path)
+        except OSError:
+            # FAT filesystems won't rename over an existing file
+            os.remove(self.path)
+            os.rename(temp_path, self.path)
+
+    def parse(self, payload):
+        return self.validate(parse_json(payload))
+
+    def validate(self, settings):
+        """Return ``settings`` if they can be applied, otherwise raise ValueError."""
+        if not isinstance(settings, dict):
+            raise ValueError('expected an object')
+        for name in settings:
+            if name not in ('event_periods', 'adaptive_periods', 'deadbands'):
+                raise ValueError('unknown section {0!r}'.format(name))
+
+        for name, period in _section(settings, 'event_periods').items():
+            self.app.config_target(name)
+            _period(period, name)
+
+        for name, rule in _section(settings, 'adaptive_periods').items():
+            target, reading = self.app.config_target(name)
+            if rule is None:
+                continue
+            if not isinstance(rule, dict):
+                raise ValueError('{0}: expected an object or null'.format(name))
+            merged = dict(target.adaptive_periods.get(reading, {}))
+            merged.update(rule)
+            for key, value in rule.items():
+                if key not in ADAPTIVE_KEYS:
+                    raise ValueError('{0}: unknown setting {1!r}'.format(name, key))
+                if key in ('min_period', 'max_period'):
+                    _period(value, name + '.' + key)
+                elif key in ('window', 'backoff'):
+                    # a count of readings, and a factor keeping periods whole
+                    _whole(value, 1, name + '.' + key)
+                elif value is not None:
+                    _number(value, 0, name + '.' + key)
+            if 'min_period' not in merged or 'max_period' not in merged:
+                raise ValueError('{0}: min_period and max_period are needed'.format(name))
+            if merged['min_period'] > merged['max_period']:
+                raise ValueError('{0}: min_period is above max_period'.format(name))
+
+        for name, rule in _section(settings, 'deadbands').items():
+            self.app.config_target(name)
+            if rule is None:
+                continue
+            if not isinstance(rule, dict):
+                raise ValueError('{0}: expected an object or null'.format(name))
+            for key, value in rule.items():
+                if key not in DEADBAND_KEYS:
+                    raise ValueError('{0}: unknown setting {1!r}'.format(name, key))
+                if key == 'retain':
+                    if not isinstance(value, bool):
+                        raise ValueError('{0}.retain: expected true or false'.format(name))
+                elif value is not None:
+                    _number(value, 0, name + '.' + key)
+        return settings
+
+    def command_config(self, topic, settings):
+        self.apply(settings, self.app.time())
+
+    def apply(self, settings, current_time, save=True):
+        """Apply validated ``settings``. Returns whether anything changed."""
+        app = self.app
+        changed = {}
+        for name, period in settings.get('event_periods', {}).items():
+            target, reading = app.config_target(name)
+            if target.event_periods.get(reading) != period:
+                target.set_event_period(reading, period, current_time)
+                changed.setdefault('event_periods', {})[name] = period
+        for name, rule in settings.get('adaptive_periods', {}).items():
+            target, reading = app.config_target(name)
+            if rule is None:
+                if reading in target.adaptive_periods:
+                    target.set_adaptive_period(reading, None, current_time)
+                    changed.setdefault('adaptive_periods', {})[name] = None
+                continue
+            current = target.adaptive_periods.get(reading, {})
+            merged = dict(current)
+            merged.update(rule)
+            if merged != current:
+                target.set_adaptive_period(reading, merged, current_time)
+                changed.setdefault('adaptive_periods', {})[name] = merged
+        applied = self.settings.get('deadbands', {})
+        for name, rule in settings.get('deadbands', {}).items():
+            if name not in applied or applied[name] != rule:
+                app.publisher.set_deadband(name, rule)
+                changed.setdefault('deadbands', {})[name] = rule
+        if not changed:
+            return False
+
+        for section, values in changed.items():
+            self.settings.setdefault(section, {}).update(values)
+        self.updates += 1
+        app.log(current_time, 'Config updated: {0}'.format(changed))
+        if save and self.path is not None:
+            self.save()
+        return True
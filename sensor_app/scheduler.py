@@ -0,0 +1,456 @@
+"""Timer queue for scheduled events."""
+from array import array
+
+try:
+    import heapq
+except ImportError:
+    import uheapq as heapq
+
+
+class EventQueue:
+    """
+        Min-heap of pending events keyed on trigger time.
+
+        Each entry is a list of ``[dtime, seq, event]``. The sequence number
+        breaks ties so that events due at the same time fire in the order they
+        were scheduled, and means the event callables are never compared.
+
+        The entry itself is returned as the handle for ``cancel``. Cancelled
+        entries stay in the heap with their event cleared and are dropped when
+        they reach the top.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def push(self, dtime, event):
+        """Add ``event`` to trigger at ``dtime``. Returns a cancellable handle."""
+        entry = [dtime, self._seq, event]
+        self._seq += 1
+        heapq.heappush(self._heap, entry)
+        return entry
+
+    def reschedule(self, handle, dtime):
+        """
+            Move a pending event to ``dtime``, keeping its handle.
+
+            Returns False if the event has already fired or been cancelled.
+        """
+        if handle[2] is None:
+            return False
+        handle[0] = dtime
+        # the entry's position is unknown; re-heapifying is O(n) but rare
+        heapq.heapify(self._heap)
+        return True
+
+    def shift_time(self, delta):
+        """Move every pending event ``delta`` seconds, after the clock is stepped."""
+        # the same shift for all keeps the heap ordered
+        for entry in self._heap:
+            entry[0] += delta
+
+    def cancel(self, handle):
+        """
+            Cancel a pending event.
+
+            Returns False if the event has already fired or been cancelled.
+        """
+        if handle[2] is None:
+            return False
+        handle[2] = None
+        self._cancelled += 1
+        return True
+
+    def _discard_cancelled(self):
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+
+    def next_time(self):
+        """Trigger time of the earliest pending event, None if queue is empty."""
+        self._discard_cancelled()
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def pop(self):
+        """Remove and return ``(dtime, event)`` for the earliest pending event."""
+        self._discard_cancelled()
+        entry = heapq.heappop(self._heap)
+        event = entry[2]
+        # Clear the event so a late cancel() on this handle is a no-op.
+        entry[2] = None
+        return entry[0], event
+
+    def pop_due(self, current_time):
+        """Remove and return ``(dtime, event)`` for all events due at or before ``current_time``."""
+        due = []
+        while True:
+            dtime = self.next_time()
+            if dtime is None or dtime > current_time:
+                return due
+            due.append(self.pop())
+
+    def pending(self):
+        """All pending ``(dtime, event)`` pairs in trigger order."""
+        return [(entry[0], entry[2]) for entry in sorted(self._heap) if entry[2] is not None]
+
+    def clear(self):
+        """Remove all pending events."""
+        # as in pop, so that handles already given out no longer cancel
+        for entry in self._heap:
+            entry[2] = None
+        self._heap = []
+        self._cancelled = 0
+
+
+class EventTable:
+    """
+        Fixed capacity event queue for MicroPython.
+
+        Deadlines, sequence numbers and handler indices live in preallocated
+        ``array``s and each distinct handler is stored once in ``handlers``,
+        so scheduling a handler that has been seen before allocates nothing.
+        Trigger times must be integers, as from ``utime.time()``.
+
+        Same interface as ``EventQueue`` except that handles are integers and
+        ``pop_due`` returns ``[dtime, event]`` pairs in a list, all reused by
+        the next call. Finding
+        the earliest event is a linear scan, which is cheap for the handful
+        of events a board schedules.
+    """
+    SEQ_MASK = 0x3FFFFFFF # keep sequence numbers small ints on MicroPython
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.handlers = []
+        self._index = {}
+        self._times = array('l', [0] * capacity)
+        self._seqs = array('l', [0] * capacity)
+        self._slots = array('h', [-1] * capacity)
+        self._gens = array('H', [0] * capacity)
+        self._seq = 0
+        self._count = 0
+        self._due = []
+        self._pairs = [[0, None] for _ in range(capacity)]
+
+    def __len__(self):
+        return self._count
+
+    def push(self, dtime, event):
+        """Add ``event`` to trigger at ``dtime``. Returns a cancellable handle."""
+        if self._count == self.capacity:
+            raise IndexError('event table full')
+        index = self._index.get(event)
+        if index is None:
+            index = len(self.handlers)
+            self.handlers.append(event)
+            self._index[event] = index
+        slots = self._slots
+        i = 0
+        while slots[i] >= 0:
+            i += 1
+        slots[i] = index
+        self._times[i] = dtime
+        self._seqs[i] = self._seq
+        self._seq = (self._seq + 1) & self.SEQ_MASK
+        self._count += 1
+        return self._gens[i] * self.capacity + i
+
+    def _free(self, i):
+        self._slots[i] = -1
+        self._gens[i] = (self._gens[i] + 1) & 0xFFFF
+        self._count -= 1
+
+    def cancel(self, handle):
+        """
+            Cancel a pending event.
+
+            Returns False if the event has already fired or been cancelled,
+            or for a None handle.
+        """
+        if handle is None:
+            return False
+        i = handle % self.capacity
+        if self._slots[i] < 0 or self._gens[i] * self.capacity + i != handle:
+            return False
+        self._free(i)
+        return True
+
+    def reschedule(self, handle, dtime):
+        """
+            Move a pending event to ``dtime``, keeping its handle.
+
+            Returns False if the event has already fired or been cancelled,
+            or for a None handle.
+        """
+        if handle is None:
+            return False
+        i = handle % self.capacity
+        if self._slots[i] < 0 or self._gens[i] * self.capacity + i != handle:
+            return False
+        self._times[i] = dtime
+        return True
+
+    def shift_time(self, delta):
+        """Move every pending event ``delta`` seconds, after the clock is stepped."""
+        times = self._times
+        for i in range(self.capacity):
+            if self._slots[i] >= 0:
+                times[i] += delta
+
+    def _earliest(self):
+        times = self._times
+        seqs = self._seqs
+        slots = self._slots
+        best = -1
+        for i in range(self.capacity):
+            if slots[i] < 0:
+                continue
+            if best < 0 or times[i] < times[best] or (times[i] == times[best] and seqs[i] < seqs[best]):
+                best = i
+        return best
+
+    def next_time(self):
+        """Trigger time of the earliest pending event, None if queue is empty."""
+        i = self._earliest()
+        if i < 0:
+            return None
+        return self._times[i]
+
+    def pop(self):
+        """Remove and return ``(dtime, event)`` for the earliest pending event."""
+        i = self._earliest()
+        if i < 0:
+            raise IndexError('pop from empty event table')
+        dtime = self._times[i]
+        event = self.handlers[self._slots[i]]
+        self._free(i)
+        return dtime, event
+
+    def pop_due(self, current_time):
+        """Remove and return ``[dtime, event]`` for all events due at or before ``current_time``."""
+        due = self._due
+        del due[:]
+        while True:
+            i = self._earliest()
+            if i < 0 or self._times[i] > current_time:
+                return due
+            # fill a preallocated pair rather than building a tuple per event
+            pair = self._pairs[len(due)]
+            pair[0] = self._times[i]
+            pair[1] = self.handlers[self._slots[i]]
+            self._free(i)
+            due.append(pair)
+
+    def pending(self):
+        """All pending ``(dtime, event)`` pairs in trigger order."""
+        live = [(self._times[i], self._seqs[i], self._slots[i]) for i in range(self.capacity) if self._slots[i] >= 0]
+        return [(dtime, self.handlers[index]) for dtime, seq, index in sorted(live)]
+
+    def clear(self):
+        """Remove all pending events."""
+        for i in range(self.capacity):
+            if self._slots[i] >= 0:
+                self._free(i)
+
+
+def stable_offset(key, span):
+    """
+        Offset in ``[0, span)`` derived from ``key``.
+
+        Uses FNV-1a rather than ``hash`` so the value is the same on every
+        boot and on both CPython and MicroPython.
+    """
+    if not span:
+        return 0
+    value = 0x811C9DC5
+    for byte in bytes(key, 'utf-8'):
+        value = ((value ^ byte) * 0x01000193) & 0xFFFFFFFF
+    return value % int(span)
+
+
+class PeriodicJob:
+    """
+        Event that runs ``handler`` on fixed slots of ``period`` seconds.
+
+        Slots are at ``phase + n * period`` epoch seconds, so the time a
+        handler takes never shifts later runs. If the handler (or the loop)
+        runs past the next slot, the slots that were missed are skipped and
+        counted in ``missed``, and the run is counted in ``overruns``, both
+        here and in the application's ``stats``.
+
+        ``app`` provides ``time``, ``log``, ``stats``, ``run_handler``,
+        ``event_schedule_dtime``, ``event_reschedule`` and ``event_cancel``.
+    """
+    def __init__(self, app, period, handler, phase=0, name=None):
+        self.app = app
+        self.period = period
+        self.handler = handler
+        self.phase = phase
+        self.name = name or getattr(handler, '__name__', 'periodic')
+        self.runs = 0
+        self.missed = 0
+        self.overruns = 0
+        self.next_time = None
+        self._handle = None
+        self._cancelled = False
+
+    def next_slot(self, after):
+        """First slot strictly after ``after``."""
+        return ((after - self.phase) // self.period + 1) * self.period + self.phase
+
+    def start(self, after, run_now=False):
+        """Schedule the first run, at ``after`` if ``run_now`` else the next slot."""
+        self._cancelled = False
+        self._schedule(after if run_now else self.next_slot(after))
+
+    def cancel(self):
+        self._cancelled = True
+        if self._handle is not None:
+            self.app.event_cancel(self._handle)
+            self._handle = None
+
+    def _schedule(self, dtime):
+        self.next_time = dtime
+        self._handle = self.app.event_schedule_dtime(dtime, self)
+
+    def _move(self, dtime):
+        self.next_time = dtime
+        self.app.event_reschedule(self._handle, dtime)
+
+    def set_period(self, period, current_time):
+        """Change the period, moving a pending run to the first new slot after ``current_time``."""
+        self.period = period
+        if self._handle is not None:
+            next_time = self.next_slot(current_time)
+            if next_time != self.next_time:
+                self._move(next_time)
+
+    def shift_time(self, delta, current_time):
+        """
+            Follow the clock being stepped ``delta`` seconds to ``current_time``.
+
+            A run that was due stays due and later runs move to the next slot
+            on the corrected clock.
+        """
+        if self.next_time is None:
+            return
+        next_time = self.next_time + delta
+        if self._handle is None:
+            # running, or cancelled; the next slot follows on from this
+            self.next_time = next_time
+        elif next_time > current_time:
+            self._move(self.next_slot(current_time))
+        else:
+            self._move(next_time)
+
+    def __call__(self, current_time):
+        self._handle = None
+        self.runs += 1
+        self.app.run_handler(self.handler, current_time)
+        if self._cancelled:
+            return
+
+        # read after the handler, which may have stepped the clock
+        next_time = self.next_slot(self.next_time)
+        now = self.app.time()
+        if now > next_time:
+            skipped = int((now - next_time) // self.period) + 1
+            self.missed += skipped
+            self.overruns += 1
+            stats = self.app.stats
+            stats.missed += skipped
+            stats.overruns += 1
+            self.app.log(now, 'Overrun: {0} missed {1} tick(s)'.format(self.name, skipped))
+            next_time += skipped * self.period
+        self._schedule(next_time)
+
+
+class AdaptiveJob(PeriodicJob):
+    """
+        ``PeriodicJob`` whose period follows the signal being sampled.
+
+        The handler feeds each reading to ``observe``. If the value is
+        changing faster than ``rate`` units per second, or the variance of
+        the last ``window`` readings is at least ``variance``, the period drops
+        to ``min_period``. Otherwise it grows by ``backoff`` times per reading
+        up to ``max_period``, where it starts. Slots stay on the fixed
+        ``phase + n * period`` grid; powers of ``backoff`` between the bounds
+        keep them lined up.
+    """
+    def __init__(self, app, min_period, max_period, handler, rate=None, variance=None, window=4, backoff=2,
+                 phase=0, name=None):
+        super(AdaptiveJob, self).__init__(app, max_period, handler, phase, name)
+        self.min_period = min_period
+        self.max_period = max_period
+        self.rate = rate
+        self.variance = variance
+        self.window = window
+        self.backoff = backoff
+        self.speedups = 0
+        self._values = []
+        self._last_time = None
+
+    def active(self, value, current_time):
+        """Whether ``value`` shows the signal moving."""
+        values = self._values
+        if (self.rate is not None and values and self._last_time is not None and
+                current_time > self._last_time and
+                abs(value - values[-1]) / (current_time - self._last_time) >= self.rate):
+            return True
+        if self.variance is not None and len(values) >= self.window - 1:
+            count = len(values) + 1
+            mean = (sum(values) + value) / count
+            spread = sum((v - mean) ** 2 for v in values) + (value - mean) ** 2
+            if spread / count >= self.variance:
+                return True
+        return False
+
+    def observe(self, value, current_time):
+        """Record a reading and adjust the period. Returns the new period."""
+        if self.active(value, current_time):
+            period = self.min_period
+        else:
+            period = min(self.period * self.backoff, self.max_period)
+        self._values.append(value)
+        if len(self._values) >= self.window:
+            self._values.pop(0)
+        self._last_time = current_time
+        if period != self.period:
+            self.set_period(period, current_time)
+        return period
+
+    def set_period(self, period, current_time):
+        """Change the period, bringing a pending run forward if the new slots are sooner."""
+        if period < self.period:
+            self.speedups += 1
+            self.app.log(current_time, 'Sampling {0} every {1}s'.format(self.name, period))
+        self.period = period
+        if self._handle is not None:
+            next_time = self.next_slot(current_time)
+            if next_time < self.next_time:
+                self._move(next_time)
+
+    def shift_time(self, delta, current_time):
+        super(AdaptiveJob, self).shift_time(delta, current_time)
+        if self._last_time is not None:
+            self._last_time += delta
+
+    def configure(self, current_time, min_period, max_period, rate=None, variance=None, window=4, backoff=2):
+        """Replace the settings given to the constructor, keeping the period within the new bounds."""
+        self.min_period = min_period
+        self.max_period = max_period
+        self.rate = rate
+        self.variance = variance
+        self.window = window
+        self.backoff = backoff
+        del self._values[:max(len(self._values) - window + 1, 0)]
+        period = min(max(self.period, min_period), max_period)
+        if period != self.period:
+            self.set_period(period, current_time)
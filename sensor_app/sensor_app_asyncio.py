@@ -0,0 +1,156 @@
+"""Feed handler running on an asyncio event loop."""
+import asyncio
+
+from sensor_app.sensor_app_cpython import CPythonSensorApplication
+from sensor_app.stats import event_name
+
+
+class AsyncSensorApplication(CPythonSensorApplication):
+    """
+        Sensor application where events may be coroutine functions.
+
+        Due events are started as tasks so a slow sensor conversion only
+        delays its own publish. The paho client is driven from the same
+        asyncio loop through its socket callbacks instead of ``loop()``.
+    """
+    MQTT_MISC_INTERVAL = 1 # seconds
+
+    def __init__(self, *args, **kwargs):
+        """Setup the application"""
+        self._aio_loop = None
+        self._wakeup = None
+        self._tasks = set()
+        super(AsyncSensorApplication, self).__init__(*args, **kwargs)
+        self.mqtt_client.on_socket_open = self.mqtt_on_socket_open
+        self.mqtt_client.on_socket_close = self.mqtt_on_socket_close
+        self.mqtt_client.on_socket_register_write = self.mqtt_on_socket_register_write
+        self.mqtt_client.on_socket_unregister_write = self.mqtt_on_socket_unregister_write
+        if self.executor is not None:
+            # finished blocking handlers are processed straight away
+            self.executor.notify = self._wake_threadsafe
+
+    def mqtt_connect(self):
+        """Connection is deferred to ``run`` once the asyncio loop exists."""
+        if self._aio_loop is not None:
+            super(AsyncSensorApplication, self).mqtt_connect()
+
+    def event_schedule_dtime(self, dtime, event):
+        handle = super(AsyncSensorApplication, self).event_schedule_dtime(dtime, event)
+        self._wake()
+        return handle
+
+    def mqtt_recieve(self, client, userdata, msg):
+        super(AsyncSensorApplication, self).mqtt_recieve(client, userdata, msg)
+        self._wake()
+
+    def _wake(self):
+        """Interrupt the current wait so the queue is re-examined."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _wake_threadsafe(self):
+        """``_wake`` from any thread, e.g. the executor's workers."""
+        aio_loop = self._aio_loop
+        if aio_loop is not None and not aio_loop.is_closed():
+            aio_loop.call_soon_threadsafe(self._wake)
+
+    def mqtt_on_socket_open(self, client, userdata, sock):
+        self._aio_loop.add_reader(sock, client.loop_read)
+
+    def mqtt_on_socket_close(self, client, userdata, sock):
+        self._aio_loop.remove_reader(sock)
+
+    def mqtt_on_socket_register_write(self, client, userdata, sock):
+        self._aio_loop.add_writer(sock, client.loop_write)
+
+    def mqtt_on_socket_unregister_write(self, client, userdata, sock):
+        self._aio_loop.remove_writer(sock)
+
+    async def _mqtt_misc(self):
+        """Keepalive and reconnect housekeeping normally done by ``loop()``."""
+        while not self.should_bail:
+            self.mqtt_check_connection()
+            self.mqtt_client.loop_misc()
+            await asyncio.sleep(self.MQTT_MISC_INTERVAL)
+
+    def run(self):
+        """Main event loop. Will run loop until ``should_bail`` is True."""
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        """Run the event loop as a coroutine inside an existing asyncio loop."""
+        self._aio_loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.should_bail = False
+        self.startup.mark('run')
+
+        # the first pass starts the first readings, then connects
+        misc = asyncio.ensure_future(self._mqtt_misc())
+        try:
+            while not self.should_bail:
+                await self.loop_async()
+            if self._tasks:
+                await asyncio.wait(self._tasks)
+        finally:
+            misc.cancel()
+            self.mqtt_client.disconnect()
+            if self.executor is not None:
+                self.executor.shutdown()
+            if self.timeseries is not None:
+                self.timeseries.close()
+            self.outbox.close()
+
+    def loop(self):
+        raise RuntimeError("AsyncSensorApplication is driven by loop_async()")
+
+    async def loop_async(self):
+        """The inner-event loop."""
+        self.pre_event_handler()
+
+        current_time = self.time()
+        start = self.ticks_us()
+        for dtime, event in self._events.pop_due(current_time):
+            self.stats.lag.record(int((current_time - dtime) * 1000000))
+            event_start = self.ticks_us()
+            # coroutine handlers are timed to their first await
+            self.run_handler(event, current_time)
+            self.stats.handler(event_name(event)).record(self.ticks_diff(self.ticks_us(), event_start))
+        self.post_event_handler(current_time)
+        self.stats.iteration.record(self.ticks_diff(self.ticks_us(), start))
+        self.stats.record_queue_depth(len(self._events))
+
+        if self.should_bail:
+            return
+
+        seconds = self.wait_time()
+        if self.executor is not None and self.executor.busy():
+            # handlers that overrun their timeout are only noticed by polling
+            seconds = min(seconds, self.EXECUTOR_POLL)
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def run_handler(self, handler, current_time):
+        """
+            Call an event handler, running it as a task if it returns a coroutine.
+
+            Periodic jobs run their handler through here too, so coroutine
+            handlers can be scheduled either way. Handlers marked ``blocking``
+            go to the executor as before.
+        """
+        if getattr(handler, 'blocking_device', None) is not None:
+            super(AsyncSensorApplication, self).run_handler(handler, current_time)
+            return
+        result = handler(current_time)
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self._tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        self.post_event_handler(self.time())
+        if not task.cancelled() and task.exception() is not None:
+            self.log(self.time(), 'Event failed: {0!r}'.format(task.exception()))
@@ -1,15 +1,37 @@
 """Abstract feed handler."""
+try:
+    import json
+except ImportError:
+    import ujson as json
+
+from sensor_app.commands import CommandTable
+from sensor_app.scheduler import AdaptiveJob, EventQueue, PeriodicJob, stable_offset
+from sensor_app.startup import StartupTimer
+from sensor_app.stats import LoopStats, event_name
+
 
 class SensorApplication:
     DEFAULT_EVENT_PERIOD = 300 # seconds
+    MAX_WAIT = 30 # seconds
 
-    def __init__(self, event_periods, debug):
+    def __init__(self, event_periods, debug, adaptive_periods=None, jitter=0):
         """Setup the application"""
-        self._events = []
+        self.startup = StartupTimer()
+        self.startup.mark('init')
+        self._events = EventQueue()
 
         self.should_bail = False
         self.debug = debug
         self.event_periods = event_periods
+        self.adaptive_periods = adaptive_periods or {}
+        # spread of reading slots, see schedule_periodic
+        self.jitter = jitter
+        self._adaptive_jobs = {}
+        self._period_jobs = {}
+        self.stats = LoopStats()
+        # remote commands, including methods declared with ``commands.command``
+        self.commands = CommandTable(self)
+        self.commands.add_declared(self)
 
     def log(self, current_time, message):
         """Simple logging to stout."""
@@ -22,15 +44,150 @@ class SensorApplication:
         
             Trigger date/time is specified in epoch seconds. i.e. response from
             ``utime.time()``.
+
+            Returns a handle that can be passed to ``event_cancel``.
         """
-        self._events.append((dtime, event))
+        return self._events.push(dtime, event)
 
     def event_schedule_offset(self, offset_secs, event):
         """
             Add a new event to the queue to be triggered ``offset_secs`` from current time.
         """
-        dtime_secs = self.time() + offset_secs
-        self._events.append((dtime_secs, event))
+        return self.event_schedule_dtime(self.time() + offset_secs, event)
+
+    def event_cancel(self, handle):
+        """Cancel a scheduled event. Returns False if it has already fired."""
+        return self._events.cancel(handle)
+
+    def event_reschedule(self, handle, dtime):
+        """Move a scheduled event to ``dtime`` in place. Returns False if it has already fired."""
+        return self._events.reschedule(handle, dtime)
+
+    def schedule_periodic(self, period, handler, phase=0, jitter=0, run_now=False, after=None):
+        """
+            Run ``handler`` every ``period`` seconds on fixed wall-clock slots.
+
+            Slots fall at ``phase`` seconds past each multiple of ``period``.
+            ``jitter`` adds a fixed offset in ``[0, jitter)`` derived from
+            ``jitter_key`` and the handler name, so devices sharing a config
+            don't all fire on the same second. With ``run_now`` the first
+            run is immediate, otherwise it is the first slot after ``after``
+            (default now). Returns the ``PeriodicJob``, which can be cancelled.
+        """
+        name = getattr(handler, '__name__', 'periodic')
+        phase += stable_offset(self.jitter_key() + name, jitter)
+        job = PeriodicJob(self, period, handler, phase, name)
+        job.start(self.time() if after is None else after, run_now)
+        return job
+
+    def schedule_reading(self, name, handler, jitter=None, run_now=False, after=None):
+        """
+            Schedule reads of sensor ``name``, or any job run every ``event_period(name)``.
+
+            If ``adaptive_periods`` has an entry for ``name`` (``AdaptiveJob``
+            keyword arguments, at least ``min_period`` and ``max_period``) the
+            period adapts to readings passed to ``observe``. Otherwise reads
+            are every ``event_period(name)``, following ``set_event_period``.
+            ``jitter`` defaults to the application's. Returns the job.
+        """
+        if jitter is None:
+            jitter = self.jitter
+        job_name = getattr(handler, '__name__', name)
+        phase = stable_offset(self.jitter_key() + job_name, jitter)
+        return self._start_reading(name, handler, phase, job_name, run_now, after)
+
+    def _start_reading(self, name, handler, phase, job_name, run_now=False, after=None):
+        settings = self.adaptive_periods.get(name)
+        if settings is None:
+            job = PeriodicJob(self, self.event_period(name), handler, phase, job_name)
+            self._period_jobs[name] = job
+        else:
+            job = AdaptiveJob(self, handler=handler, phase=phase, name=job_name, **settings)
+            self._adaptive_jobs[name] = job
+        job.start(self.time() if after is None else after, run_now)
+        return job
+
+    def set_event_period(self, name, period, current_time):
+        """Change ``event_periods[name]``, moving the pending run of the job scheduled for it."""
+        self.event_periods[name] = period
+        job = self._period_jobs.get(name)
+        if job is not None:
+            job.set_period(period, current_time)
+
+    def set_adaptive_period(self, name, settings, current_time):
+        """
+            Change ``adaptive_periods[name]``, or remove it if ``settings`` is
+            None, updating the job scheduled for it. A reading moving between
+            a fixed and an adaptive schedule has its job replaced, keeping the
+            handler and phase, with the first run at the next slot.
+        """
+        job = self._adaptive_jobs.get(name)
+        if settings is not None and job is not None:
+            self.adaptive_periods[name] = settings
+            job.configure(current_time, **settings)
+            return
+        if settings is None:
+            self.adaptive_periods.pop(name, None)
+            old = self._adaptive_jobs.pop(name, None)
+        else:
+            self.adaptive_periods[name] = settings
+            old = self._period_jobs.pop(name, None)
+        if old is not None:
+            old.cancel()
+            self._start_reading(name, old.handler, old.phase, old.name, after=current_time)
+
+    def config_target(self, name):
+        """
+            Application and reading a runtime config key ``name`` applies to.
+
+            Raises ValueError for a key nothing here would use. Hosts of
+            several devices route ``<device>/<reading>`` keys to the device.
+        """
+        if '/' in name:
+            raise ValueError('{0}: no such device'.format(name))
+        return self, name
+
+    def observe(self, name, value, current_time):
+        """Feed a reading of sensor ``name`` to its adaptive schedule, if it has one."""
+        job = self._adaptive_jobs.get(name)
+        if job is not None:
+            job.observe(value, current_time)
+
+    def clock_stepped(self, delta, current_time):
+        """
+            Correct for the clock being set ``delta`` seconds, as by NTP, to ``current_time``.
+
+            One-off events keep their distance from now; periodic jobs move to
+            their slots on the corrected clock. Subclasses correct anything
+            else timed on the old clock.
+        """
+        self._events.shift_time(delta)
+        jobs = [event for dtime, event in self._events.pending() if isinstance(event, PeriodicJob)]
+        # a job running now isn't in the queue
+        for job in list(self._period_jobs.values()) + list(self._adaptive_jobs.values()):
+            if job not in jobs:
+                jobs.append(job)
+        for job in jobs:
+            job.shift_time(delta, current_time)
+
+    def startup_report(self, current_time):
+        """
+            The ``startup`` stage times as a JSON payload once the first
+            reading has been published, otherwise None. Only returned once.
+        """
+        stages = self.startup.report()
+        if stages is None:
+            return None
+        self.log(current_time, 'Startup ms: {0}'.format(stages))
+        return json.dumps(stages)
+
+    def call_in_loop(self, func, *args):
+        """Call ``func(*args)`` on the loop thread. Here there is only the one."""
+        func(*args)
+
+    def jitter_key(self):
+        """Per-device string used to spread periodic jobs."""
+        return ''
 
     def event_period(self, value):
         """Look-up period in event_periods, default if not found."""
@@ -39,6 +196,7 @@ class SensorApplication:
     def run(self):
         """Main event loop. Will run loop until ``should_bail`` is True."""
         self.should_bail = False
+        self.startup.mark('run')
         while not self.should_bail:
             self.loop()
 
@@ -50,22 +208,43 @@ class SensorApplication:
         # Get current time
         current_time = self.time()
 
-        # loop over list of pending events
-        triggered = []
-        for i in range(len(self._events)):
-            # if current time greater than event trigger time then
-            # trigger event
-            if self._events[i][0] <= current_time:
-                # call the event callback.
-                self._events[i][1](current_time)
-                triggered.append(i)
+        # pop everything that is due before calling any of it so that events
+        # scheduled by a handler wait for the next pass.
+        start = self.ticks_us()
+        for dtime, event in self._events.pop_due(current_time):
+            self.stats.lag.record(int((current_time - dtime) * 1000000))
+            event_start = self.ticks_us()
+            self.run_handler(event, current_time)
+            self.stats.handler(event_name(event)).record(self.ticks_diff(self.ticks_us(), event_start))
 
-        # remove handled events
-        for i in triggered[::-1]:
-            del self._events[i]       
+        # Flush anything the events produced
+        self.post_event_handler(current_time)
+        self.stats.iteration.record(self.ticks_diff(self.ticks_us(), start))
+        self.stats.record_queue_depth(len(self._events))
 
-        # sleep a bit
-        self.sleep(1)
+        # wait until the next event is due
+        if not self.should_bail:
+            self.wait(self.wait_time())
+
+    def run_handler(self, handler, current_time):
+        """Call an event handler. Subclasses may run some handlers elsewhere."""
+        handler(current_time)
+
+    def wait_time(self):
+        """Seconds until the next event is due, capped at ``MAX_WAIT``."""
+        next_time = self._events.next_time()
+        if next_time is None:
+            return self.MAX_WAIT
+        return min(max(next_time - self.time(), 0), self.MAX_WAIT)
+
+    def wait(self, seconds):
+        """
+            Block until the next event is due.
+
+            Subclasses with a network connection can override this to return
+            early when a message arrives.
+        """
+        self.sleep(seconds)
 
     def time(self):
         """Get current time."""
@@ -79,10 +258,22 @@ class SensorApplication:
         """Format timeval as localtime struct."""
         raise NotImplementedError
 
+    def ticks_us(self):
+        """Microsecond counter for measuring durations."""
+        return int(self.time() * 1000000)
+
+    def ticks_diff(self, end, start):
+        """Difference between two ``ticks_us`` values."""
+        return end - start
+
     def init_events(self):
         """Trigger initial events."""
         pass
 
     def pre_event_handler(self):
         """Perform any housekeeping in event loop."""
+        pass
+
+    def post_event_handler(self, current_time):
+        """Perform any housekeeping after due events have run."""
         pass
\ No newline at end of file
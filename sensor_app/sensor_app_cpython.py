@@ -1,22 +1,115 @@
 """Abstract feed handler."""
+import json
 import time
 
-import paho.mqtt.client as mqtt
-
+from sensor_app.commands import command
+from sensor_app.outbox import FileOutbox, RamOutbox
+from sensor_app.publisher import Publisher, FORMAT_JSON
+from sensor_app.runtime_config import RuntimeConfig
 from sensor_app.sensor_app_base import SensorApplication
 
+MQTT_ERR_SUCCESS = 0 # paho.mqtt.client.MQTT_ERR_SUCCESS, without importing paho up front
+
 
 class CPythonSensorApplication(SensorApplication):
-    def __init__(self, mqtt_host, mqtt_root_topic, mqtt_sub_topics, mqtt_username, mqtt_password, *args, **kwargs):
+    EXECUTOR_POLL = 0.1 # seconds between checks on pool handlers
+    OUTBOX_SIZE = 10000 # messages
+    OUTBOX_SLOT_SIZE = 4096 # bytes per message in a file outbox, enough for the stats report
+    OUTBOX_DRAIN_BATCH = 100 # messages per loop pass
+    RECONNECT_INTERVAL = 10 # seconds
+
+    def __init__(self, mqtt_host, mqtt_root_topic, mqtt_sub_topics, mqtt_username, mqtt_password, *args,
+                 mqtt_batch_topic=None, mqtt_batch_format=FORMAT_JSON, outbox_path=None,
+                 enable_profiling=False, executor_workers=0, deadbands=None, timeseries_path=None, config_path=None,
+                 mqtt_qos=0, mqtt_inflight=16, mqtt_ack_timeout=10, **kwargs):
         """Setup the application"""
         super(CPythonSensorApplication, self).__init__(*args, **kwargs)
+        self.mqtt_host = mqtt_host
         self.mqtt_root_topic = mqtt_root_topic
-        self.mqtt_sub_topics = mqtt_sub_topics
-        self.mqtt_client = mqtt.Client()
+        self.mqtt_sub_topics = list(mqtt_sub_topics)
+        self.executor = None
+        if executor_workers:
+            from sensor_app.executor import HandlerExecutor
+            self.executor = HandlerExecutor(self, executor_workers)
+        self.profiler = None
+        if enable_profiling:
+            from sensor_app.profiling import Profiler
+            self.profiler = Profiler(self)
+            self.commands.add('profile', self.mqtt_profile)
+        self.timeseries = None
+        if timeseries_path is not None:
+            from sensor_app.timeseries import TimeSeriesStore
+            self.timeseries = TimeSeriesStore(timeseries_path)
+            self.commands.add('query', self.mqtt_answer_query)
+        self.mqtt_client = self.mqtt_make_client()
         self.mqtt_client.username_pw_set(mqtt_username, mqtt_password)
         self.mqtt_client.on_connect = self.mqtt_on_connect
+        self.mqtt_client.on_disconnect = self.mqtt_on_disconnect
         self.mqtt_client.on_message = self.mqtt_recieve
-        self.mqtt_client.connect(mqtt_host, 1883, 60)
+        self.inflight = None
+        if mqtt_qos:
+            from sensor_app.inflight import InflightWindow
+            self.inflight = InflightWindow(self.mqtt_client, mqtt_inflight, mqtt_ack_timeout, self.time)
+            # the window limits what is sent; paho's own limit, with the
+            # messages it resends on reconnecting on top, would only queue
+            # publishes inside paho where the outbox can't see them
+            self.mqtt_client.max_inflight_messages_set(0)
+        if outbox_path is None:
+            self.outbox = RamOutbox(self.OUTBOX_SIZE)
+        else:
+            self.outbox = FileOutbox(outbox_path, self.OUTBOX_SIZE, self.OUTBOX_SLOT_SIZE)
+        self._retained = {}
+        self._last_connect_attempt = None
+        # connect() has been called and the CONNACK, read by loop(), is awaited
+        self._mqtt_connecting = False
+        self.publisher = Publisher(
+            self.mqtt_send, self.mqtt_make_topic,
+            batch_topic=mqtt_batch_topic, fmt=mqtt_batch_format, deadbands=deadbands,
+        )
+        self.runtime_config = RuntimeConfig(self, config_path)
+        # connected from the loop, after the first readings are started
+
+        if 'stats' in self.event_periods:
+            self.schedule_reading('stats', self.event_publish_stats)
+
+    def mqtt_make_client(self):
+        """Create the MQTT client. Simulations override this to use an in-process broker."""
+        import paho.mqtt.client as mqtt
+
+        return mqtt.Client()
+
+    def mqtt_connect(self):
+        """
+            Connect to the MQTT broker.
+
+            A failed connection is logged rather than raised; readings are
+            stored in the outbox until ``mqtt_check_connection`` gets through.
+            The client only counts as connected once ``loop`` has read the
+            broker's CONNACK.
+        """
+        self._last_connect_attempt = self.time()
+        try:
+            if self.mqtt_client.is_connected():
+                return
+            self.mqtt_client.connect(self.mqtt_host, 1883, 60)
+            self._mqtt_connecting = True
+        except OSError as err:
+            self._mqtt_connecting = False
+            self.log(self._last_connect_attempt, 'MQTT connect failed: {0}'.format(err))
+
+    def mqtt_check_connection(self):
+        """
+            Reconnect if the connection has dropped, at most every ``RECONNECT_INTERVAL``.
+
+            Returns whether there is a connection for ``loop`` to service,
+            either established or waiting on its CONNACK.
+        """
+        if self.mqtt_client.is_connected():
+            return True
+        last = self._last_connect_attempt
+        if last is None or self.time() - last >= self.RECONNECT_INTERVAL:
+            self.mqtt_connect()
+        return self._mqtt_connecting
 
     def time(self):
         """Get current time."""
@@ -30,22 +123,215 @@ class CPythonSensorApplication(SensorApplication):
         """Format timeval as localtime struct."""
         return time.localtime(timeval)
 
+    def ticks_us(self):
+        """Microsecond counter for measuring durations."""
+        return int(time.perf_counter() * 1000000)
+
+    def jitter_key(self):
+        return self.mqtt_root_topic
+
     def mqtt_make_topic(self, *sub_topics):
         """Build mqtt topic strings."""
         return "/".join((self.mqtt_root_topic,) + sub_topics)
 
     def mqtt_on_connect(self, client, userdata, flags, rc):
+        self._mqtt_connecting = False
+        if rc != 0: # paho.mqtt.client.CONNACK_ACCEPTED
+            self.log(self.time(), 'MQTT connection refused: {0}'.format(rc))
+            return
+        self.startup.mark('mqtt')
+        if self.inflight is not None:
+            self.inflight.reset()
         # Subscribing in on_connect() means that if we lose the connection and
         # reconnect then subscriptions will be renewed.
+        topics = self.commands.filters()
         for topic in self.mqtt_sub_topics:
-            self.mqtt_client.subscribe(self.mqtt_make_topic(topic))
+            topic = self.mqtt_make_topic(topic)
+            if topic not in topics:
+                topics.append(topic)
+        for topic in topics:
+            self.mqtt_client.subscribe(topic)
+
+    def mqtt_on_disconnect(self, client, userdata, rc):
+        self._mqtt_connecting = False
+
+    def mqtt_subscribe_filters(self, topics):
+        """Subscribe to ``topics``, e.g. the ``filters`` of newly added commands, if connected."""
+        if self.mqtt_client.is_connected():
+            for topic in topics:
+                self.mqtt_client.subscribe(topic)
 
     def mqtt_recieve(self, client, userdata, msg):
         """Received messages from subscriptions will be delivered to this callback."""
-        if msg.topic == self.mqtt_make_topic("halt"):
-            self.should_bail = True
+        current_time = self.time()
+        # payloads may be binary; decoding strictly would raise in paho's callback
+        self.log(current_time, msg.topic + ': ' + msg.payload.decode('utf-8', 'replace'))
+        self.commands.dispatch(msg.topic, msg.payload, current_time)
+
+    @command('halt')
+    def mqtt_halt(self, topic, payload):
+        self.should_bail = True
+
+    def mqtt_profile(self, topic, payload):
+        try:
+            self.profiler.command(payload)
+        except ValueError as err:
+            self.log(self.time(), 'Bad profile command: {0}'.format(err))
 
-        self.log(self.time(), msg.topic + ': ' + msg.payload.decode('utf-8'))
+    def mqtt_answer_query(self, topic, payload):
+        """
+            Reply to a history query on ``query/result``, or ``query/result/<id>``
+            if the query has an id. See ``TimeSeriesStore.handle_query``.
+        """
+        try:
+            query_id, result = self.timeseries.handle_query(payload)
+        except ValueError as err:
+            self.log(self.time(), 'Bad query: {0}'.format(err))
+            return
+        if query_id is None:
+            topic = self.mqtt_make_topic('query', 'result')
+        else:
+            topic = self.mqtt_make_topic('query', 'result', str(query_id))
+        self.mqtt_send(topic, result)
+
+    def call_in_loop(self, func, *args):
+        """Call ``func(*args)`` now if on the loop thread, otherwise at the next loop pass."""
+        if self.executor is not None and not self.executor.in_loop_thread():
+            self.executor.call_soon(func, *args)
+        else:
+            func(*args)
+
+    def publish(self, name, value):
+        """
+            Queue a reading for publishing on the ``name`` sub-topic.
+
+            Safe to call from handlers running on the executor.
+        """
+        self.call_in_loop(self._add_reading, name, value, self.time())
+
+    def _add_reading(self, name, value, current_time):
+        if self.timeseries is not None:
+            self.timeseries.add(name, current_time, value)
+        self.publisher.add(name, value, current_time)
+
+    def observe(self, name, value, current_time):
+        """Safe to call from handlers running on the executor."""
+        self.call_in_loop(super(CPythonSensorApplication, self).observe, name, value, current_time)
+
+    def run_handler(self, handler, current_time):
+        """Run handlers marked ``blocking`` on the executor when there is one."""
+        if self.executor is not None and getattr(handler, 'blocking_device', None) is not None:
+            self.executor.submit(handler, current_time)
+        else:
+            handler(current_time)
+
+    def run(self):
+        try:
+            super(CPythonSensorApplication, self).run()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+            if self.timeseries is not None:
+                self.timeseries.close()
+            self.outbox.close()
+
+    def mqtt_send(self, topic, payload, retain=False):
+        """
+            Publish now if connected and nothing is waiting, otherwise store in the outbox.
+
+            Only the latest retained message per topic matters, so while
+            disconnected those are held aside and sent on reconnect instead.
+        """
+        if retain:
+            if not self._mqtt_publish_stored(self.time(), topic, payload, True):
+                self._retained[topic] = payload
+            return
+        if not len(self.outbox) and self._mqtt_publish_stored(self.time(), topic, payload):
+            return
+        if not self.outbox.fits(topic, payload):
+            self.log(self.time(), 'Outbox: dropped {0} byte message for {1}, too large to store'.format(
+                len(payload), topic))
+        self.outbox.put(self.time(), topic, payload)
+
+    def _mqtt_send_retained(self):
+        for topic in list(self._retained):
+            if not self._mqtt_publish_stored(self.time(), topic, self._retained[topic], True):
+                return
+            del self._retained[topic]
+
+    def _mqtt_publish_stored(self, timestamp, topic, payload, retain=False):
+        if not self.mqtt_client.is_connected():
+            return False
+        if self.inflight is not None and self.inflight.full():
+            # held in the outbox until acknowledgements free the window
+            return False
+        start = self.ticks_us()
+        if self.inflight is not None:
+            ok = self.inflight.publish(topic, payload, retain)
+        else:
+            ok = self.mqtt_client.publish(topic, payload, retain=retain).rc == MQTT_ERR_SUCCESS
+        self.stats.publish.record(self.ticks_us() - start)
+        if not ok:
+            self.stats.publish_failures += 1
+        elif not self.startup.reported:
+            self.startup.mark('first_publish')
+        return ok
+
+    def event_publish_stats(self, current_time):
+        """Publish loop statistics to the ``stats`` sub-topic and start a new interval."""
+        stats = self.stats.as_dict()
+        stats['outbox'] = self.outbox.stats()
+        stats['publisher'] = self.publisher.stats()
+        stats['commands'] = self.commands.stats()
+        if self.inflight is not None:
+            stats['inflight'] = self.inflight.stats()
+            self.inflight.rtt.reset()
+        self.mqtt_send(self.mqtt_make_topic('stats'), bytes(json.dumps(stats), 'utf-8'))
+        self.stats.reset()
 
     def pre_event_handler(self):
-        self.mqtt_client.loop()
\ No newline at end of file
+        """
+            With QoS 1, hold due events back while the in-flight window is
+            full, for up to ``mqtt_ack_timeout``, so readings aren't taken
+            faster than the link can carry them.
+        """
+        if self.inflight is None:
+            return
+        start = self.time()
+        while (self.inflight.full() and self.mqtt_client.is_connected() and
+               self.time() - start < self.inflight.timeout):
+            self.mqtt_client.loop(timeout=self.inflight.timeout)
+
+    def post_event_handler(self, current_time):
+        if self._last_connect_attempt is None:
+            self.mqtt_connect()
+        if self.executor is not None:
+            self.executor.process()
+        self.publisher.tick(current_time)
+        if self._retained:
+            self._mqtt_send_retained()
+        # drain in bounded batches so a long backlog doesn't hold up due events
+        if len(self.outbox):
+            self.outbox.drain(self._mqtt_publish_stored, self.OUTBOX_DRAIN_BATCH)
+        if not self.startup.reported:
+            report = self.startup_report(current_time)
+            if report is not None:
+                self.mqtt_send(self.mqtt_make_topic('startup'), bytes(report, 'utf-8'))
+
+    def wait(self, seconds):
+        """
+            Service the MQTT connection until the next event is due or a message arrives.
+
+            While connecting this is what reads the CONNACK, so the loop runs
+            as soon as a connection is pending, not only once it is up.
+        """
+        if self.mqtt_check_connection():
+            if (self.mqtt_client.is_connected() and len(self.outbox) and
+                    (self.inflight is None or not self.inflight.full())):
+                # keep draining the backlog between events
+                seconds = 0
+            elif self.executor is not None and self.executor.busy():
+                seconds = min(seconds, self.EXECUTOR_POLL)
+            self.mqtt_client.loop(timeout=seconds)
+        else:
+            self.sleep(min(seconds, self.RECONNECT_INTERVAL))
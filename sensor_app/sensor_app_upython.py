@@ -1,13 +1,125 @@
 """Abstract feed handler."""
+import machine
 import utime
+from umqtt.simple import MQTTClient
 
+from sensor_app.commands import command
+from sensor_app.outbox import RamOutbox
+from sensor_app.power import PowerManager, POWER_ALWAYS_ON
+from sensor_app.publisher import Publisher
+from sensor_app.runtime_config import RuntimeConfig
+from sensor_app.scheduler import EventTable, PeriodicJob
 from sensor_app.sensor_app_base import SensorApplication
+from sensor_app.stats import event_name
+from sensor_app.wifi import WifiStation
 
 
 class UPythonSensorApplication(SensorApplication):
-    def __init__(self, *args, **kwargs):
+    """
+        Sensor application for MicroPython boards using WiFi and umqtt.
+
+        Publishes go through a ``Publisher`` and a RAM outbox so a broker
+        outage doesn't stall the loop. Events are kept in a fixed size
+        ``EventTable`` and readings formatted into a reusable buffer to keep
+        garbage, and so GC pauses, out of the loop. Subclasses declare MQTT
+        commands with ``commands.command`` or add them with ``mqtt_subscribe``.
+        In the low power modes of ``PowerManager`` the network is only
+        brought up when something is sent.
+
+        Start up is staged: WiFi is connected from the loop, so the first
+        readings are taken while it comes up, with MQTT and the clock
+        following once it is. ``wifi_cache_path`` keeps the settings of the
+        last good connection to make the next one quicker (see
+        ``WifiStation``); the scan for the access point that needs is run
+        once, in a wait of at least ``WIFI_SCAN_IDLE``. Stage times are published once to the ``startup``
+        sub-topic after the first reading is sent.
+    """
+    # umqtt has no blocking wait with a timeout so poll for messages at least this often.
+    MQTT_POLL_INTERVAL = 1 # seconds
+    NETWORK_POLL_MS = 50 # between checks on a WiFi connection in progress
+    WIFI_SCAN_IDLE = 5 # seconds free before the next event to scan for the access point
+    CLOCK_STEP = 2 # seconds; NTP corrections smaller than this are just drift
+    OUTBOX_SIZE = 64 # messages held while the broker is unreachable
+    OUTBOX_DRAIN_BATCH = 8 # messages per loop pass
+    RECONNECT_INTERVAL = 30 # seconds
+    EVENT_CAPACITY = 16 # events scheduled at once
+    PAYLOAD_BUFFER = 32 # bytes, for formatting single readings
+
+    def __init__(self, network_ssid, network_password, mqtt_host, mqtt_root_topic, *args, **kwargs):
         """Setup the application"""
+        mqtt_batch_topic = kwargs.pop('mqtt_batch_topic', None)
+        power_mode = kwargs.pop('power_mode', POWER_ALWAYS_ON)
+        deadbands = kwargs.pop('deadbands', None)
+        config_path = kwargs.pop('config_path', None)
+        wifi_cache_path = kwargs.pop('wifi_cache_path', None)
         super(UPythonSensorApplication, self).__init__(*args, **kwargs)
+        self._events = EventTable(self.EVENT_CAPACITY)
+        self.events_dropped = 0
+        self.power = PowerManager(machine, power_mode)
+
+        self.wifi = WifiStation(network_ssid, network_password, wifi_cache_path)
+        self.network_up = False
+        self.clock_synced_at = None
+
+        self.mqtt_root_topic = mqtt_root_topic
+        self.mqtt_client = MQTTClient("umqtt_client", mqtt_host)
+        self.mqtt_client.set_callback(self.mqtt_recieve)
+        self.mqtt_connected = False
+        self.mqtt_last_attempt = 0
+
+        self.outbox = RamOutbox(self.OUTBOX_SIZE)
+        self._retained = {}
+        self.publisher = Publisher(self.mqtt_send, self.mqtt_make_topic, batch_topic=mqtt_batch_topic,
+                                   payload_buffer=self.PAYLOAD_BUFFER, deadbands=deadbands)
+        self.runtime_config = RuntimeConfig(self, config_path)
+
+    def __del__(self):
+        self.mqtt_client.disconnect()
+
+    def start(self):
+        """
+            Start connecting, unless in a low power mode, and restore any
+            schedule saved before deep sleep. The loop finishes connecting.
+
+            Returns the time the board went to sleep if a schedule was
+            restored, otherwise None and the caller should fire its initial
+            events.
+        """
+        if not self.power.low_power:
+            self.network_begin()
+
+        restored = self.power.load_schedule()
+        if restored is None:
+            return None
+        slept_at, pending = restored
+        for dtime, name in pending:
+            self.restore_event(dtime, name)
+        return slept_at
+
+    def restore_event(self, dtime, name):
+        """
+            Schedule method ``name``, saved before deep sleep, at ``dtime``.
+            Returns the handle; subclasses keeping one for an event take it here.
+        """
+        return self.event_schedule_dtime(dtime, getattr(self, name))
+
+    def event_schedule_dtime(self, dtime, event):
+        """
+            Add a new event to the queue to be triggered at ``dtime``.
+
+            If the event table is full the event is dropped, logged and
+            counted in ``events_dropped`` rather than stopping the loop, and
+            None is returned in place of a handle. In deep sleep mode one-off
+            events must be methods of the application, see ``PowerManager.check_event``.
+        """
+        if not isinstance(event, PeriodicJob):
+            self.power.check_event(self, event)
+        try:
+            return self._events.push(dtime, event)
+        except IndexError:
+            self.events_dropped += 1
+            self.log(utime.time(), 'Event table full, dropped ' + event_name(event))
+            return None
 
     def time(self):
         """Get current time."""
@@ -19,4 +131,257 @@ class UPythonSensorApplication(SensorApplication):
 
     def localtime(self, timeval):
         """Format timeval as localtime struct."""
-        return utime.localtime(timeval)
\ No newline at end of file
+        return utime.localtime(timeval)
+
+    def ticks_us(self):
+        """Microsecond counter for measuring durations."""
+        return utime.ticks_us()
+
+    def ticks_diff(self, end, start):
+        """Difference between two ``ticks_us`` values, allowing for wrap around."""
+        return utime.ticks_diff(end, start)
+
+    def jitter_key(self):
+        return self.mqtt_root_topic
+
+    def network_begin(self):
+        """Start bringing WiFi up; ``pre_event_handler`` connects MQTT once it is."""
+        self.mqtt_last_attempt = utime.time()
+        if self.wifi.begin():
+            self.network_poll()
+
+    def network_poll(self):
+        """Check on WiFi and once it is up connect MQTT and sync the clock. Returns whether MQTT is connected."""
+        result = self.wifi.poll()
+        if result is None:
+            return False
+        self.network_up = result
+        if not result:
+            self.log(utime.time(), 'Unable to connect to network')
+            return False
+        self.startup.mark('network')
+        self.mqtt_connect()
+        if not self.mqtt_connected and self.wifi.cached:
+            # the cached address may be stale, start afresh next time
+            self.wifi.forget()
+            self.network_disconnect()
+            return False
+        if self.clock_sync_due(utime.time()):
+            self.sync_clock()
+        return self.mqtt_connected
+
+    def network_connect(self):
+        """Bring WiFi up, waiting for it."""
+        self.network_up = self.wifi.connect(self.NETWORK_POLL_MS)
+        if self.network_up:
+            self.startup.mark('network')
+        else:
+            self.log(utime.time(), 'Unable to connect to network')
+
+    def network_disconnect(self):
+        """Drop MQTT and WiFi to save power."""
+        if self.mqtt_connected:
+            try:
+                self.mqtt_client.disconnect()
+            except OSError:
+                pass
+            self.mqtt_connected = False
+        self.wifi.disconnect()
+        self.network_up = False
+
+    def ensure_connected(self):
+        """Bring the network and MQTT up on demand in low power modes."""
+        if self.mqtt_connected or not self.power.low_power:
+            return
+        if not self.network_up:
+            self.network_connect()
+        if self.network_up:
+            self.mqtt_connect()
+            if self.clock_sync_due(utime.time()):
+                self.sync_clock()
+
+    def clock_sync_due(self, current_time):
+        """Whether the clock has not been set yet or not for the ``ntp_sync`` period."""
+        if self.clock_synced_at is None:
+            return True
+        period = self.event_periods.get('ntp_sync')
+        return period is not None and current_time - self.clock_synced_at >= period
+
+    def sync_clock(self):
+        """
+            Set the RTC from NTP if the network is up. Returns whether it was set.
+
+            The network isn't brought up for this; in the low power modes the
+            clock is set when it is next up to publish, if ``clock_sync_due``.
+            The RTC starts from 2000 at a cold boot and the first readings
+            are taken before the network is up, so a step in the clock is
+            passed to ``clock_stepped`` to correct what was timed on the old
+            one.
+        """
+        import ntptime
+
+        if not self.network_up:
+            return False
+        before = utime.time()
+        try:
+            ntptime.settime()
+        except OSError:
+            self.log(before, 'NTP timed out.')
+            return False
+        current_time = utime.time()
+        self.clock_synced_at = current_time
+        self.startup.mark('clock')
+        delta = current_time - before
+        if delta >= self.CLOCK_STEP or delta <= -self.CLOCK_STEP:
+            self.log(current_time, 'Clock stepped {0}s'.format(delta))
+            self.clock_stepped(delta, current_time)
+        return True
+
+    def clock_stepped(self, delta, current_time):
+        super(UPythonSensorApplication, self).clock_stepped(delta, current_time)
+        self.publisher.shift_time(delta)
+        self.outbox.shift_time(delta)
+        self.mqtt_last_attempt += delta
+
+    def mqtt_make_topic(self, *sub_topics):
+        """Build mqtt topic strings."""
+        return bytes("/".join((self.mqtt_root_topic,) + sub_topics), "utf-8")
+
+    def mqtt_subscribe(self, sub_topic, callback, parse=None, min_interval=0):
+        """
+            Call ``callback(topic, value)`` for messages on ``sub_topic``, as a
+            command (see ``commands.command``). Subscribed on each connect.
+        """
+        cmd = self.commands.add(sub_topic, callback, parse, min_interval)
+        if self.mqtt_connected:
+            for topic in self.commands.filters([cmd]):
+                self.mqtt_client.subscribe(topic)
+        return cmd
+
+    def mqtt_connect(self):
+        """Connect and subscribe. Failures are logged and retried from the loop."""
+        self.mqtt_last_attempt = utime.time()
+        try:
+            self.mqtt_client.connect()
+            for topic in self.commands.filters():
+                self.mqtt_client.subscribe(topic)
+            self.mqtt_connected = True
+            self.startup.mark('mqtt')
+        except OSError as err:
+            self.mqtt_connected = False
+            self.log(self.mqtt_last_attempt, 'MQTT connect failed: ' + str(err))
+
+    def mqtt_recieve(self, topic, msg):
+        """Received messages from subscriptions will be delivered to this callback."""
+        current_time = utime.time()
+        self.log(current_time, topic + b': ' + msg)
+        self.commands.dispatch(topic, msg, current_time)
+
+    @command('halt')
+    def mqtt_halt(self, topic, msg):
+        self.should_bail = True
+
+    def mqtt_send(self, topic, payload, retain=False):
+        """
+            Publish now if connected and nothing is waiting, otherwise store a
+            copy of ``payload`` in the outbox.
+
+            Retained messages are held aside while disconnected, latest per
+            topic, and sent on reconnect instead.
+        """
+        self.ensure_connected()
+        if retain:
+            if not self._mqtt_publish_stored(utime.time(), topic, payload, True):
+                self._retained[topic] = bytes(payload)
+            return
+        if not len(self.outbox) and self._mqtt_publish_stored(utime.time(), topic, payload):
+            return
+        self.outbox.put(utime.time(), topic, bytes(payload))
+
+    def _mqtt_send_retained(self):
+        for topic in list(self._retained):
+            if not self._mqtt_publish_stored(utime.time(), topic, self._retained[topic], True):
+                return
+            del self._retained[topic]
+
+    def _mqtt_publish_stored(self, timestamp, topic, payload, retain=False):
+        if not self.mqtt_connected:
+            return False
+        try:
+            self.mqtt_client.publish(topic, payload, retain)
+        except OSError:
+            self.mqtt_connected = False
+            return False
+        if not self.startup.reported:
+            self.startup.mark('first_publish')
+        return True
+
+    def publish(self, name, value):
+        """Queue a reading for publishing on the ``name`` sub-topic."""
+        self.publisher.add(name, value, utime.time())
+
+    def pre_event_handler(self):
+        if self.mqtt_connected:
+            try:
+                self.mqtt_client.check_msg()
+            except OSError:
+                self.mqtt_connected = False
+        elif self.wifi.connecting:
+            self.network_poll()
+        elif self.power.low_power:
+            # start the radio on waking for readings, as they are taken
+            next_time = self._events.next_time()
+            if not self.network_up and next_time is not None and next_time <= utime.time():
+                self.wifi.begin()
+        elif utime.time() - self.mqtt_last_attempt >= self.RECONNECT_INTERVAL:
+            self.network_begin()
+
+    def post_event_handler(self, current_time):
+        # send whatever the events produced, then some of any backlog
+        self.publisher.tick(current_time)
+        if self._retained:
+            self.ensure_connected()
+            self._mqtt_send_retained()
+        if len(self.outbox):
+            self.ensure_connected()
+            self.outbox.drain(self._mqtt_publish_stored, self.OUTBOX_DRAIN_BATCH)
+        if not self.startup.reported:
+            report = self.startup_report(current_time)
+            if report is not None:
+                self.mqtt_send(self.mqtt_make_topic('startup'), bytes(report, 'utf-8'))
+
+    def wait(self, seconds):
+        """Sleep until the next event, polling MQTT unless in a low power mode."""
+        if self.network_up and seconds >= self.WIFI_SCAN_IDLE and self.wifi.scan_pending():
+            # blocks for a second or two, so only with time to spare; the
+            # loop works out the rest of the wait afresh
+            self.wifi.scan()
+        elif self.power.low_power:
+            self.low_power_wait()
+        elif self.wifi.connecting:
+            utime.sleep_ms(min(int(seconds * 1000), self.NETWORK_POLL_MS))
+        else:
+            utime.sleep(min(seconds, self.MQTT_POLL_INTERVAL))
+
+    def low_power_wait(self):
+        """
+            Sleep until the next event without polling MQTT.
+
+            Commands sent while asleep are only seen once the board is next
+            connected to publish.
+        """
+        next_time = self._events.next_time()
+        if next_time is None:
+            return
+        wait = next_time - utime.time()
+        if wait <= 0:
+            return
+        if self.power.radio_off(wait) and (self.network_up or self.wifi.connecting):
+            self.network_disconnect()
+        if self.power.use_deep_sleep(wait):
+            # periodic jobs are recreated from their slots at boot
+            pending = [(dtime, event) for dtime, event in self._events.pending()
+                       if not isinstance(event, PeriodicJob)]
+            self.power.deep_sleep(wait, pending, utime.time())
+        else:
+            self.power.light_sleep(wait)
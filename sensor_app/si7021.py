@@ -1,46 +1,166 @@
-import fcntl
-import os
 import struct
 import time
 
-I2C_SLAVE = 0x0703
+from sensor_app.i2c_bus import get_bus
+
 I2C_CHANNEL = 1
 ADDR = 0x40
-READ_TEMP = 0xF3
-READ_HUM = 0xF5
+
+MEASURE_HUM_HOLD = 0xE5
+MEASURE_HUM = 0xF5
+READ_TEMP_FROM_HUM = 0xE0
+WRITE_USER_REG = 0xE6
+READ_USER_REG = 0xE7
+
+# User register resolution bits (D7, D0) for (RH bits, temperature bits).
+RESOLUTIONS = {
+    (12, 14): 0x00,
+    (8, 12): 0x01,
+    (10, 13): 0x80,
+    (11, 11): 0x81,
+}
+RESOLUTION_MASK = 0x81
+
+# Conversion from raw codes, value = code * scale + offset.
+HUMIDITY_SCALE = 125 / 65536.0
+HUMIDITY_OFFSET = -6
+TEMPERATURE_SCALE = 175.72 / 65536.0
+TEMPERATURE_OFFSET = -46.85
+
+POLL_INTERVAL = 0.005 # seconds
+CONVERSION_TIMEOUT = 0.1 # seconds
+
+
+def crc8(data):
+    """CRC-8 used by the SI7021, polynomial x^8 + x^5 + x^4 + 1, initial value 0."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
 
 
 class SI7021:
-    def __init__(self):
-        # Get I2C bus
-        self.i2c = os.open('/dev/i2c-{0}'.format(I2C_CHANNEL), os.O_RDWR)
-        fcntl.ioctl(self.i2c, I2C_SLAVE, ADDR)
+    """
+        SI7021 temperature and humidity sensor.
+
+        Pass ``bus`` to share an ``I2CBus`` with other devices, otherwise the
+        shared bus for ``channel`` is used.
+
+        A read starts a humidity conversion and then fetches the temperature
+        measured as part of it (command 0xE0), so only one conversion is done.
+        By default the conversion is polled for completion; with
+        ``hold_master`` the read blocks on clock stretching instead.
+
+        With ``cache_ttl`` set, reads within that many seconds of the last bus
+        transaction return the cached values.
+    """
+    def __init__(self, channel=I2C_CHANNEL, address=ADDR, resolution=None, hold_master=False, cache_ttl=0, bus=None):
+        self.hold_master = hold_master
+        self.cache_ttl = cache_ttl
+        self._cached = None
+        self._cached_at = None
+
+        if bus is None:
+            bus = get_bus(channel)
+        self.i2c = bus.device(address)
+
+        if resolution is not None:
+            self.set_resolution(*resolution)
+
+    def set_resolution(self, rh_bits, temp_bits):
+        """Set measurement resolution, one of the ``RESOLUTIONS`` pairs."""
+        user_reg = self.i2c.write_read(bytes([READ_USER_REG]), 1)[0]
+        user_reg = (user_reg & ~RESOLUTION_MASK) | RESOLUTIONS[(rh_bits, temp_bits)]
+        self.i2c.write(bytes([WRITE_USER_REG, user_reg]))
+
+    def _start_humidity(self):
+        """Start a no-hold conversion. Hold-master conversions start in ``_poll_humidity``."""
+        if not self.hold_master:
+            self.i2c.write(bytes([MEASURE_HUM]))
+
+    def _poll_humidity(self):
+        """Result of the humidity conversion, None if it hasn't finished."""
+        if self.hold_master:
+            # the device stretches the clock until the result is ready
+            return self.i2c.write_read(bytes([MEASURE_HUM_HOLD]), 3)
+        try:
+            return self.i2c.read(3)
+        except OSError:
+            # device NACKs the read until the conversion is complete
+            return None
+
+    @staticmethod
+    def _check(msg):
+        data, crc = msg[:2], msg[2]
+        if crc8(data) != crc:
+            raise OSError('SI7021 CRC check failed')
+        return struct.unpack('>H', data)[0]
+
+    def _finish(self, msg):
+        humidity = self._check(msg)
+
+        # temperature measured during the humidity conversion, no CRC byte.
+        data = self.i2c.write_read(bytes([READ_TEMP_FROM_HUM]), 2)
+        return struct.unpack('>H', data)[0], humidity
+
+    def _convert(self, temp, humidity):
+        self._cached = (self.convert_temperature(temp), self.convert_humidity(humidity))
+        self._cached_at = time.monotonic()
+        return self._cached
+
+    def _cache_valid(self):
+        return (self._cached is not None and
+                time.monotonic() - self._cached_at < self.cache_ttl)
+
+    @staticmethod
+    def convert_humidity(data):
+        return data * HUMIDITY_SCALE + HUMIDITY_OFFSET
+
+    @staticmethod
+    def convert_temperature(data):
+        return data * TEMPERATURE_SCALE + TEMPERATURE_OFFSET
 
     def read(self):
-        # SI7021 address, 0x40(64)
-        #		0xF5(245)	Select Relative Humidity NO HOLD master mode
-        os.write(self.i2c, struct.pack('B', READ_HUM))
-        time.sleep(0.3)
-        # SI7021 address, 0x40(64)
-        # Read data back, 2 bytes, Humidity MSB first, 1 byte CRC
-        msg = os.read(self.i2c, 3)
-        data = struct.unpack('>H', msg[:2])[0]
-
-        # Convert the data
-        humidity = (data * 125 / 65536.0) - 6
-
-        time.sleep(0.3)
-
-        # SI7021 address, 0x40(64)
-        #		0xF3(243)	Select temperature NO HOLD master mode
-        os.write(self.i2c, struct.pack('B', READ_TEMP))
-        time.sleep(0.3)
-        # SI7021 address, 0x40(64)
-        # Read data back, 2 bytes, Temperature MSB first, 1 byte CRC
-        msg = os.read(self.i2c, 3)
-        data = struct.unpack('>H', msg[:2])[0]
-
-        # Convert the data
-        temp = (data * 175.72 / 65536.0) - 46.85
-
-        return temp, humidity
+        """Returns ``(temperature, humidity)``."""
+        if self._cache_valid():
+            return self._cached
+
+        return self._convert(*self.read_raw())
+
+    def read_raw(self):
+        """
+            Returns raw ``(temperature, humidity)`` codes from a new
+            conversion, for ``convert_temperature`` and ``convert_humidity``
+            or batch conversion with ``aggregate.SampleWindow``.
+        """
+        self._start_humidity()
+        deadline = time.monotonic() + CONVERSION_TIMEOUT
+        while True:
+            msg = self._poll_humidity()
+            if msg is not None:
+                return self._finish(msg)
+            if time.monotonic() > deadline:
+                raise OSError('SI7021 conversion timed out')
+            time.sleep(POLL_INTERVAL)
+
+    async def read_async(self):
+        """As ``read`` but yields to the event loop while the conversion runs."""
+        import asyncio
+
+        if self._cache_valid():
+            return self._cached
+
+        self._start_humidity()
+        deadline = time.monotonic() + CONVERSION_TIMEOUT
+        while True:
+            msg = self._poll_humidity()
+            if msg is not None:
+                return self._convert(*self._finish(msg))
+            if time.monotonic() > deadline:
+                raise OSError('SI7021 conversion timed out')
+            await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,337 @@
+"""Virtual clock, replayed sensor traces and an in-process broker for simulation."""
+import bisect
+import csv
+import time
+
+from sensor_app.commands import TopicTrie, command
+from sensor_app.publisher import Publisher
+from sensor_app.sensor_app_base import SensorApplication
+
+
+class VirtualClock:
+    """
+        Mixin that runs a ``SensorApplication`` on a simulated clock.
+
+        Put it before the application class so its hooks win. ``time`` reads
+        ``now``, ``sleep`` advances it and ``wait`` jumps straight to the next
+        deadline instead of blocking, so idle time costs nothing. It still
+        runs the application's own ``wait`` with no time to spare first, so
+        an MQTT client is serviced as it would be between events. ``ticks_us``
+        stays on the real clock so the loop statistics measure real work.
+    """
+    now = 0
+    end = None
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def localtime(self, timeval):
+        return time.gmtime(int(timeval))
+
+    def ticks_us(self):
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(self, end, start):
+        return end - start
+
+    def wait(self, seconds):
+        super(VirtualClock, self).wait(0)
+        next_time = self._events.next_time()
+        if next_time is None:
+            next_time = self.now + seconds
+        if self.end is not None and next_time >= self.end:
+            self.now = self.end
+            self.should_bail = True
+        elif next_time > self.now:
+            self.now = next_time
+
+    def run_until(self, end):
+        """Run the loop until the simulated clock reaches ``end`` or something halts it."""
+        self.end = end
+        try:
+            self.run()
+        finally:
+            self.end = None
+
+
+class Message:
+    """Received message, with the attributes of a paho ``MQTTMessage`` the apps use."""
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class PublishResult:
+    """The parts of paho's ``MQTTMessageInfo`` the apps use."""
+    def __init__(self, mid, rc=0):
+        self.mid = mid
+        self.rc = rc
+
+
+class Broker:
+    """
+        In-process stand-in for an MQTT broker.
+
+        Delivers each publish synchronously to callbacks subscribed to a
+        matching topic filter and keeps the last payload per topic. ``messages`` and
+        ``wire_bytes`` count what a QoS 0 PUBLISH would have cost on the
+        network, and ``retained`` how many were sent retained. With ``keep``
+        every message is also kept in ``log``.
+    """
+    def __init__(self, keep=False):
+        self.last = {}
+        self.log = [] if keep else None
+        self.messages = 0
+        self.wire_bytes = 0
+        self.retained = 0
+        self._subscribers = TopicTrie()
+
+    def subscribe(self, topic, callback):
+        """Call ``callback(topic, payload)`` for messages on ``topic``, which may have wildcards."""
+        self._subscribers.add(topic, callback)
+
+    def publish(self, topic, payload, retain=False):
+        if retain:
+            self.retained += 1
+        if isinstance(payload, str):
+            payload = bytes(payload, 'utf-8')
+        else:
+            payload = bytes(payload)
+        self.messages += 1
+        self.wire_bytes += 4 + len(topic) + len(payload)
+        self.last[topic] = payload
+        if self.log is not None:
+            self.log.append((topic, payload))
+        for callback in self._subscribers.match(topic):
+            callback(topic, payload)
+
+    def client(self, **kwargs):
+        return BrokerClient(self, **kwargs)
+
+
+class BrokerClient:
+    """
+        The subset of the paho ``Client`` interface ``CPythonSensorApplication``
+        uses, connected to a ``Broker``.
+
+        As with paho, ``connect`` only starts the connection: the client is
+        connected, and ``on_connect`` called, once ``loop`` has run.
+
+        QoS 1 and 2 publishes are acknowledged through ``on_publish`` from
+        ``loop``, ``latency`` seconds later on ``clock``. ``loop`` waits for
+        the next acknowledgement, or the timeout, with ``sleep``, so a fake
+        clock and sleep simulate a slow link instantly. Acknowledgements
+        still due when the client disconnects are lost with the connection.
+    """
+    def __init__(self, broker, latency=0, clock=time.monotonic, sleep=time.sleep):
+        self.broker = broker
+        self.latency = latency
+        self.clock = clock
+        self.sleep = sleep
+        self.on_connect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_disconnect = None
+        self.connected = False
+        self.connecting = False
+        self._subscribed = set()
+        self._mid = 0
+        self._acks = []
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60):
+        self.connected = False
+        self.connecting = True
+
+    def disconnect(self):
+        was_connected = self.connected or self.connecting
+        self.connected = False
+        self.connecting = False
+        self._acks = []
+        if was_connected and self.on_disconnect is not None:
+            self.on_disconnect(self, None, 0)
+
+    def is_connected(self):
+        return self.connected
+
+    def subscribe(self, topic):
+        if topic not in self._subscribed:
+            self._subscribed.add(topic)
+            self.broker.subscribe(topic, self._deliver)
+
+    def _deliver(self, topic, payload):
+        if self.connected and self.on_message is not None:
+            self.on_message(self, None, Message(topic, payload))
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self._mid += 1
+        if not self.connected:
+            return PublishResult(self._mid, 4) # MQTT_ERR_NO_CONN
+        self.broker.publish(topic, payload or b'', retain)
+        if qos:
+            self._acks.append((self.clock() + self.latency, self._mid))
+        return PublishResult(self._mid)
+
+    def loop_misc(self):
+        pass
+
+    def loop(self, timeout=1.0):
+        """
+            Complete a pending connection, or else deliver acknowledgements
+            that are due, waiting up to ``timeout`` for the first.
+        """
+        if self.connecting:
+            # the CONNACK is read here, as paho does, never in connect()
+            self.connecting = False
+            self.connected = True
+            if self.on_connect is not None:
+                self.on_connect(self, None, {}, 0)
+            return
+        now = self.clock()
+        first = self._acks[0][0] if self._acks else None
+        if first is None or first - now > timeout:
+            self.sleep(timeout)
+            return
+        if first > now:
+            self.sleep(first - now)
+            # compare against the due time itself; the clock may round short of it
+            now = first
+        while self._acks and self._acks[0][0] <= now:
+            due, mid = self._acks.pop(0)
+            if self.on_publish is not None:
+                self.on_publish(self, None, mid)
+
+
+class TraceReplay:
+    """
+        Readings recorded from a real sensor, replayed against a simulated clock.
+
+        ``times`` are ascending epoch seconds and ``rows`` the field values
+        recorded at each. ``read`` returns the row in effect at a given time,
+        i.e. the last one at or before it. With ``repeat`` the trace loops, so
+        a day's recording can drive a month of simulation.
+    """
+    def __init__(self, fields, times, rows, repeat=True):
+        if not times:
+            raise ValueError('Empty trace')
+        self.fields = tuple(fields)
+        self.times = list(times)
+        self.rows = [tuple(row) for row in rows]
+        self.repeat = repeat
+        self.start = self.times[0]
+        # time from the first sample to the point the trace repeats, allowing
+        # the last sample the same spacing as the one before it
+        step = self.times[-1] - self.times[-2] if len(self.times) > 1 else 1
+        self.span = self.times[-1] - self.start + step
+
+    def __len__(self):
+        return len(self.times)
+
+    def read(self, current_time):
+        """Row of values in effect at ``current_time``."""
+        offset = current_time - self.start
+        if self.repeat:
+            offset %= self.span
+        i = bisect.bisect_right(self.times, self.start + offset) - 1
+        return self.rows[max(i, 0)]
+
+
+def load_csv(path, repeat=True):
+    """``TraceReplay`` from a CSV file with a ``time`` column and one column per field."""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        time_col = header.index('time')
+        fields = [name for i, name in enumerate(header) if i != time_col]
+        times = []
+        rows = []
+        for record in reader:
+            times.append(float(record[time_col]))
+            rows.append([float(value) for i, value in enumerate(record) if i != time_col])
+    return TraceReplay(fields, times, rows, repeat)
+
+
+def load_parquet(path, repeat=True):
+    """``TraceReplay`` from a Parquet file laid out like ``load_csv``. Needs pandas."""
+    import pandas
+
+    frame = pandas.read_parquet(path).sort_values('time')
+    fields = [name for name in frame.columns if name != 'time']
+    return TraceReplay(fields, frame['time'].tolist(), frame[fields].itertuples(index=False, name=None), repeat)
+
+
+class ReplaySensor:
+    """
+        Fake sensor driver returning readings from a trace.
+
+        ``read()`` returns the values of ``fields`` at ``clock()`` plus
+        ``offset`` seconds, so one trace can stand in for many sensors that
+        are out of step with each other. With ``fields`` of temperature and
+        humidity it is a drop-in for ``SI7021``.
+    """
+    def __init__(self, trace, clock, fields=None, offset=0):
+        self.trace = trace
+        self.clock = clock
+        self.offset = offset
+        fields = trace.fields if fields is None else fields
+        self._columns = [trace.fields.index(name) for name in fields]
+        self.reads = 0
+
+    def read(self):
+        self.reads += 1
+        row = self.trace.read(self.clock() + self.offset)
+        return tuple(row[i] for i in self._columns)
+
+
+class SimulatedSensorApplication(VirtualClock, SensorApplication):
+    """
+        Sensor application on a virtual clock publishing to a ``Broker``.
+
+        Handlers publish with ``publish`` as on the real targets. Commands are
+        subscribed when the application is created, or later with
+        ``mqtt_subscribe_filters``. A message on the ``halt`` sub-topic stops
+        the loop.
+    """
+    def __init__(self, event_periods, debug, broker=None, root='sim', start_time=0, batch_topic=None,
+                 deadbands=None):
+        super(SimulatedSensorApplication, self).__init__(event_periods, debug)
+        self.now = start_time
+        self.broker = Broker() if broker is None else broker
+        self.mqtt_root_topic = root
+        self.publisher = Publisher(self.mqtt_send, self.mqtt_make_topic, batch_topic=batch_topic,
+                                   deadbands=deadbands)
+        self.mqtt_subscribe_filters(self.commands.filters())
+
+    def jitter_key(self):
+        return self.mqtt_root_topic
+
+    def mqtt_make_topic(self, *sub_topics):
+        return "/".join((self.mqtt_root_topic,) + sub_topics)
+
+    def mqtt_send(self, topic, payload, retain=False):
+        self.broker.publish(topic, payload, retain)
+
+    def mqtt_subscribe_filters(self, topics):
+        for topic in topics:
+            self.broker.subscribe(topic, self.mqtt_recieve)
+
+    def mqtt_recieve(self, topic, payload):
+        self.commands.dispatch(topic, payload, self.now)
+
+    @command('halt')
+    def mqtt_halt(self, topic, payload):
+        self.should_bail = True
+
+    def publish(self, name, value):
+        self.publisher.add(name, value, self.now)
+
+    def post_event_handler(self, current_time):
+        self.publisher.tick(current_time)
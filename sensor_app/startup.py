@@ -0,0 +1,42 @@
+"""Timing of the stages of bringing an application up."""
+try:
+    from utime import ticks_diff, ticks_ms
+    # the tick counter starts at reset, so stages are timed from power on
+    BOOT_TICKS = 0
+except ImportError:
+    import time
+
+    def ticks_ms():
+        return int(time.perf_counter() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+    # when the sensor_app package was first imported
+    BOOT_TICKS = ticks_ms()
+
+
+class StartupTimer:
+    """
+        Milliseconds from start up to each stage of bringing an app up.
+
+        On MicroPython stages are timed from reset, or from waking from deep
+        sleep; on CPython from when the package was imported. Only the first
+        ``mark`` of a stage counts. ``report`` returns the times once, after
+        ``first_publish`` is marked, as time to first publish is what most of
+        the energy of a duty-cycled node goes on.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.reported = False
+
+    def mark(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = ticks_diff(ticks_ms(), BOOT_TICKS)
+
+    def report(self):
+        """The stage times, the first time it is called after the first publish, otherwise None."""
+        if self.reported or 'first_publish' not in self.stages:
+            return None
+        self.reported = True
+        return self.stages
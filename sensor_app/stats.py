@@ -0,0 +1,117 @@
+"""Event loop instrumentation."""
+
+# Bucket upper bounds in microseconds: 1 ms to 10 s, then overflow.
+DEFAULT_BOUNDS = (1000, 5000, 10000, 50000, 100000, 500000, 1000000, 5000000, 10000000)
+
+
+class Histogram:
+    """
+        Fixed-bucket histogram of integer microsecond values.
+
+        Buckets are allocated up front and ``record`` only updates integers
+        in place so it can be called from the loop on MicroPython without
+        creating garbage.
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        if value < 0:
+            # tick counter wrapped
+            value = 0
+        i = 0
+        bounds = self.bounds
+        while i < len(bounds) and value > bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total // self.count if self.count else 0,
+            'max_us': self.max,
+            'buckets': list(self.counts),
+        }
+
+
+class LoopStats:
+    """
+        Counters for the event loop.
+
+        ``handlers`` holds a latency histogram per handler name, ``lag`` how
+        late events ran relative to their trigger time, ``iteration`` the time
+        spent dispatching each loop pass and ``publish`` MQTT publish call
+        latency. ``overruns`` counts periodic job runs that went past their
+        next slot and ``missed`` the slots skipped as a result.
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.handlers = {}
+        self.lag = Histogram(bounds)
+        self.iteration = Histogram(bounds)
+        self.publish = Histogram(bounds)
+        self.publish_failures = 0
+        self.overruns = 0
+        self.missed = 0
+        self.queue_depth = 0
+        self.queue_depth_max = 0
+
+    def handler(self, name):
+        """Histogram for handler ``name``, created on first use."""
+        histogram = self.handlers.get(name)
+        if histogram is None:
+            histogram = self.handlers[name] = Histogram(self.bounds)
+        return histogram
+
+    def record_queue_depth(self, depth):
+        self.queue_depth = depth
+        if depth > self.queue_depth_max:
+            self.queue_depth_max = depth
+
+    def reset(self):
+        for histogram in self.handlers.values():
+            histogram.reset()
+        self.lag.reset()
+        self.iteration.reset()
+        self.publish.reset()
+        self.publish_failures = 0
+        self.overruns = 0
+        self.missed = 0
+        self.queue_depth_max = self.queue_depth
+
+    def as_dict(self):
+        return {
+            'handlers': dict((name, histogram.as_dict()) for name, histogram in self.handlers.items()),
+            'lag': self.lag.as_dict(),
+            'iteration': self.iteration.as_dict(),
+            'publish': self.publish.as_dict(),
+            'publish_failures': self.publish_failures,
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'queue_depth': self.queue_depth,
+            'queue_depth_max': self.queue_depth_max,
+            'bounds_us': list(self.bounds),
+        }
+
+
+def event_name(event):
+    """Name to report an event under."""
+    name = getattr(event, 'name', None)
+    if name is None:
+        name = getattr(event, '__name__', 'event')
+    return name
@@ -0,0 +1,97 @@
+import statistics
+import unittest
+from unittest import mock
+
+from sensor_app import aggregate
+from sensor_app.aggregate import SampleWindow
+from sensor_app.main_rpi import FanDevice
+from sensor_app.si7021 import SI7021
+from sensor_app.simulation import Broker, SimulatedSensorApplication
+
+
+class SampleWindowTestCase(unittest.TestCase):
+    use_numpy = False
+
+    def make_window(self, size, scale=1.0, offset=0.0):
+        return SampleWindow(size, scale, offset, use_numpy=self.use_numpy)
+
+    def test_summary(self):
+        window = self.make_window(10, scale=0.5, offset=-1)
+        raw = [2, 4, 4, 4, 5, 5, 7, 9]
+        window.extend(raw)
+        values = [value * 0.5 - 1 for value in raw]
+
+        summary = window.summary()
+        self.assertEqual(summary['count'], 8)
+        self.assertAlmostEqual(summary['min'], min(values))
+        self.assertAlmostEqual(summary['max'], max(values))
+        self.assertAlmostEqual(summary['mean'], statistics.mean(values))
+        self.assertAlmostEqual(summary['stddev'], statistics.pstdev(values))
+
+    def test_window_rolls(self):
+        window = self.make_window(3)
+        window.extend([1, 2, 3])
+        window.add(10)
+        window.extend([20])
+
+        self.assertEqual(sorted(float(v) for v in window.values()), [3, 10, 20])
+        self.assertEqual(window.summary()['min'], 3)
+
+    def test_negative_scale(self):
+        window = self.make_window(4, scale=-1)
+        window.extend([1, 3])
+        summary = window.summary()
+        self.assertEqual((summary['min'], summary['max']), (-3, -1))
+
+    def test_empty(self):
+        self.assertIsNone(self.make_window(3).summary())
+
+    def test_publish(self):
+        window = self.make_window(3)
+        window.extend([1, 3])
+        publish = mock.Mock()
+        summary = window.publish(publish, 'temperature')
+
+        names = [call[0][0] for call in publish.call_args_list]
+        self.assertEqual(names, ['temperature', 'temperature_min', 'temperature_max', 'temperature_stddev'])
+        self.assertEqual(summary['mean'], 2)
+
+
+@unittest.skipIf(aggregate.numpy is None, 'numpy not installed')
+class NumpySampleWindowTestCase(SampleWindowTestCase):
+    use_numpy = True
+
+
+class OversampledFanTestCase(unittest.TestCase):
+    def make_device(self, oversample):
+        self.broker = Broker(keep=True)
+        host = SimulatedSensorApplication({}, False, broker=self.broker, root='gw')
+        sensor = mock.Mock()
+        # 0x683A is 24.7 C, 0x7C80 54.8 %RH
+        sensor.read_raw.side_effect = [(0x683A + i * 16, 0x7C80) for i in range(-2, 2)]
+        sensor.read.return_value = (24.7, 54.8)
+        with mock.patch('sensor_app.main_rpi.PwmFan'), mock.patch('sensor_app.main_rpi.SI7021', return_value=sensor):
+            device = FanDevice(host, 'fan', 18, oversample=oversample)
+        device.init_events()
+        host.run_until(1)
+        return device
+
+    def test_summary_published(self):
+        device = self.make_device(4)
+        last = self.broker.last
+
+        self.assertEqual(device.si7120.read_raw.call_count, 4)
+        mean = SI7021.convert_temperature(0x683A - 8)
+        self.assertAlmostEqual(float(last['gw/fan/temperature']), mean, places=3)
+        self.assertAlmostEqual(float(last['gw/fan/temperature_max']), SI7021.convert_temperature(0x683A + 16),
+                               places=3)
+        self.assertAlmostEqual(float(last['gw/fan/humidity_stddev']), 0)
+        # the fan follows the mean
+        self.assertEqual(device.fan_curve.temperature, mean)
+
+    def test_single_reading(self):
+        device = self.make_device(1)
+
+        self.assertEqual(device.si7120.read_raw.call_count, 0)
+        self.assertEqual(self.broker.last['gw/fan/temperature'], b'24.7')
+        self.assertNotIn('gw/fan/temperature_max', self.broker.last)
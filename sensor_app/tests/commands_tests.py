@@ -0,0 +1,98 @@
+import unittest
+
+from sensor_app.commands import TopicTrie, command, parse_int, parse_json
+from sensor_app.device import GatewayDevice
+from sensor_app.simulation import SimulatedSensorApplication
+
+
+class TopicTrieTestCase(unittest.TestCase):
+    def test_wildcards(self):
+        trie = TopicTrie()
+        for topic_filter in ('a/b', 'a/+', 'a/#', '+/b/c', '#', 'x'):
+            trie.add(topic_filter, topic_filter)
+
+        self.assertEqual(sorted(trie.match('a/b')), ['#', 'a/#', 'a/+', 'a/b'])
+        self.assertEqual(sorted(trie.match('a')), ['#', 'a/#'])
+        self.assertEqual(sorted(trie.match('a/b/c')), ['#', '+/b/c', 'a/#'])
+        self.assertEqual(sorted(trie.match('x')), ['#', 'x'])
+
+    def test_exact_only(self):
+        trie = TopicTrie()
+        trie.add(b'root/halt', 1)
+        trie.add(b'root/halt', 2)
+        self.assertEqual(trie.match(b'root/halt'), [1, 2])
+        self.assertEqual(trie.match(b'root/other'), ())
+
+    def test_bytes(self):
+        trie = TopicTrie()
+        trie.add(b'root/+/set', 1)
+        self.assertEqual(trie.match(b'root/fan/set'), [1])
+        self.assertEqual(trie.match(b'root/fan/get'), [])
+
+    def test_bad_filter(self):
+        with self.assertRaises(ValueError):
+            TopicTrie().add('a/#/b', 1)
+
+
+class CommandApp(SimulatedSensorApplication):
+    def __init__(self, *args, **kwargs):
+        self.received = []
+        super(CommandApp, self).__init__(*args, **kwargs)
+
+    @command('period/+', parse=parse_int, min_interval=10)
+    def command_period(self, topic, value):
+        self.received.append((topic, value))
+
+    @command('config', parse=parse_json)
+    def command_config(self, topic, value):
+        self.received.append((topic, value))
+
+
+class FanDevice(GatewayDevice):
+    @command('fan')
+    def command_fan(self, topic, value):
+        self.fan = value
+
+
+class CommandTableTestCase(unittest.TestCase):
+    def test_declared(self):
+        app = CommandApp({}, False)
+        app.broker.publish('sim/period/light', b'60')
+        app.broker.publish('sim/config', b'{"a": 1}')
+        app.broker.publish('sim/halt', b'')
+
+        self.assertEqual(app.received, [('sim/period/light', 60), ('sim/config', {'a': 1})])
+        self.assertTrue(app.should_bail)
+        self.assertEqual(app.commands.stats()['halt']['calls'], 1)
+
+    def test_rejected_and_limited(self):
+        app = CommandApp({}, False)
+        app.broker.publish('sim/period/light', b'soon')
+        app.broker.publish('sim/period/light', b'60')
+        app.broker.publish('sim/period/light', b'120')
+        app.now = 10
+        app.broker.publish('sim/period/light', b'180')
+
+        self.assertEqual([value for topic, value in app.received], [60, 180])
+        self.assertEqual(app.commands.stats()['period/+'], {'calls': 2, 'rejected': 1, 'limited': 1})
+
+    def test_handler_error(self):
+        app = CommandApp({}, False)
+
+        def fail(topic, value):
+            raise TypeError('broken')
+
+        app.commands.add('broken', fail)
+        app.mqtt_subscribe_filters(app.commands.filters())
+        app.broker.publish('sim/broken', b'')
+
+        self.assertEqual(app.commands.stats()['broken'], {'calls': 0, 'rejected': 1, 'limited': 0})
+
+    def test_device(self):
+        app = SimulatedSensorApplication({}, False, root='gw')
+        device = FanDevice(app, 'shed')
+        app.mqtt_subscribe_filters(app.commands.filters(device.device_commands))
+        app.broker.publish('gw/shed/fan', b'on')
+
+        self.assertEqual(device.fan, b'on')
+        self.assertFalse(hasattr(app, 'fan'))
@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sensor_app.device import GatewayDevice, load_devices
+from sensor_app.simulation import Broker, SimulatedSensorApplication
+
+
+class CounterDevice(GatewayDevice):
+    def init_events(self):
+        self.count = 0
+        self.job = self.schedule_periodic(self.event_period('count'), self.event_count, jitter=60)
+
+    def event_count(self, current_time):
+        self.count += 1
+        self.publish('count', self.count)
+
+
+class GatewayDeviceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.broker = Broker(keep=True)
+        self.host = SimulatedSensorApplication({}, False, broker=self.broker, root='gw')
+
+    def test_shared_loop(self):
+        devices = [CounterDevice(self.host, 'dev{0}'.format(i), {'count': 60}) for i in range(3)]
+        for device in devices:
+            device.init_events()
+        self.assertEqual(len(self.host._events), 3)
+        self.host.run_until(600)
+
+        self.assertEqual([device.count for device in devices], [10, 10, 10])
+        self.assertEqual(self.broker.last['gw/dev1/count'], b'10')
+        self.assertEqual(devices[2].mqtt_make_topic('halt'), 'gw/dev2/halt')
+        # the same handler is spread differently on each device
+        self.assertEqual(len(set(device.job.phase for device in devices)), 3)
+
+    def test_deadbands_per_device(self):
+        quiet = CounterDevice(self.host, 'quiet', {'count': 60}, deadbands={'count': {'absolute': 5}})
+        loud = CounterDevice(self.host, 'loud', {'count': 60})
+        quiet.init_events()
+        loud.init_events()
+        self.host.run_until(600)
+
+        topics = [topic for topic, payload in self.broker.log]
+        self.assertEqual(topics.count('gw/loud/count'), 10)
+        self.assertEqual(topics.count('gw/quiet/count'), 2)
+
+    def test_batch_per_device(self):
+        host = SimulatedSensorApplication({}, False, broker=self.broker, root='gw', batch_topic='batch')
+        devices = [CounterDevice(host, name, {'count': 60}, jitter=0) for name in ('a', 'b')]
+        for device in devices:
+            device.init_events()
+        host.publish('uptime', 1)
+        host.run_until(60)
+
+        # readings due together still go out on each device's own topic
+        self.assertEqual(sorted(self.broker.log), [
+            ('gw/a/batch', b'{"count": 1}'),
+            ('gw/b/batch', b'{"count": 1}'),
+            ('gw/batch', b'{"uptime": 1}'),
+        ])
+
+    def test_jitter_from_host(self):
+        self.host.jitter = 60
+        devices = [GatewayDevice(self.host, 'dev'), GatewayDevice(self.host, 'quiet', jitter=0)]
+        self.assertEqual([device.jitter for device in devices], [60, 0])
+
+    def test_bad_name(self):
+        for name in ('', 'a/b', 'a+', '#'):
+            with self.assertRaises(ValueError):
+                GatewayDevice(self.host, name)
+
+    def test_load_devices(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ('b', 'a'):
+            with open(os.path.join(directory, name + '.json'), 'w') as f:
+                json.dump({'class': 'sensor_app.device.GatewayDevice', 'event_periods': {'x': 5}}, f)
+        with open(os.path.join(directory, 'README'), 'w') as f:
+            f.write('ignored')
+
+        devices = load_devices(self.host, directory)
+        self.assertEqual([device.name for device in devices], ['a', 'b'])
+        self.assertEqual(devices[0].event_period('x'), 5)
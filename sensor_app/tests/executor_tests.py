@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from sensor_app.executor import HandlerExecutor, blocking
+from sensor_app.stats import LoopStats
+
+
+def make_app():
+    app = mock.Mock()
+    app.stats = LoopStats()
+    app.time.return_value = 0
+    return app
+
+
+def wait_idle(executor):
+    deadline = time.monotonic() + 5
+    while executor.busy() and time.monotonic() < deadline:
+        time.sleep(0.01)
+        executor.process()
+
+
+class ExecutorTestCase(unittest.TestCase):
+    def test_runs_off_loop_thread(self):
+        executor = HandlerExecutor(make_app(), 2)
+        results = []
+
+        @blocking()
+        def event_read(current_time):
+            executor.call_soon(results.append, threading.get_ident())
+
+        self.assertTrue(executor.submit(event_read, 0))
+        wait_idle(executor)
+        executor.process()
+
+        self.assertEqual(len(results), 1)
+        self.assertNotEqual(results[0], threading.get_ident())
+        self.assertEqual(executor.app.stats.handler('event_read@pool').count, 1)
+        executor.shutdown()
+
+    def test_device_exclusive(self):
+        executor = HandlerExecutor(make_app(), 2)
+        release = threading.Event()
+
+        @blocking(device='si7021')
+        def event_read(current_time):
+            release.wait(5)
+
+        self.assertTrue(executor.submit(event_read, 0))
+        self.assertFalse(executor.submit(event_read, 1))
+        self.assertEqual(executor.skipped, 1)
+        release.set()
+        wait_idle(executor)
+        self.assertTrue(executor.submit(event_read, 2))
+        wait_idle(executor)
+        executor.shutdown()
+
+    def test_timeout_discards_results(self):
+        executor = HandlerExecutor(make_app(), 1)
+        release = threading.Event()
+        results = []
+
+        @blocking(timeout=0)
+        def event_hung(current_time):
+            release.wait(5)
+            executor.call_soon(results.append, current_time)
+
+        executor.submit(event_hung, 0)
+        executor.process()
+        self.assertEqual(executor.timeouts, 1)
+        self.assertTrue(executor.busy())
+
+        release.set()
+        wait_idle(executor)
+        executor.process()
+        self.assertEqual(results, [])
+        executor.shutdown()
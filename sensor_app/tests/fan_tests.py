@@ -0,0 +1,87 @@
+import unittest
+
+from sensor_app.fan import FAN_KICKING, FAN_RUNNING, FAN_STOPPED, BandCurve, Fan, PidCurve, make_curve
+from sensor_app.simulation import SimulatedSensorApplication
+
+
+class BandCurveTestCase(unittest.TestCase):
+    def test_hysteresis(self):
+        curve = BandCurve(hysteresis=1)
+        temps = (27.9, 28.1, 27.9, 28.1, 27.2, 26.9, 28.0, 20)
+        duty_cycles = [curve.duty_cycle(temp, 0) for temp in temps]
+
+        self.assertEqual(duty_cycles, [40, 50, 50, 50, 50, 40, 50, 0])
+
+    def test_without_hysteresis(self):
+        curve = BandCurve(hysteresis=0)
+        self.assertEqual([curve.duty_cycle(temp, 0) for temp in (27.9, 28.1, 27.9)], [40, 50, 40])
+
+    def test_smoothing(self):
+        curve = BandCurve(hysteresis=0, smoothing=0.5)
+        curve.duty_cycle(30, 0)
+        # a single spike only moves the average half way
+        self.assertEqual(curve.duty_cycle(38, 60), 80)
+        self.assertEqual(curve.temperature, 34)
+
+    def test_bad_settings(self):
+        with self.assertRaises(ValueError):
+            BandCurve(edges=(26, 28), duty_cycles=(0, 50))
+        with self.assertRaises(ValueError):
+            make_curve({'mode': 'bang-bang'})
+
+
+class PidCurveTestCase(unittest.TestCase):
+    def test_output(self):
+        curve = make_curve({'mode': 'pid', 'setpoint': 30, 'kp': 20, 'ki': 0.1})
+        self.assertIsInstance(curve, PidCurve)
+        self.assertEqual(curve.duty_cycle(29, 0), 0)
+        self.assertEqual(curve.duty_cycle(32.5, 60), 50 + round(0.1 * 2.5 * 60))
+        self.assertEqual(curve.duty_cycle(40, 120), 100)
+
+    def test_no_windup(self):
+        curve = PidCurve(30, 20, ki=1)
+        for minute in range(10):
+            curve.duty_cycle(40, minute * 60)
+        self.assertEqual(curve.integral, 0)
+
+
+class FanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = SimulatedSensorApplication({}, False)
+        self.writes = []
+        self.fan = Fan(self.app, self.writes.append)
+
+    def test_kick_is_an_event(self):
+        self.fan.set(40, 0)
+        self.assertEqual(self.fan.state, FAN_KICKING)
+        self.assertEqual(self.writes, [90])
+
+        # a new target during the kick waits for it to end
+        self.fan.set(50, 1)
+        self.app.run_until(10)
+        self.assertEqual(self.fan.state, FAN_RUNNING)
+        self.assertEqual(self.writes, [90, 50])
+
+    def test_only_kicks_from_stopped(self):
+        self.fan.set(40, 0)
+        self.app.run_until(10)
+        self.fan.set(40, 10)
+        self.fan.set(50, 20)
+
+        self.assertEqual(self.writes, [90, 40, 50])
+        self.assertEqual(self.fan.kicks, 1)
+        self.assertEqual(self.fan.writes, 3)
+
+    def test_stop_during_kick(self):
+        self.fan.set(40, 0)
+        self.fan.set(0, 1)
+        self.app.run_until(10)
+
+        self.assertEqual(self.fan.state, FAN_STOPPED)
+        self.assertEqual(self.writes, [90, 0])
+        self.assertEqual(len(self.app._events), 0)
+
+    def test_fast_start_needs_no_kick(self):
+        self.fan.set(80, 0)
+        self.assertEqual(self.fan.state, FAN_RUNNING)
+        self.assertEqual(self.writes, [80])
@@ -0,0 +1,189 @@
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'main.py')
+
+
+class Board:
+    """Clock for the stand-in ``utime``."""
+    def __init__(self):
+        self.now = 0
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class WLAN:
+    """Station interface that connects straight away."""
+    def __init__(self, interface):
+        self.connected = False
+        self.bssid = None
+        self.scans = 0
+
+    def status(self):
+        return 5 if self.connected else 0
+
+    def active(self, state):
+        pass
+
+    def connect(self, ssid, password, bssid=None):
+        self.connected = True
+        self.bssid = bssid
+
+    def disconnect(self):
+        self.connected = False
+
+    def ifconfig(self, config=None):
+        return ('10.0.0.2', '255.255.255.0', '10.0.0.1', '10.0.0.1')
+
+    def scan(self):
+        self.scans += 1
+        return [(b'ssid', b'\x02\x00\x00\x00\x00\x01', 6, -60, 3, False)]
+
+
+def make_modules(board):
+    utime = types.ModuleType('utime')
+    utime.time = lambda: int(board.now)
+    utime.sleep = board.advance
+    utime.sleep_ms = lambda ms: board.advance(ms / 1000)
+    utime.ticks_ms = lambda: int(board.now * 1000)
+    utime.ticks_us = lambda: int(board.now * 1000000)
+    utime.ticks_diff = lambda end, start: end - start
+    utime.localtime = lambda secs=None: (2020, 1, 1, 0, 0, int(board.now if secs is None else secs), 0, 1)
+
+    machine = mock.Mock()
+    machine.DEEPSLEEP_RESET = 5
+    machine.reset_cause.return_value = 0
+
+    network = types.ModuleType('network')
+    network.STA_IF = 0
+    network.STAT_IDLE = 0
+    network.STAT_CONNECTING = 1
+    network.STAT_GOT_IP = 5
+    network.WLAN = WLAN
+
+    umqtt_simple = types.ModuleType('umqtt.simple')
+    umqtt_simple.MQTTClient = mock.Mock()
+    umqtt = types.ModuleType('umqtt')
+    umqtt.simple = umqtt_simple
+
+    bme280 = mock.Mock()
+    bme280.BME280.return_value.read_compensated_data.return_value = (2150, 101325 * 256, 45 * 1024)
+    si1145 = mock.Mock()
+    si1145.SI1145.return_value = types.SimpleNamespace(read_uv=1, read_visible=260, read_ir=250)
+    ads1x15 = mock.Mock()
+    ads1x15.ADS1015.return_value.read.return_value = 1200
+
+    return {
+        'machine': machine, 'utime': utime, 'network': network,
+        'umqtt': umqtt, 'umqtt.simple': umqtt_simple, 'ntptime': mock.Mock(),
+        'bme280': bme280, 'si1145': si1145, 'ads1x15': ads1x15,
+        # with no settings main() stops straight away, leaving the classes to test
+        'sensor_feed_config': types.ModuleType('sensor_feed_config'),
+    }
+
+
+class FirmwareTestCase(unittest.TestCase):
+    EVENT_PERIODS = {'ntp_sync': 3600, 'temperature': 300, 'light': 300, 'pump_running': 40, 'soil_moisture': 600}
+
+    def setUp(self):
+        self.board = Board()
+        patcher = mock.patch.dict(sys.modules, make_modules(self.board))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # the firmware's modules bind machine, utime etc. at import so load them fresh
+        for name in ('sensor_app.sensor_app_base', 'sensor_app.sensor_app_upython', 'sensor_app.startup',
+                     'sensor_app.wifi'):
+            sys.modules.pop(name, None)
+        self.main = runpy.run_path(MAIN)
+
+    def make_app(self, **kwargs):
+        return self.main['Application']('ssid', 'password', 'broker', 'root', 13, 12, 5, 4, 0x77,
+                                        dict(self.EVENT_PERIODS), False, **kwargs)
+
+    def test_repeated_water_plant(self):
+        app = self.make_app()
+        for i in range(2 * app.EVENT_CAPACITY):
+            self.board.advance(self.main['WATER_PLANT_MIN_INTERVAL'] + 1)
+            app.loop()
+            app.mqtt_recieve(b'root/water_plant', b'')
+
+        # each command replaces the scheduled watering rather than adding one
+        pump_on = [dtime for dtime, event in app._events.pending() if event == app.event_pump_on]
+        self.assertEqual(len(pump_on), 1)
+        self.assertEqual(app.events_dropped, 0)
+
+    def test_event_table_full(self):
+        app = self.make_app()
+        app._events.clear()
+        for i in range(app.EVENT_CAPACITY):
+            self.assertIsNotNone(app.event_schedule_offset(i, app.event_pump_off))
+
+        # logged and dropped rather than stopping the loop
+        self.assertIsNone(app.event_schedule_offset(60, app.event_pump_on))
+        self.assertEqual(app.events_dropped, 1)
+        self.assertFalse(app.event_cancel(None))
+        app.loop()
+        self.assertEqual(len(app._events), app.EVENT_CAPACITY - 1)
+
+    def test_wifi_scan_when_idle(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'wifi.json')
+        app = self.make_app(wifi_cache_path=path)
+        self.assertEqual(app.wifi.sta_if.scans, 0)
+
+        # connects and publishes the first readings, then scans while waiting for the next
+        app.loop()
+        self.assertTrue(app.mqtt_connected)
+        self.assertEqual(app.wifi.sta_if.scans, 1)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['bssid'], '020000000001')
+
+        app = self.make_app(wifi_cache_path=path)
+        self.assertEqual(app.wifi.sta_if.bssid, b'\x02\x00\x00\x00\x00\x01')
+        app.loop()
+        self.assertEqual(app.wifi.sta_if.scans, 0)
+
+    def test_light_read_once(self):
+        app = self.make_app()
+        app.sensor_si1145 = mock.Mock(read_uv=1, read_ir=250)
+        reads = mock.PropertyMock(side_effect=[260, 270])
+        type(app.sensor_si1145).read_visible = reads
+        app.observe = mock.Mock()
+        app.publisher.add = mock.Mock()
+        app.event_light(0)
+
+        # the adaptive schedule sees the value that is published
+        self.assertEqual(reads.call_count, 1)
+        app.observe.assert_called_once_with('light', 260, 0)
+        app.publisher.add.assert_any_call('visible', 260, 0)
+
+    def test_deep_sleep_events_must_be_methods(self):
+        app = self.make_app(power_mode='deep_sleep')
+        # saved by name before deep sleep, so anything else would be lost
+        self.assertRaises(ValueError, app.event_schedule_offset, 60, lambda current_time: None)
+        self.assertRaises(ValueError, app.event_schedule_offset, 60, self.make_app().event_pump_off)
+        self.assertIsNotNone(app.event_schedule_offset(60, app.event_pump_off))
+
+    def test_water_plant_after_deep_sleep(self):
+        machine = sys.modules['machine']
+        machine.reset_cause.return_value = machine.DEEPSLEEP_RESET
+        self.board.advance(1000)
+        next_on = self.main['next_water_time'](1000)
+        machine.RTC.return_value.memory.return_value = json.dumps([900, [[next_on, 'event_pump_on']]]).encode()
+        app = self.make_app(power_mode='deep_sleep')
+
+        self.board.advance(self.main['WATER_PLANT_MIN_INTERVAL'] + 1)
+        app.mqtt_recieve(b'root/water_plant', b'')
+
+        # the restored run is replaced rather than joined by another
+        pump_on = [dtime for dtime, event in app._events.pending() if event == app.event_pump_on]
+        self.assertEqual(pump_on, [next_on])
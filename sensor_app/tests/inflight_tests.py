@@ -0,0 +1,65 @@
+import unittest
+
+from sensor_app.inflight import InflightWindow
+from sensor_app.simulation import Broker
+
+
+class Clock:
+    now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class InflightWindowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.broker = Broker(keep=True)
+
+    def make_client(self, **kwargs):
+        client = self.broker.client(latency=0.5, clock=self.clock.time, sleep=self.clock.sleep, **kwargs)
+        client.connect('localhost')
+        client.loop(timeout=0)
+        return client
+
+    def test_window(self):
+        client = self.make_client()
+        sender = InflightWindow(client, 2, 5, self.clock.time)
+        self.assertTrue(sender.publish('a', b'1'))
+        self.assertTrue(sender.publish('a', b'2'))
+        self.assertTrue(sender.full())
+        self.assertFalse(sender.publish('a', b'3'))
+
+        client.loop(timeout=1)
+        self.assertEqual(len(sender), 0)
+        self.assertEqual(self.clock.now, 0.5)
+        self.assertEqual(sender.rtt.as_dict()['mean_us'], 500000)
+        self.assertEqual(sender.stats()['full'], 1)
+
+    def test_reconnect(self):
+        client = self.make_client()
+        sender = InflightWindow(client, 2, 5, self.clock.time)
+        sender.publish('a', b'1')
+        sender.publish('a', b'2')
+        # the acknowledgements are lost with the connection
+        client.disconnect()
+        client.loop(timeout=1)
+        self.assertTrue(sender.full())
+
+        # nothing is resent here, that is left to the client
+        client.connect('localhost')
+        client.loop(timeout=0)
+        sender.reset()
+        self.assertEqual(len(sender), 0)
+        self.assertTrue(sender.publish('a', b'3'))
+        self.assertEqual(self.broker.log, [('a', b'1'), ('a', b'2'), ('a', b'3')])
+        self.assertEqual(sender.stats()['resets'], 1)
+
+        # a late acknowledgement for a message from before is ignored
+        sender.on_publish(client, None, 1)
+        self.assertEqual(sender.acked, 0)
+        client.loop(timeout=1)
+        self.assertEqual(sender.acked, 1)
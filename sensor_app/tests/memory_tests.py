@@ -0,0 +1,93 @@
+import gc
+import tracemalloc
+import unittest
+
+from sensor_app.publisher import Publisher
+from sensor_app.scheduler import EventTable
+from sensor_app.sensor_app_base import SensorApplication
+
+
+class FakeBoardApp(SensorApplication):
+    """Firmware-like app: event table, buffered payloads, a sink that keeps nothing."""
+    def __init__(self, *args, **kwargs):
+        super(FakeBoardApp, self).__init__(*args, **kwargs)
+        self._events = EventTable(8)
+        self.now = 0
+        self.sent = 0
+        # called with each payload, while the pass's temporaries are live
+        self.probe = None
+        self.publisher = Publisher(self.send, lambda *sub_topics: bytes('/'.join(('root',) + sub_topics), 'utf-8'),
+                                   payload_buffer=16)
+        self.publisher.intern('temperature', 'humidity')
+
+    def send(self, topic, payload):
+        self.sent += len(payload)
+        if self.probe is not None:
+            self.probe()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def localtime(self, timeval):
+        return timeval
+
+    def post_event_handler(self, current_time):
+        self.publisher.tick(current_time)
+
+    def event_temperature(self, current_time):
+        # raw counts, as the BME280 driver returns; float arithmetic boxes
+        # its result here and on the board alike
+        self.publisher.add('temperature', 2150, current_time)
+        self.publisher.add('humidity', current_time % 100, current_time)
+
+
+class SteadyStateAllocationTestCase(unittest.TestCase):
+    # the modules on the firmware's hot path
+    HOT_PATH = ('*sensor_app/publisher.py', '*sensor_app/scheduler.py')
+
+    def snapshot(self, *patterns):
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, pattern)
+                                                          for pattern in patterns])
+
+    def test_loop_does_not_grow(self):
+        app = FakeBoardApp({}, False)
+        app.schedule_periodic(10, app.event_temperature, run_now=True)
+        app.event_schedule_offset(15, app.event_temperature)
+
+        new = []
+
+        def check():
+            # blocks from the hot path that weren't there when the pass began
+            new.extend(stat for stat in self.snapshot(*self.HOT_PATH).compare_to(start, 'lineno')
+                       if stat.count_diff > 0)
+
+        tracemalloc.start()
+        try:
+            # warm up: registers handlers, stats histograms and topics, and
+            # takes the counters past CPython's small int cache (MicroPython
+            # keeps them unboxed anyway)
+            for _ in range(300):
+                app.loop()
+            gc.collect()
+            before = self.snapshot('*sensor_app*').filter_traces([tracemalloc.Filter(False, '*tests*')])
+            app.probe = check
+            for _ in range(100):
+                start = self.snapshot(*self.HOT_PATH)
+                app.loop()
+                check()
+            app.probe = None
+            for _ in range(400):
+                app.loop()
+            gc.collect()
+            after = self.snapshot('*sensor_app*').filter_traces([tracemalloc.Filter(False, '*tests*')])
+        finally:
+            tracemalloc.stop()
+
+        self.assertGreater(app.sent, 0)
+        growth = after.compare_to(before, 'lineno')
+        self.assertEqual(sum(stat.size_diff for stat in growth), 0)
+        # nothing allocated by the publisher or event table within a pass
+        self.assertEqual(new, [])
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+from sensor_app.outbox import FileOutbox, RamOutbox
+
+
+class SendUntil:
+    def __init__(self, limit):
+        self.limit = limit
+        self.sent = []
+
+    def __call__(self, timestamp, topic, payload):
+        if len(self.sent) >= self.limit:
+            return False
+        self.sent.append((timestamp, topic, bytes(payload)))
+        return True
+
+
+class RamOutboxTestCase(unittest.TestCase):
+    def make_outbox(self, capacity):
+        return RamOutbox(capacity)
+
+    def test_fifo(self):
+        outbox = self.make_outbox(4)
+        for i in range(3):
+            outbox.put(i, 'a/b', b'%d' % i)
+
+        send = SendUntil(2)
+        self.assertEqual(outbox.drain(send), 2)
+        self.assertEqual(send.sent, [(0, 'a/b', b'0'), (1, 'a/b', b'1')])
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(outbox.pop(), (2, 'a/b', b'2'))
+        self.assertIsNone(outbox.pop())
+
+    def test_overflow_drops_oldest(self):
+        outbox = self.make_outbox(3)
+        for i in range(5):
+            outbox.put(i, 't', b'x')
+
+        stats = outbox.stats()
+        self.assertEqual(stats['depth'], 3)
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['enqueued'], 5)
+        self.assertEqual(outbox.peek()[0], 2)
+
+    def test_shift_time(self):
+        outbox = self.make_outbox(3)
+        for i in range(4):
+            outbox.put(i, 't', b'%d' % i)
+        outbox.shift_time(100)
+
+        send = SendUntil(3)
+        outbox.drain(send)
+        self.assertEqual(send.sent, [(101, 't', b'1'), (102, 't', b'2'), (103, 't', b'3')])
+
+    def test_drain_limit(self):
+        outbox = self.make_outbox(10)
+        for i in range(10):
+            outbox.put(i, 't', b'x')
+
+        self.assertEqual(outbox.drain(SendUntil(100), limit=4), 4)
+        self.assertEqual(outbox.stats()['sent'], 4)
+        self.assertEqual(len(outbox), 6)
+
+
+class FileOutboxTestCase(RamOutboxTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def make_outbox(self, capacity):
+        return FileOutbox(self.path, capacity, slot_size=64)
+
+    def test_survives_reopen(self):
+        outbox = self.make_outbox(4)
+        outbox.put(1.5, 'a/b', b'one')
+        outbox.put(2.5, 'a/c', b'two')
+        outbox.pop()
+        outbox.close()
+
+        outbox = self.make_outbox(4)
+        self.assertEqual(len(outbox), 1)
+        timestamp, topic, payload = outbox.pop()
+        self.assertEqual((timestamp, topic, payload), (2.5, 'a/c', b'two'))
+        outbox.close()
+
+    def test_oversized_dropped(self):
+        outbox = self.make_outbox(4)
+        self.assertFalse(outbox.put(0, 't', b'x' * 100))
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(outbox.stats()['dropped'], 1)
+        self.assertEqual(outbox.stats()['oversized'], 1)
+        self.assertFalse(outbox.fits('t', b'x' * 100))
+        self.assertTrue(outbox.fits('t', b'x' * 10))
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+from sensor_app.power import PowerManager, POWER_ALWAYS_ON, POWER_DEEP_SLEEP, POWER_LIGHT_SLEEP
+
+
+class FakeRTC:
+    data = b''
+
+    def memory(self, data=None):
+        if data is None:
+            return FakeRTC.data
+        FakeRTC.data = data
+
+
+class App:
+    def event_temperature(self, current_time):
+        pass
+
+    def event_light(self, current_time):
+        pass
+
+
+def make_machine():
+    FakeRTC.data = b''
+    machine = mock.Mock()
+    machine.DEEPSLEEP_RESET = 5
+    machine.RTC = FakeRTC
+    machine.reset_cause.return_value = 0
+    return machine
+
+
+class PowerManagerTestCase(unittest.TestCase):
+    def test_modes(self):
+        machine = make_machine()
+        self.assertFalse(PowerManager(machine, POWER_ALWAYS_ON).radio_off(3600))
+
+        light = PowerManager(machine, POWER_LIGHT_SLEEP)
+        self.assertTrue(light.radio_off(light.RADIO_OFF_AFTER))
+        self.assertFalse(light.use_deep_sleep(3600))
+
+        deep = PowerManager(machine, POWER_DEEP_SLEEP)
+        self.assertFalse(deep.use_deep_sleep(deep.DEEP_SLEEP_AFTER - 1))
+        self.assertTrue(deep.use_deep_sleep(deep.DEEP_SLEEP_AFTER))
+
+    def test_schedule_round_trip(self):
+        machine = make_machine()
+        app = App()
+        power = PowerManager(machine, POWER_DEEP_SLEEP)
+        power.deep_sleep(120, [(100, app.event_temperature), (200, app.event_light)], 50)
+        machine.deepsleep.assert_called_once_with(120000)
+
+        # normal boot ignores whatever is in RTC memory
+        self.assertIsNone(power.load_schedule())
+
+        machine.reset_cause.return_value = machine.DEEPSLEEP_RESET
+        self.assertEqual(power.load_schedule(), (50, [(100, 'event_temperature'), (200, 'event_light')]))
@@ -0,0 +1,151 @@
+import json
+import unittest
+from unittest import mock
+
+from sensor_app.publisher import Deadband, Publisher, FORMAT_BINARY, decode_binary, encode_value, format_value
+
+
+def make_topic(*sub_topics):
+    return "/".join(("root",) + sub_topics)
+
+
+class PublisherTestCase(unittest.TestCase):
+    def test_per_field(self):
+        publish = mock.Mock()
+        publisher = Publisher(publish, make_topic)
+        publisher.add('temperature', 21.5, 0)
+        publisher.add('humidity', 40, 0)
+        publish.assert_not_called()
+
+        publisher.tick(0)
+        publish.assert_has_calls([
+            mock.call('root/temperature', b'21.5'),
+            mock.call('root/humidity', b'40'),
+        ])
+        self.assertEqual(publisher.sent, 2)
+
+    def test_coalesced_json(self):
+        publish = mock.Mock()
+        publisher = Publisher(publish, make_topic, batch_topic='readings')
+        publisher.add('temperature', 21.5, 0)
+        publisher.add('humidity', 40, 0)
+        publisher.flush()
+
+        topic, payload = publish.call_args[0]
+        self.assertEqual(topic, 'root/readings')
+        self.assertEqual(json.loads(payload), {'temperature': 21.5, 'humidity': 40})
+
+    def test_coalesced_binary(self):
+        publish = mock.Mock()
+        publisher = Publisher(publish, make_topic, batch_topic='readings', fmt=FORMAT_BINARY)
+        publisher.add('temperature', 21.5, 0)
+        publisher.add('humidity', 40, 0)
+        publisher.flush()
+
+        self.assertEqual(decode_binary(publish.call_args[0][1]), [('temperature', 21.5), ('humidity', 40.0)])
+
+    def test_thresholds(self):
+        publish = mock.Mock()
+        publisher = Publisher(publish, make_topic, batch_topic='readings', max_batch=3, max_age=10)
+        publisher.add('a', 1, 0)
+        publisher.tick(5)
+        publish.assert_not_called()
+        publisher.tick(10)
+        self.assertEqual(publish.call_count, 1)
+
+        for i in range(3):
+            publisher.add('b', i, 20)
+        self.assertEqual(publish.call_count, 2)
+
+    def test_topics_cached(self):
+        make = mock.Mock(side_effect=make_topic)
+        publisher = Publisher(mock.Mock(), make)
+        publisher.intern('a')
+        publisher.add('a', 1)
+        publisher.add('a', 2)
+        publisher.flush()
+        make.assert_called_once_with('a')
+
+    def test_payload_buffer(self):
+        sent = []
+        publisher = Publisher(lambda topic, payload: sent.append(bytes(payload)), make_topic, payload_buffer=16)
+        publisher.add('temperature', 21.5, 0)
+        publisher.add('humidity', 40, 0)
+        publisher.add('status', b'ok', 0)
+        publisher.flush()
+
+        self.assertEqual(sent, [b'21.5', b'40', b'ok'])
+
+    def test_deadbands(self):
+        publish = mock.Mock()
+        publisher = Publisher(publish, make_topic, deadbands={
+            'temperature': {'absolute': 0.5},
+            'fan_duty_cycle': {'heartbeat': 600, 'retain': True},
+        })
+        for current_time, temp in enumerate((21.0, 21.2, 21.4, 21.6, 21.7)):
+            publisher.add('temperature', temp, current_time)
+            publisher.add('fan_duty_cycle', 40, current_time)
+            publisher.add('humidity', 40, current_time)
+        publisher.add('fan_duty_cycle', 40, 600)
+        publisher.flush()
+
+        sent = [call[0] for call in publish.call_args_list]
+        self.assertEqual([call[1] for call in sent if call[0] == 'root/temperature'], [b'21.0', b'21.6'])
+        self.assertEqual(sent.count(('root/fan_duty_cycle', b'40', True)), 2)
+        self.assertEqual(publisher.stats(), {'sent': 9, 'readings': 9, 'suppressed': 7})
+
+
+class DeadbandTestCase(unittest.TestCase):
+    def test_percent(self):
+        rule = Deadband(percent=10)
+        self.assertTrue(rule.accept(50, 0))
+        self.assertFalse(rule.accept(54, 1))
+        self.assertTrue(rule.accept(45, 2))
+
+    def test_zero(self):
+        rule = Deadband(percent=10, heartbeat=3600)
+        self.assertTrue(rule.accept(0, 0))
+        self.assertFalse(rule.accept(0, 60))
+        self.assertTrue(rule.accept(40, 120))
+
+        rule = Deadband(absolute=0)
+        self.assertTrue(rule.accept(0.0, 0))
+        self.assertFalse(rule.accept(0.0, 60))
+        self.assertTrue(rule.accept(0.1, 120))
+
+    def test_heartbeat(self):
+        rule = Deadband(absolute=1, heartbeat=60)
+        self.assertTrue(rule.accept(20, 0))
+        self.assertFalse(rule.accept(20, 59))
+        self.assertTrue(rule.accept(20, 60))
+        self.assertFalse(rule.accept(20.5, 100))
+
+    def test_change_only(self):
+        rule = Deadband()
+        self.assertTrue(rule.accept(b'on', 0))
+        self.assertFalse(rule.accept(b'on', 1))
+        self.assertTrue(rule.accept(b'off', 2))
+
+
+class FormatValueTestCase(unittest.TestCase):
+    def check(self, value, expected):
+        buf = bytearray(16)
+        length = format_value(buf, value)
+        self.assertEqual(bytes(buf[:length]), expected)
+
+    def test_ints(self):
+        for value in (0, 7, 40, -12, 1234567890):
+            self.check(value, encode_value(value))
+
+    def test_floats(self):
+        self.check(21.5, b'21.5')
+        self.check(45.0, b'45.0')
+        self.check(0.05, b'0.05')
+        self.check(-3.25, b'-3.25')
+        self.check(1013.2512, b'1013.251')
+        self.check(-0.0001, b'0.0')
+
+    def test_fallback(self):
+        buf = bytearray(4)
+        for value in (True, 'x', b'x', float('nan'), float('inf'), 1e9, 123456):
+            self.assertEqual(format_value(buf, value), -1)
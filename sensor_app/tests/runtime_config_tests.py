@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sensor_app.device import DeviceHost, GatewayDevice
+from sensor_app.runtime_config import RuntimeConfig
+from sensor_app.scheduler import EventTable
+from sensor_app.simulation import SimulatedSensorApplication
+
+
+class SimulatedGateway(DeviceHost, SimulatedSensorApplication):
+    def __init__(self, *args, **kwargs):
+        super(SimulatedGateway, self).__init__(*args, **kwargs)
+        self.devices = {}
+
+
+class ReadingDevice(GatewayDevice):
+    def init_events(self):
+        self.reads = []
+        self.schedule_reading('temperature', self.event_temperature)
+
+    def event_temperature(self, current_time):
+        self.reads.append(current_time)
+        self.publish('temperature', 0)
+
+
+class RuntimeConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'config.json')
+        self.event_periods = {'temperature': 300}
+
+    def make_app(self, events=None):
+        app = SimulatedSensorApplication(self.event_periods, False,
+                                         deadbands={'temperature': {'absolute': 1}})
+        if events is not None:
+            app._events = events
+        app.runtime_config = RuntimeConfig(app, self.path)
+        app.mqtt_subscribe_filters(app.commands.filters([app.runtime_config.command]))
+        app.reads = []
+        app.schedule_reading('temperature', lambda current_time: app.reads.append(current_time))
+        return app
+
+    def send(self, app, settings):
+        app.broker.publish('sim/config', json.dumps(settings), retain=True)
+
+    def test_reschedule_in_place(self):
+        app = self.make_app()
+        job = app._period_jobs['temperature']
+        handle = job._handle
+        app.now = 130
+        self.send(app, {'event_periods': {'temperature': 60}})
+
+        self.assertIs(job._handle, handle)
+        self.assertEqual(job.next_time, 180)
+        app.run_until(400)
+        self.assertEqual(app.reads, [180, 240, 300, 360])
+        self.assertEqual(self.event_periods, {'temperature': 300})
+
+    def test_persisted(self):
+        app = self.make_app()
+        self.send(app, {'event_periods': {'temperature': 60}, 'deadbands': {'temperature': None}})
+        self.assertEqual(app.runtime_config.updates, 1)
+
+        # a retained message delivered again on reconnect changes nothing
+        self.send(app, {'event_periods': {'temperature': 60}})
+        self.assertEqual(app.runtime_config.updates, 1)
+
+        app = self.make_app()
+        self.assertEqual(app.event_period('temperature'), 60)
+        self.assertNotIn('temperature', app.publisher.deadbands)
+
+    def test_adaptive(self):
+        app = SimulatedSensorApplication({}, False)
+        config = RuntimeConfig(app)
+        app.adaptive_periods['temperature'] = {'min_period': 30, 'max_period': 480}
+        job = app.schedule_reading('temperature', lambda current_time: None)
+        config.apply({'adaptive_periods': {'temperature': {'max_period': 120}}}, 0)
+
+        self.assertEqual(job.max_period, 120)
+        self.assertEqual(job.period, 120)
+        self.assertEqual(job.next_time, 120)
+
+    def test_adaptive_switch(self):
+        app = self.make_app()
+        fixed = app._period_jobs['temperature']
+        app.now = 130
+        self.send(app, {'adaptive_periods': {'temperature': {'min_period': 60, 'max_period': 120}}})
+
+        job = app._adaptive_jobs['temperature']
+        self.assertNotIn('temperature', app._period_jobs)
+        self.assertIsNone(fixed._handle)
+        self.assertEqual(job.next_time, 240)
+        app.run_until(400)
+        self.assertEqual(app.reads, [240, 360])
+
+        # and back to the fixed period on removing it
+        self.send(app, {'adaptive_periods': {'temperature': None}})
+        self.assertNotIn('temperature', app._adaptive_jobs)
+        self.assertEqual(app._period_jobs['temperature'].next_time, 600)
+        app.run_until(700)
+        self.assertEqual(app.reads, [240, 360, 600])
+
+        app = self.make_app()
+        self.assertNotIn('temperature', app.adaptive_periods)
+        self.assertIn('temperature', app._period_jobs)
+
+    def test_rejected(self):
+        app = self.make_app()
+        for settings in ({'event_periods': {'temperature': 0}},
+                         {'event_periods': {'temperature': True}},
+                         {'event_periods': {'temperature': 60}, 'deadbands': {'humidity': {'wide': 1}}},
+                         {'adaptive_periods': {'temperature': {'max_period': 60}}},
+                         {'colour': 'blue'},
+                         [1]):
+            self.send(app, settings)
+        app.broker.publish('sim/config', b'{')
+
+        self.assertEqual(app.runtime_config.command.rejected, 7)
+        self.assertEqual(app.event_period('temperature'), 300)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_fractional_period(self):
+        # as on a board, where the event table only holds whole seconds
+        app = self.make_app(EventTable(8))
+        self.send(app, {'event_periods': {'temperature': 60.5}})
+        self.send(app, {'adaptive_periods': {'temperature': {'min_period': 30, 'max_period': 90.5}}})
+
+        self.assertEqual(app.runtime_config.command.rejected, 2)
+        self.assertFalse(os.path.exists(self.path))
+        app.run_until(700)
+        self.assertEqual(app.reads, [300, 600])
+
+    def test_fractional_window(self):
+        app = SimulatedSensorApplication({}, False)
+        config = RuntimeConfig(app, self.path)
+        app.mqtt_subscribe_filters(app.commands.filters([config.command]))
+        app.adaptive_periods['temperature'] = {'min_period': 30, 'max_period': 480}
+        job = app.schedule_reading('temperature', lambda current_time: None)
+        for rule in ({'window': 2.5}, {'backoff': 1.5}):
+            app.broker.publish('sim/config', json.dumps({'adaptive_periods': {'temperature': rule}}))
+
+        self.assertEqual(config.command.rejected, 2)
+        self.assertEqual((job.window, job.backoff), (4, 2))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_gateway_devices(self):
+        app = SimulatedGateway({}, False)
+        device = app.add_device(ReadingDevice(app, 'dev', {'temperature': 300}))
+        config = RuntimeConfig(app, self.path)
+        config.apply(config.validate({'event_periods': {'dev/temperature': 60},
+                                      'deadbands': {'dev/temperature': {'absolute': 1}}}), 0)
+
+        self.assertEqual(device.event_period('temperature'), 60)
+        self.assertNotIn('dev/temperature', app.event_periods)
+        app.run_until(200)
+        self.assertEqual(device.reads, [60, 120, 180])
+        self.assertEqual(app.publisher.suppressed, 2)
+
+        # a device that isn't there would change nothing
+        for settings in ({'event_periods': {'other/temperature': 60}},
+                         {'deadbands': {'dev/': None}},
+                         {'adaptive_periods': {'other/temperature': {'min_period': 30, 'max_period': 60}}}):
+            with self.assertRaises(ValueError):
+                config.validate(settings)
+
+    def test_device_keys_need_a_gateway(self):
+        app = self.make_app()
+        self.send(app, {'event_periods': {'dev/temperature': 60}})
+        self.assertEqual(app.runtime_config.command.rejected, 1)
@@ -0,0 +1,283 @@
+import unittest
+from unittest import mock
+
+from sensor_app.scheduler import EventQueue, EventTable
+from sensor_app.sensor_app_base import SensorApplication
+
+
+class FakeClockApp(SensorApplication):
+    def __init__(self, *args, **kwargs):
+        super(FakeClockApp, self).__init__(*args, **kwargs)
+        self.now = 0
+        self.waits = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.waits.append(seconds)
+        self.now += seconds
+
+    def localtime(self, timeval):
+        return timeval
+
+
+class EventQueueTestCase(unittest.TestCase):
+    def test_order(self):
+        queue = EventQueue()
+        for dtime, name in [(5, 'c'), (1, 'a'), (3, 'b'), (1, 'a2')]:
+            queue.push(dtime, name)
+
+        self.assertEqual(len(queue), 4)
+        self.assertEqual(queue.pop_due(3), [(1, 'a'), (1, 'a2'), (3, 'b')])
+        self.assertEqual(queue.next_time(), 5)
+
+    def test_cancel(self):
+        queue = EventQueue()
+        first = queue.push(1, 'a')
+        queue.push(2, 'b')
+
+        self.assertTrue(queue.cancel(first))
+        self.assertFalse(queue.cancel(first))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.next_time(), 2)
+        self.assertEqual(queue.pop(), (2, 'b'))
+        self.assertIsNone(queue.next_time())
+
+    def test_cancel_after_fire(self):
+        queue = EventQueue()
+        handle = queue.push(1, 'a')
+        queue.pop()
+
+        self.assertFalse(queue.cancel(handle))
+        self.assertEqual(len(queue), 0)
+
+    def test_cancel_after_clear(self):
+        for queue in (EventQueue(), EventTable(4)):
+            handle = queue.push(1, 'a')
+            queue.clear()
+
+            self.assertFalse(queue.cancel(handle))
+            self.assertFalse(queue.reschedule(handle, 2))
+            self.assertEqual(len(queue), 0)
+            self.assertIsNone(queue.next_time())
+
+    def test_reschedule(self):
+        for queue in (EventQueue(), EventTable(4)):
+            first = queue.push(1, 'a')
+            queue.push(2, 'b')
+
+            self.assertTrue(queue.reschedule(first, 3))
+            self.assertEqual(queue.pop(), (2, 'b'))
+            self.assertTrue(queue.reschedule(first, 4))
+            self.assertEqual(queue.pop(), (4, 'a'))
+            self.assertFalse(queue.reschedule(first, 5))
+
+
+class EventTableTestCase(unittest.TestCase):
+    def test_order(self):
+        table = EventTable(4)
+        for dtime, name in [(5, 'c'), (1, 'a'), (3, 'b'), (1, 'a2')]:
+            table.push(dtime, name)
+
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.pending(), [(1, 'a'), (1, 'a2'), (3, 'b'), (5, 'c')])
+        self.assertEqual(table.pop_due(3), [[1, 'a'], [1, 'a2'], [3, 'b']])
+        self.assertEqual(table.next_time(), 5)
+        self.assertEqual(table.handlers, ['c', 'a', 'b', 'a2'])
+
+    def test_stale_handle(self):
+        table = EventTable(1)
+        first = table.push(1, 'a')
+        table.pop()
+        # the slot is reused but the old handle must not cancel the new event
+        table.push(2, 'b')
+
+        self.assertFalse(table.cancel(first))
+        self.assertEqual(len(table), 1)
+        self.assertRaises(IndexError, table.push, 3, 'c')
+
+    def test_handlers_registered_once(self):
+        table = EventTable(2)
+        for dtime in range(10):
+            handle = table.push(dtime, 'a')
+            self.assertTrue(table.cancel(handle))
+
+        self.assertEqual(table.handlers, ['a'])
+        self.assertIsNone(table.next_time())
+
+
+class SensorAppLoopTestCase(unittest.TestCase):
+    def test_sleeps_until_deadline(self):
+        app = FakeClockApp({}, False)
+        event = mock.Mock()
+        app.event_schedule_offset(2.5, event)
+        app.event_schedule_offset(100, lambda current_time: setattr(app, 'should_bail', True))
+        app.run()
+
+        event.assert_called_once_with(2.5)
+        self.assertEqual(app.waits[0], 2.5)
+        self.assertEqual(app.now, 100)
+        self.assertTrue(all(wait <= app.MAX_WAIT for wait in app.waits))
+
+    def test_rescheduled_event_waits_for_next_pass(self):
+        app = FakeClockApp({}, False)
+        calls = []
+
+        def event(current_time):
+            calls.append(current_time)
+            app.event_schedule_offset(0, event)
+
+        app.event_schedule_offset(0, event)
+        app.loop()
+
+        self.assertEqual(calls, [0])
+        self.assertEqual(len(app._events), 1)
+
+
+class PeriodicTestCase(unittest.TestCase):
+    def test_fixed_slots(self):
+        app = FakeClockApp({}, False)
+        app.now = 7
+        calls = []
+
+        def event(current_time):
+            calls.append(current_time)
+            # slow handler shouldn't shift the next slot
+            app.now += 3
+
+        job = app.schedule_periodic(10, event, phase=2)
+        for _ in range(4):
+            app.loop()
+
+        self.assertEqual(calls[:3], [12, 22, 32])
+        self.assertEqual(job.missed, 0)
+
+    def test_overrun(self):
+        app = FakeClockApp({}, False)
+        calls = []
+
+        def event(current_time):
+            calls.append(current_time)
+            app.now += 25
+
+        job = app.schedule_periodic(10, event, run_now=True)
+        app.loop()
+
+        # ran 0-25, so the slots at 10 and 20 are skipped
+        self.assertEqual(calls, [0])
+        self.assertEqual(job.next_time, 30)
+        self.assertEqual(job.missed, 2)
+        self.assertEqual(job.overruns, 1)
+        # and published with the loop stats
+        stats = app.stats.as_dict()
+        self.assertEqual((stats['overruns'], stats['missed']), (1, 2))
+        app.stats.reset()
+        self.assertEqual(app.stats.as_dict()['missed'], 0)
+
+    def test_clock_step(self):
+        app = FakeClockApp({}, False)
+        calls = []
+        job = app.schedule_periodic(60, calls.append, run_now=True)
+        app.event_schedule_offset(40, calls.append)
+        app.loop()
+
+        # NTP sets the clock forward while the job is pending
+        self.assertEqual(app.now, 30)
+        app.now += 1000000
+        app.clock_stepped(1000000, app.now)
+        self.assertEqual(job.next_time, 1000080)
+        while len(calls) < 3:
+            app.loop()
+
+        self.assertEqual(calls, [0, 1000040, 1000080])
+        self.assertEqual(job.missed, 0)
+
+    def test_clock_step_in_handler(self):
+        app = FakeClockApp({'ntp_sync': 60}, False)
+
+        def sync(current_time):
+            app.now += 1000
+            app.clock_stepped(1000, app.now)
+
+        job = app.schedule_reading('ntp_sync', sync, run_now=True)
+        app.loop()
+
+        self.assertEqual(job.next_time, 1020)
+        self.assertEqual(job.overruns, 0)
+
+    def test_jitter_is_stable(self):
+        app = FakeClockApp({}, False)
+        event = mock.Mock(__name__='event_temperature')
+        first = app.schedule_periodic(300, event, jitter=30)
+        second = app.schedule_periodic(300, event, jitter=30)
+
+        self.assertEqual(first.phase, second.phase)
+        self.assertTrue(0 <= first.phase < 30)
+
+    def test_reading_jitter(self):
+        app = FakeClockApp({}, False, jitter=30)
+        event = mock.Mock(__name__='event_temperature')
+
+        self.assertEqual(app.schedule_reading('temperature', event).phase,
+                         app.schedule_periodic(300, event, jitter=30).phase)
+        self.assertEqual(app.schedule_reading('temperature', event, jitter=0).phase, 0)
+
+    def test_cancel(self):
+        app = FakeClockApp({}, False)
+        event = mock.Mock(__name__='event')
+        job = app.schedule_periodic(10, event)
+        job.cancel()
+
+        self.assertEqual(len(app._events), 0)
+
+
+class AdaptiveTestCase(unittest.TestCase):
+    def run_signal(self, signal, seconds):
+        app = FakeClockApp({}, False, adaptive_periods={
+            'temperature': {'min_period': 30, 'max_period': 240, 'rate': 0.002},
+        })
+        calls = []
+
+        def event_temperature(current_time):
+            calls.append(current_time)
+            app.observe('temperature', signal(current_time), current_time)
+
+        job = app.schedule_reading('temperature', event_temperature, run_now=True)
+        app.event_schedule_offset(seconds, lambda current_time: setattr(app, 'should_bail', True))
+        app.run()
+        return job, calls
+
+    def test_stable_signal_backs_off(self):
+        job, calls = self.run_signal(lambda current_time: 20.0, 960)
+
+        self.assertEqual(calls, [0, 240, 480, 720, 960])
+        self.assertEqual(job.period, 240)
+        self.assertEqual(job.speedups, 0)
+
+    def test_step_speeds_up(self):
+        # steps up by 1 degree at 500s, then holds
+        job, calls = self.run_signal(lambda current_time: 20.0 if current_time < 500 else 21.0, 1200)
+
+        self.assertEqual(calls[:4], [0, 240, 480, 720])
+        # seen at 720, then every 30s doubling back up to the max
+        self.assertEqual(calls[4:], [750, 780, 840, 960, 1200])
+        self.assertEqual(job.speedups, 1)
+
+    def test_fixed_without_settings(self):
+        app = FakeClockApp({'light': 60}, False)
+        job = app.schedule_reading('light', mock.Mock(__name__='event_light'))
+        app.observe('light', 1, 0)
+
+        self.assertEqual(job.period, 60)
+        self.assertNotIn('light', app._adaptive_jobs)
+
+    def test_pending_run_brought_forward(self):
+        app = FakeClockApp({}, False, adaptive_periods={'temperature': {'min_period': 10, 'max_period': 100}})
+        job = app.schedule_reading('temperature', mock.Mock(__name__='event_temperature'))
+        self.assertEqual(job.next_time, 100)
+
+        app.now = 42
+        job.set_period(10, app.now)
+        self.assertEqual(job.next_time, 50)
+        self.assertEqual(len(app._events), 1)
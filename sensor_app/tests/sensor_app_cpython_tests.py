@@ -1,8 +1,16 @@
+import asyncio
 import os
+import shutil
+import tempfile
+import time
 import unittest
 from unittest import mock
 
+from sensor_app.sensor_app_asyncio import AsyncSensorApplication
+from sensor_app.executor import blocking
 from sensor_app.sensor_app_cpython import CPythonSensorApplication
+from sensor_app.simulation import Broker, VirtualClock
+from sensor_app.timeseries import decode_points
 
 
 class SimpleApp(CPythonSensorApplication):
@@ -17,10 +25,237 @@ class SimpleApp(CPythonSensorApplication):
     def bail(self, current_time):
         self.should_bail = True
         
+
+class SimulatedApp(VirtualClock, SimpleApp):
+    def mqtt_make_client(self):
+        self.broker = Broker()
+        return self.broker.client()
+
+
+class AsyncApp(AsyncSensorApplication):
+    def mqtt_make_client(self):
+        self.broker = Broker()
+        return self.broker.client()
+
+
 class SensorAppTestCase(unittest.TestCase):
     def test_single(self):
         host = os.getenv('MQTT_HOST', '::1')
         app = SimpleApp(host, 'mqtt', {}, None, None, True)
         app.run()
 
-        self.assertEqual(app.mock_event.call_count, 3)
\ No newline at end of file
+        self.assertEqual(app.mock_event.call_count, 3)
+
+    def test_simulated(self):
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, False)
+        app.init_events()
+        app.run()
+
+        self.assertEqual(app.mock_event.call_count, 3)
+        self.assertEqual(app.now, 10)
+
+    def test_simulated_halt(self):
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, False)
+        app.schedule_periodic(5, lambda current_time: app.publish('value', current_time))
+        app.event_schedule_offset(23, lambda current_time: app.broker.publish('mqtt/halt', b''))
+        app.run()
+
+        self.assertEqual(app.now, 23)
+        self.assertEqual(app.broker.last['mqtt/value'], b'20')
+
+    def test_simulated_binary_payload(self):
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, True)
+        app.event_schedule_offset(5, lambda current_time: app.broker.publish('mqtt/config', b'\xff\xfe'))
+        app.event_schedule_offset(6, app.bail)
+        with mock.patch('builtins.print'):
+            app.run()
+
+        # refused by the handler rather than raising in the client's callback
+        self.assertEqual(app.now, 6)
+        self.assertEqual(app.commands.stats()['config']['rejected'], 1)
+
+    def test_simulated_connect(self):
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, False)
+        app.schedule_periodic(5, lambda current_time: app.publish('value', current_time), run_now=True)
+        app.event_schedule_offset(12, app.bail)
+        app.run()
+
+        # connecting starts after the first reading and completes in wait(),
+        # which has the client read the CONNACK; the reading waits for it
+        self.assertTrue(app.mqtt_client.is_connected())
+        self.assertEqual(len(app.outbox), 0)
+        # three readings and the start up report
+        self.assertEqual(app.broker.messages, 4)
+        self.assertIn('mqtt/startup', app.broker.last)
+        self.assertEqual(app.broker.last['mqtt/value'], b'10')
+
+    def test_simulated_file_outbox(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.unlink, path)
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, False, outbox_path=path)
+
+        def offline(current_time):
+            app.mqtt_client.disconnect()
+            app.mqtt_send('mqtt/big', b'x' * app.OUTBOX_SLOT_SIZE)
+            app.mqtt_send('mqtt/small', b'1')
+
+        app.event_schedule_offset(5, offline)
+        app.event_schedule_offset(6, app.bail)
+        app.run()
+
+        # too large for a slot so counted rather than stored
+        self.assertEqual(app.outbox.stats()['oversized'], 1)
+        self.assertEqual(len(app.outbox), 1)
+        self.assertTrue(app.outbox._map.closed)
+
+    def test_simulated_query(self):
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, False, timeseries_path=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, app.timeseries.directory)
+        app.schedule_periodic(60, lambda current_time: app.publish('temperature', current_time / 60))
+        app.event_schedule_offset(300, lambda current_time: app.broker.publish(
+            'mqtt/query', b'{"metric": "temperature", "start": 60, "id": "q1"}'))
+        app.event_schedule_offset(300, lambda current_time: app.broker.publish(
+            'mqtt/query', b'{"metric": "temperature", "id": "q/#"}'))
+        app.event_schedule_offset(301, app.bail)
+        app.run()
+
+        # an id that isn't a single topic level is refused, not published under
+        self.assertEqual(app.commands.stats()['query'], {'calls': 2, 'rejected': 0, 'limited': 0})
+        self.assertEqual([topic for topic in app.broker.last if topic.startswith('mqtt/query/result')],
+                         ['mqtt/query/result/q1'])
+
+        # the query was scheduled first so runs before the reading due at 300
+        self.assertEqual(decode_points(app.broker.last['mqtt/query/result/q1']),
+                         [(60, 1.0), (120, 2.0), (180, 3.0), (240, 4.0)])
+
+    def test_simulated_qos(self):
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, False, mqtt_qos=1, mqtt_inflight=2)
+        app.schedule_periodic(5, lambda current_time: [app.publish('value', i) for i in range(3)])
+        app.event_schedule_offset(12, app.bail)
+        app.run()
+
+        # the third reading each time waits in the outbox for the window
+        self.assertEqual(app.broker.messages, 6)
+        self.assertEqual(app.inflight.stats()['sent'], 6)
+        self.assertEqual(app.inflight.acked, 4)
+
+    def test_simulated_qos_reconnect(self):
+        app = SimulatedApp('sim', 'mqtt', ['halt'], None, None, {}, False, mqtt_qos=1, mqtt_inflight=2)
+        # acknowledgements that never come
+        app.mqtt_client.latency = 1000
+        app.mqtt_client.clock = app.time
+        app.mqtt_client.sleep = app.sleep
+        app.schedule_periodic(5, lambda current_time: app.publish('value', current_time))
+        sent = []
+        app.event_schedule_offset(30, lambda current_time: (sent.append(app.broker.messages),
+                                                            app.mqtt_client.disconnect()))
+        app.event_schedule_offset(60, app.bail)
+        app.run()
+
+        # the full window stopped publishing until reconnecting emptied it
+        self.assertEqual(sent, [2])
+        self.assertEqual(app.inflight.resets, 1)
+        self.assertEqual(app.broker.messages, 4)
+        self.assertEqual(app.inflight.acked, 0)
+
+    def test_async_periodic(self):
+        app = AsyncApp('sim', 'mqtt', ['halt'], None, None, {}, False)
+        reads = []
+
+        async def read(current_time):
+            await asyncio.sleep(0)
+            reads.append(current_time)
+            app.should_bail = True
+            app._wake()
+
+        app.schedule_periodic(60, read, run_now=True)
+        app.run()
+
+        self.assertEqual(len(reads), 1)
+
+    def test_async_concurrent(self):
+        app = AsyncApp('sim', 'mqtt', ['halt'], None, None, {}, False)
+        done = []
+
+        async def slow(current_time):
+            await asyncio.sleep(0.2)
+            done.append('slow')
+            app.should_bail = True
+            app._wake()
+
+        async def fast(current_time):
+            await asyncio.sleep(0)
+            done.append('fast')
+
+        app.event_schedule_offset(0, slow)
+        app.event_schedule_offset(0, fast)
+        app.run()
+
+        # started as tasks so the slow conversion doesn't hold up the other
+        self.assertEqual(done, ['fast', 'slow'])
+        self.assertFalse(app._tasks)
+
+    def test_async_connect_deferred(self):
+        app = AsyncApp('sim', 'mqtt', ['halt'], None, None, {}, False)
+        app.mqtt_client.connect = mock.Mock(wraps=app.mqtt_client.connect)
+        # no asyncio loop for the socket callbacks yet
+        app.mqtt_connect()
+        app.mqtt_client.connect.assert_not_called()
+
+        def stop(current_time):
+            app.should_bail = True
+
+        app.event_schedule_offset(0, lambda current_time: app.publish('value', 1))
+        app.event_schedule_offset(1, stop)
+        app.run()
+
+        # connected after the first pass started the readings
+        app.mqtt_client.connect.assert_called_once_with('sim', 1883, 60)
+
+    def test_async_handler_error(self):
+        app = AsyncApp('sim', 'mqtt', ['halt'], None, None, {}, False)
+        reads = []
+
+        async def broken(current_time):
+            raise ValueError('no sensor')
+
+        async def read(current_time):
+            await asyncio.sleep(0.05)
+            reads.append(current_time)
+            app.should_bail = True
+            app._wake()
+
+        app.event_schedule_offset(0, broken)
+        app.event_schedule_offset(0, read)
+        with mock.patch.object(app, 'log') as log:
+            app.run()
+
+        # the failed task is logged and the loop carries on
+        self.assertEqual(len(reads), 1)
+        self.assertTrue(any('no sensor' in call.args[1] for call in log.call_args_list))
+
+    def test_async_executor(self):
+        app = AsyncApp('sim', 'mqtt', ['halt'], None, None, {}, False, executor_workers=1)
+        # only the finished job can end the wait, as nothing else is due
+        app.EXECUTOR_POLL = app.MAX_WAIT
+
+        def stop(current_time):
+            app.should_bail = True
+
+        @blocking()
+        def event_read(current_time):
+            time.sleep(0.05)
+            app.call_in_loop(stop, current_time)
+
+        app.event_schedule_offset(0, event_read)
+        start = time.monotonic()
+        with mock.patch.object(app.executor, 'shutdown', wraps=app.executor.shutdown) as shutdown:
+            app.run()
+
+        self.assertLess(time.monotonic() - start, 5)
+        shutdown.assert_called_once_with()
+        self.assertIn('event_read', app.stats.handlers)
+        self.assertIn('event_read@pool', app.stats.handlers)
+        self.assertGreater(app.stats.iteration.count, 0)
+        self.assertGreater(app.stats.lag.count, 0)
@@ -0,0 +1,62 @@
+import unittest
+
+from sensor_app.i2c_bus import I2CBus
+from sensor_app.si7021 import SI7021, crc8, ADDR, MEASURE_HUM, READ_TEMP_FROM_HUM
+
+
+class FakeSI7021Bus(I2CBus):
+    """Device that NACKs ``busy_polls`` reads before the humidity result is ready."""
+    def __init__(self, busy_polls=2):
+        super(FakeSI7021Bus, self).__init__()
+        self.busy_polls = busy_polls
+        self.log = []
+
+    def _transfer(self, address, write, read_length):
+        self.log.append((address, bytes(write), read_length))
+        if write == bytes([MEASURE_HUM]):
+            return b''
+        if write == bytes([READ_TEMP_FROM_HUM]):
+            return bytes([0x68, 0x3A])
+        if self.busy_polls:
+            self.busy_polls -= 1
+            raise OSError('NACK')
+        return bytes([0x7C, 0x80, crc8([0x7C, 0x80])])
+
+
+class CRCTestCase(unittest.TestCase):
+    def test_residue(self):
+        for data in ([0x00, 0x00], [0x68, 0x3A], [0xFF, 0xFE]):
+            self.assertEqual(crc8(data + [crc8(data)]), 0)
+
+    def test_check(self):
+        msg = bytes([0x68, 0x3A, crc8([0x68, 0x3A])])
+        self.assertEqual(SI7021._check(msg), 0x683A)
+        with self.assertRaises(OSError):
+            SI7021._check(msg[:2] + bytes([msg[2] ^ 1]))
+
+
+class ConversionTestCase(unittest.TestCase):
+    def test_convert(self):
+        self.assertAlmostEqual(SI7021.convert_temperature(0x683A), 24.7, places=1)
+        self.assertAlmostEqual(SI7021.convert_humidity(0x7C80), 54.8, places=1)
+
+
+class ReadTestCase(unittest.TestCase):
+    def test_read(self):
+        bus = FakeSI7021Bus()
+        sensor = SI7021(bus=bus)
+        temp, humidity = sensor.read()
+
+        self.assertAlmostEqual(temp, 24.7, places=1)
+        self.assertAlmostEqual(humidity, 54.8, places=1)
+        # start, two busy polls, result, temperature
+        self.assertEqual(len(bus.log), 5)
+        stats = bus.stats()[ADDR]
+        self.assertEqual(stats['transactions'], 5)
+        self.assertEqual(stats['errors'], 2)
+
+    def test_cache(self):
+        bus = FakeSI7021Bus(busy_polls=0)
+        sensor = SI7021(bus=bus, cache_ttl=60)
+        self.assertEqual(sensor.read(), sensor.read())
+        self.assertEqual(len(bus.log), 3)
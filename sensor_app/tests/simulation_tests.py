@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from sensor_app.simulation import Broker, ReplaySensor, SimulatedSensorApplication, TraceReplay, load_csv
+
+
+class TraceReplayTestCase(unittest.TestCase):
+    def test_read(self):
+        trace = TraceReplay(('temperature',), [100, 160, 220], [(20.0,), (21.0,), (22.0,)])
+
+        self.assertEqual(trace.read(100), (20.0,))
+        self.assertEqual(trace.read(219), (21.0,))
+        # repeats after the last sample's interval
+        self.assertEqual(trace.read(280), (20.0,))
+        self.assertEqual(trace.read(50), (22.0,))
+
+    def test_load_csv(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            f.write('humidity,time,temperature\n40,0,20.5\n41,60,21\n')
+        trace = load_csv(path, repeat=False)
+
+        self.assertEqual(trace.fields, ('humidity', 'temperature'))
+        self.assertEqual(trace.read(1000), (41.0, 21.0))
+
+        sensor = ReplaySensor(trace, lambda: 0, fields=('temperature', 'humidity'), offset=60)
+        self.assertEqual(sensor.read(), (21.0, 41.0))
+
+
+class SimulatedApplicationTestCase(unittest.TestCase):
+    def test_jumps_to_deadlines(self):
+        app = SimulatedSensorApplication({}, False, broker=Broker(keep=True), start_time=1000)
+        app.schedule_periodic(3600, lambda current_time: app.publish('value', current_time // 3600))
+        app.run_until(1000 + 24 * 3600)
+
+        self.assertEqual(app.now, 1000 + 24 * 3600)
+        # the first pass, then one per slot rather than one per MAX_WAIT
+        self.assertEqual(app.stats.iteration.count, 25)
+        self.assertEqual(app.broker.messages, 24)
+        self.assertEqual(app.broker.log[0], ('sim/value', b'1'))
+
+    def test_halt(self):
+        broker = Broker()
+        app = SimulatedSensorApplication({}, False, broker=broker)
+        app.event_schedule_offset(50, lambda current_time: broker.publish('sim/halt', b''))
+        app.event_schedule_offset(100, lambda current_time: app.publish('late', 1))
+        app.run_until(1000)
+
+        self.assertEqual(app.now, 50)
+        self.assertNotIn('sim/late', broker.last)
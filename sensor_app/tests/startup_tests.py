@@ -0,0 +1,35 @@
+import json
+import unittest
+
+from sensor_app.simulation import SimulatedSensorApplication
+from sensor_app.startup import StartupTimer
+
+
+class StartupTimerTestCase(unittest.TestCase):
+    def test_report_once(self):
+        timer = StartupTimer()
+        timer.mark('init')
+        first = timer.stages['init']
+        timer.mark('init')
+        self.assertEqual(timer.stages['init'], first)
+        self.assertIsNone(timer.report())
+
+        timer.mark('first_publish')
+        self.assertEqual(sorted(timer.report()), ['first_publish', 'init'])
+        self.assertTrue(timer.reported)
+        self.assertIsNone(timer.report())
+
+    def test_app_report(self):
+        app = SimulatedSensorApplication({}, False)
+        app.startup.mark('first_publish')
+        report = json.loads(app.startup_report(0))
+
+        self.assertEqual(sorted(report), ['first_publish', 'init'])
+        self.assertIsNone(app.startup_report(0))
+
+    def test_deadbands_follow_clock(self):
+        app = SimulatedSensorApplication({}, False, deadbands={'temperature': {'heartbeat': 60}})
+        app.publisher.add('temperature', 20, 10)
+        app.publisher.shift_time(1000)
+
+        self.assertEqual(app.publisher.deadbands['temperature'].last_time, 1010)
@@ -0,0 +1,54 @@
+import unittest
+
+from sensor_app.sensor_app_base import SensorApplication
+from sensor_app.stats import Histogram
+
+
+class FakeClockApp(SensorApplication):
+    def __init__(self, *args, **kwargs):
+        super(FakeClockApp, self).__init__(*args, **kwargs)
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def localtime(self, timeval):
+        return timeval
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram((10, 100))
+        for value in (5, 10, 11, 500, -3):
+            histogram.record(value)
+
+        self.assertEqual(histogram.counts, [3, 1, 1])
+        self.assertEqual(histogram.max, 500)
+        self.assertEqual(histogram.as_dict()['mean_us'], 526 // 5)
+
+        histogram.reset()
+        self.assertEqual(histogram.counts, [0, 0, 0])
+        self.assertEqual(histogram.count, 0)
+
+
+class LoopStatsTestCase(unittest.TestCase):
+    def test_loop_records(self):
+        app = FakeClockApp({}, False)
+
+        def event_slow(current_time):
+            app.now += 0.5
+
+        app.event_schedule_dtime(0, event_slow)
+        app.event_schedule_dtime(10, event_slow)
+        app.now = 2
+        app.loop()
+
+        stats = app.stats.as_dict()
+        self.assertEqual(stats['handlers']['event_slow']['count'], 1)
+        self.assertEqual(stats['handlers']['event_slow']['max_us'], 500000)
+        self.assertEqual(stats['lag']['max_us'], 2000000)
+        self.assertEqual(stats['iteration']['count'], 1)
+        self.assertEqual(stats['queue_depth'], 1)
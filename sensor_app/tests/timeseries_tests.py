@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sensor_app.timeseries import RingSeries, TimeSeriesStore, decode_points
+
+
+class RingSeriesTestCase(unittest.TestCase):
+    def test_wraps(self):
+        series = RingSeries(4)
+        for t in range(6):
+            series.append(t * 10, t / 2)
+
+        self.assertEqual(len(series), 4)
+        self.assertEqual(series.last(), (50, 2.5))
+        self.assertEqual(series.range(0, 1000), [(20, 1.0), (30, 1.5), (40, 2.0), (50, 2.5)])
+        self.assertEqual(series.range(25, 45), [(30, 1.5), (40, 2.0)])
+        self.assertEqual(series.range(25, 1000, limit=1), [(30, 1.5)])
+
+    def test_persists(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'temperature.ts')
+        series = RingSeries(3, path)
+        for t in range(5):
+            series.append(t, t)
+        series.close()
+
+        series = RingSeries(3, path)
+        self.assertEqual(series.range(0, 10), [(2, 2.0), (3, 3.0), (4, 4.0)])
+        series.close()
+
+
+class TimeSeriesStoreTestCase(unittest.TestCase):
+    def test_rollups(self):
+        store = TimeSeriesStore(capacity=1000, tiers=((60, 200), (3600, 10)))
+        for t in range(0, 7200, 10):
+            store.add('temperature', t, 20 + (t // 60) % 2)
+        store.add('status', 0, b'ok')
+
+        minutes = store.query('temperature', 0, 7200, resolution=60)
+        self.assertEqual(minutes[:3], [(0, 20.0), (60, 21.0), (120, 20.0)])
+        # the last minute and hour are still in progress
+        self.assertEqual(len(minutes), 119)
+        self.assertEqual(store.query('temperature', 0, 7200, resolution=600), [(0, 20.5)])
+        self.assertEqual(len(store.query('temperature', 3600, 3700)), 10)
+        self.assertEqual(store.query('status', 0, 10), [])
+
+    def test_handle_query(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = TimeSeriesStore(directory, capacity=100, tiers=())
+        for t in range(5):
+            store.add('sensor/temperature', 1000 + t * 60, 20 + t)
+        store.close()
+
+        # a new store reopens the files
+        store = TimeSeriesStore(directory, capacity=100, tiers=())
+        query = {'metric': 'sensor/temperature', 'start': 1060, 'end': 1180, 'id': 7}
+        query_id, result = store.handle_query(json.dumps(query).encode('utf-8'))
+
+        self.assertEqual(query_id, 7)
+        self.assertEqual(decode_points(result), [(1060, 21.0), (1120, 22.0)])
+        self.assertRaises(ValueError, store.handle_query, b'{"start": 0}')
+        self.assertRaises(ValueError, store.handle_query, b'not json')
+        for query in ({'metric': 5}, {'metric': None}, {'metric': ['sensor/temperature']},
+                      {'metric': 'sensor/temperature', 'start': '1060'},
+                      {'metric': 'sensor/temperature', 'resolution': True}, [1], None,
+                      {'metric': 'sensor/temperature', 'id': 'a/b'},
+                      {'metric': 'sensor/temperature', 'id': '#'},
+                      {'metric': 'sensor/temperature', 'id': 'q+1'},
+                      {'metric': 'sensor/temperature', 'id': ''},
+                      {'metric': 'sensor/temperature', 'id': 1.5}):
+            self.assertRaises(ValueError, store.handle_query, json.dumps(query).encode('utf-8'))
+        store.close()
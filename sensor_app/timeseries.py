@@ -0,0 +1,269 @@
+"""Local time-series store for recent readings, with downsampled rollups."""
+import bisect
+import json
+import os
+import struct
+
+MAGIC = b'STS1'
+HEADER = '<4sIII'
+HEADER_SIZE = 16
+# query results: start time and point count, then uint32 second offsets and float32 values
+RESULT_HEADER = '<dI'
+RESULT_HEADER_SIZE = struct.calcsize(RESULT_HEADER)
+MAX_POINTS = 10000
+
+DEFAULT_CAPACITY = 100000 # raw points per metric
+DEFAULT_TIERS = (
+    (60, 10080), # one minute means for a week
+    (3600, 8760), # one hour means for a year
+)
+
+
+class RingSeries:
+    """
+        Fixed capacity ring of ``(timestamp, value)`` points.
+
+        Stored column-wise, float64 timestamps then float32 values, after a
+        small header holding the ring position. With ``path`` the columns are
+        memory-mapped from that file so the history survives a restart,
+        otherwise they are held in memory. Points must be appended in time
+        order.
+    """
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        self.path = path
+        size = HEADER_SIZE + capacity * 12
+        self._map = None
+        fresh = True
+        if path is None:
+            buf = bytearray(size)
+        else:
+            import mmap
+
+            fd = os.open(path, os.O_RDWR | os.O_CREAT)
+            try:
+                fresh = os.fstat(fd).st_size != size
+                if fresh:
+                    os.ftruncate(fd, size)
+                self._map = buf = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        self._view = memoryview(buf)
+        self._header = self._view[:HEADER_SIZE]
+        self._times = self._view[HEADER_SIZE:HEADER_SIZE + capacity * 8].cast('d')
+        self._values = self._view[HEADER_SIZE + capacity * 8:].cast('f')
+
+        magic, file_capacity, head, count = struct.unpack_from(HEADER, self._header, 0)
+        if fresh or magic != MAGIC or file_capacity != capacity:
+            head, count = 0, 0
+        self._set_position(head, count)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        """Timestamp of the ``index``-th oldest point, for bisecting."""
+        return self._times[(self._head + index) % self.capacity]
+
+    def _set_position(self, head, count):
+        self._head = head
+        self._count = count
+        struct.pack_into(HEADER, self._header, 0, MAGIC, self.capacity, head, count)
+
+    def append(self, timestamp, value):
+        """Add a point, overwriting the oldest once full."""
+        if self._count == self.capacity:
+            index = self._head
+            self._set_position((self._head + 1) % self.capacity, self._count)
+        else:
+            index = (self._head + self._count) % self.capacity
+            self._set_position(self._head, self._count + 1)
+        self._times[index] = timestamp
+        self._values[index] = value
+
+    def last(self):
+        """The newest point, None if empty."""
+        if not self._count:
+            return None
+        index = (self._head + self._count - 1) % self.capacity
+        return self._times[index], self._values[index]
+
+    def range(self, start, end, limit=None):
+        """Points with ``start <= timestamp < end``, oldest first, at most ``limit``."""
+        first = bisect.bisect_left(self, start, 0, self._count)
+        stop = bisect.bisect_left(self, end, first, self._count)
+        if limit is not None:
+            stop = min(stop, first + limit)
+        points = []
+        for i in range(first, stop):
+            index = (self._head + i) % self.capacity
+            points.append((self._times[index], self._values[index]))
+        return points
+
+    def close(self):
+        self._times.release()
+        self._values.release()
+        self._header.release()
+        self._view.release()
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+
+
+class Rollup:
+    """
+        Mean of the points in each ``interval`` seconds, written to ``series``
+        as each interval completes. The interval in progress is only held in
+        memory.
+    """
+    def __init__(self, interval, series):
+        self.interval = interval
+        self.series = series
+        self._bucket = None
+        self._total = 0.0
+        self._count = 0
+
+    def add(self, timestamp, value):
+        bucket = timestamp // self.interval * self.interval
+        if bucket != self._bucket:
+            if self._count:
+                self.series.append(self._bucket, self._total / self._count)
+            self._bucket = bucket
+            self._total = 0.0
+            self._count = 0
+        self._total += value
+        self._count += 1
+
+
+class Metric:
+    """Raw points for one metric plus its rollup tiers. ``path(suffix)`` names the files."""
+    def __init__(self, name, path, capacity, tiers):
+        self.name = name
+        self.raw = RingSeries(capacity, path('raw'))
+        self.rollups = [Rollup(interval, RingSeries(size, path(interval))) for interval, size in tiers]
+
+    def add(self, timestamp, value):
+        self.raw.append(timestamp, value)
+        for rollup in self.rollups:
+            rollup.add(timestamp, value)
+
+    def series(self, resolution=0):
+        """The finest series whose interval is at least ``resolution`` seconds."""
+        if resolution <= 0 or not self.rollups:
+            return self.raw
+        for rollup in self.rollups:
+            if rollup.interval >= resolution:
+                return rollup.series
+        return self.rollups[-1].series
+
+    def close(self):
+        self.raw.close()
+        for rollup in self.rollups:
+            rollup.series.close()
+
+
+class TimeSeriesStore:
+    """
+        Ring files of recent readings per metric, kept in ``directory``.
+
+        Each metric keeps ``capacity`` raw points and a rollup series for each
+        ``(interval, size)`` in ``tiers``, updated as points are added. Pass
+        ``directory=None`` to keep everything in memory.
+    """
+    def __init__(self, directory=None, capacity=DEFAULT_CAPACITY, tiers=DEFAULT_TIERS):
+        self.directory = directory
+        self.capacity = capacity
+        self.tiers = tiers
+        self.metrics = {}
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, name, suffix):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, '{0}.{1}.ts'.format(name.replace('/', '_'), suffix))
+
+    def metric(self, name):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = Metric(name, lambda suffix: self._path(name, suffix), self.capacity, self.tiers)
+            self.metrics[name] = metric
+        return metric
+
+    def add(self, name, timestamp, value):
+        """Record a numeric reading. Other values are ignored."""
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        self.metric(name).add(timestamp, value)
+
+    def query(self, name, start, end, resolution=0, limit=MAX_POINTS):
+        """Points of ``name`` in ``[start, end)`` at ``resolution`` seconds or coarser."""
+        if name not in self.metrics:
+            # reopen a metric recorded before a restart
+            path = self._path(name, 'raw')
+            if path is None or not os.path.exists(path):
+                return []
+        return self.metric(name).series(resolution).range(start, end, limit)
+
+    def handle_query(self, payload):
+        """
+            Answer a JSON query such as ``{"metric": "temperature", "start": 0,
+            "end": 1e10, "resolution": 60, "id": "abc"}``.
+
+            Returns ``(id, result)``, the result encoded by ``encode_points``.
+            The id becomes a topic level, so it must be an integer or a
+            non-empty string without ``/``, ``+`` or ``#``. Raises ValueError
+            for a malformed query.
+        """
+        request = json.loads(payload)
+        if not isinstance(request, dict):
+            raise ValueError('Bad query: expected an object')
+        name = request.get('metric')
+        if not isinstance(name, str) or not name:
+            raise ValueError('Bad query: metric: expected a name, got {0!r}'.format(name))
+        start = _query_number(request, 'start', 0)
+        end = _query_number(request, 'end', float('inf'))
+        resolution = _query_number(request, 'resolution', 0)
+        return _query_id(request), encode_points(self.query(name, start, end, resolution))
+
+    def close(self):
+        for metric in self.metrics.values():
+            metric.close()
+
+
+def _query_number(request, key, default):
+    value = request.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('Bad query: {0}: expected a number, got {1!r}'.format(key, value))
+    return float(value)
+
+
+def _query_id(request):
+    value = request.get('id')
+    if value is None or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    if not isinstance(value, str) or not value or '/' in value or '+' in value or '#' in value:
+        raise ValueError('Bad query: id: expected an integer or a topic level, got {0!r}'.format(value))
+    return value
+
+
+def encode_points(points):
+    """
+        Pack ``(timestamp, value)`` points as a start time and count, then a
+        uint32 whole second offset from the start per point, then a float32
+        value per point.
+    """
+    start = points[0][0] if points else 0.0
+    count = len(points)
+    return (struct.pack(RESULT_HEADER, start, count) +
+            struct.pack('<{0}I'.format(count), *[int(round(t - start)) for t, v in points]) +
+            struct.pack('<{0}f'.format(count), *[v for t, v in points]))
+
+
+def decode_points(payload):
+    """Inverse of ``encode_points``, to the second."""
+    start, count = struct.unpack_from(RESULT_HEADER, payload, 0)
+    offsets = struct.unpack_from('<{0}I'.format(count), payload, RESULT_HEADER_SIZE)
+    values = struct.unpack_from('<{0}f'.format(count), payload, RESULT_HEADER_SIZE + 4 * count)
+    return [(start + offset, value) for offset, value in zip(offsets, values)]
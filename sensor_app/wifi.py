@@ -0,0 +1,170 @@
+"""WiFi station bring-up for MicroPython boards."""
+try:
+    import binascii
+except ImportError:
+    import ubinascii as binascii
+try:
+    import json
+except ImportError:
+    import ujson as json
+try:
+    import os
+except ImportError:
+    import uos as os
+
+import network
+import utime
+
+
+class WifiStation:
+    """
+        Connects the WiFi station interface without blocking the loop.
+
+        ``begin`` starts connecting and ``poll`` reports how it is going, so
+        sensors can be read while the radio associates; ``connect`` does both
+        and waits. With ``cache_path`` set, the address leased on the first
+        connection is kept in that JSON file, and later connections set it
+        statically, skipping DHCP. Scanning for the access point blocks for
+        a second or more, so it isn't done while connecting; ``scan`` is
+        left to the caller to run while idle, after which connections pin
+        the access point's BSSID, skipping the SDK's own scan for it. If a
+        cached connection fails the cache is dropped with ``forget`` and the
+        next attempt starts from scratch.
+    """
+    CONNECT_TIMEOUT = 15 # seconds
+
+    def __init__(self, ssid, password, cache_path=None):
+        self.sta_if = network.WLAN(network.STA_IF)
+        self.ssid = ssid
+        self.password = password
+        self.cache_path = cache_path
+        self.cache = self.load()
+        self.connecting = False
+        self.cached = False
+        self._started = 0
+        self.connects = 0
+        self.failures = 0
+
+    def load(self):
+        """The cached connection settings, None if there are none."""
+        if self.cache_path is None:
+            return None
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            return cache if 'ifconfig' in cache else None
+        except (OSError, ValueError):
+            return None
+
+    def forget(self):
+        """Drop the cached settings, going back to scanning and DHCP."""
+        if self.cache is None:
+            return
+        self.cache = None
+        try:
+            os.remove(self.cache_path)
+        except OSError:
+            pass
+        try:
+            self.sta_if.ipconfig(dhcp4=True)
+        except AttributeError:
+            # ports before WLAN.ipconfig keep the static address until reset
+            pass
+
+    def _save(self):
+        try:
+            with open(self.cache_path, 'w') as f:
+                json.dump(self.cache, f)
+        except OSError:
+            pass
+
+    def _remember(self):
+        if self.cache_path is None or self.cached:
+            return
+        self.cache = {'ifconfig': list(self.sta_if.ifconfig())}
+        self._save()
+
+    def scan_pending(self):
+        """Whether connected with an address cached but not the access point, which ``scan`` finds."""
+        return (self.cache is not None and 'bssid' not in self.cache and
+                self.sta_if.status() == network.STAT_GOT_IP)
+
+    def scan(self):
+        """
+            Find the strongest access point for the network and cache it for
+            the next connection. Blocks while scanning. Returns whether found.
+        """
+        best = None
+        for ssid, bssid, channel, rssi, authmode, hidden in self.sta_if.scan():
+            if ssid == bytes(self.ssid, 'utf-8') and (best is None or rssi > best[0]):
+                best = (rssi, bssid, channel)
+        if best is None or self.cache is None:
+            return False
+        self.cache['bssid'] = binascii.hexlify(best[1]).decode()
+        # connect() can't be given the channel but it's useful to see
+        self.cache['channel'] = best[2]
+        self._save()
+        return True
+
+    def begin(self):
+        """Start connecting unless already connected or connecting. Returns True if connected."""
+        sta_if = self.sta_if
+        status = sta_if.status()
+        if status == network.STAT_GOT_IP:
+            return True
+        if self.connecting:
+            return False
+        self.connecting = True
+        self._started = utime.ticks_ms()
+        if status == network.STAT_CONNECTING:
+            # the SDK reconnecting to the last access point by itself at boot
+            self.cached = False
+            return False
+        sta_if.active(True)
+        self.cached = self.cache is not None
+        if not self.cached:
+            sta_if.connect(self.ssid, self.password)
+            return False
+        sta_if.ifconfig(tuple(self.cache['ifconfig']))
+        if 'bssid' in self.cache:
+            sta_if.connect(self.ssid, self.password, bssid=binascii.unhexlify(self.cache['bssid']))
+        else:
+            sta_if.connect(self.ssid, self.password)
+        return False
+
+    def poll(self):
+        """True once connected, False if not connecting or the attempt failed, None while connecting."""
+        status = self.sta_if.status()
+        if status == network.STAT_GOT_IP:
+            if self.connecting:
+                self.connecting = False
+                self.connects += 1
+                self._remember()
+            return True
+        if not self.connecting:
+            return False
+        if (status in (network.STAT_IDLE, network.STAT_CONNECTING) and
+                utime.ticks_diff(utime.ticks_ms(), self._started) < self.CONNECT_TIMEOUT * 1000):
+            return None
+        self.connecting = False
+        self.failures += 1
+        if self.cached:
+            self.forget()
+        return False
+
+    def connect(self, poll_ms=10):
+        """Connect, waiting until done. Returns whether connected."""
+        if self.begin():
+            return True
+        while True:
+            result = self.poll()
+            if result is not None:
+                return result
+            utime.sleep_ms(poll_ms)
+
+    def disconnect(self):
+        """Drop the connection and turn the radio off."""
+        self.connecting = False
+        self.sta_if.disconnect()
+        self.sta_if.active(False)
+